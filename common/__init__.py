@@ -5,5 +5,7 @@ Common modules used by both the base station and the Raspberry Pi.
 
 - `exceptions` defines exceptions used by Yozakura.
 - `functions` provides functions and decorators used throughout Yozakura.
+- `networking` defines the messages sent between the base station and the
+  Raspberry Pi.
 
 """
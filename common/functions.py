@@ -10,6 +10,7 @@ import logging
 import re
 import signal
 import subprocess
+import threading
 
 from common.exceptions import UnknownIPError, YozakuraTimeoutError
 
@@ -59,6 +60,9 @@ def interrupted(duration, exception=YozakuraTimeoutError, error_message=None):
     alloted time limit, the result is returned. Otherwise, an interrupt is
     triggered, which raises the specified exception.
 
+    The interrupt uses SIGALRM, which can only be handled in the main thread.
+    In other threads, the function runs without a time limit.
+
     Parameters
     ----------
     duration : float
@@ -105,6 +109,9 @@ def interrupted(duration, exception=YozakuraTimeoutError, error_message=None):
     def interrupt_decorator(func):
         @wraps(func)
         def func_wrapper(*args, **kwargs):
+            if threading.current_thread() is not threading.main_thread():
+                return func(*args, **kwargs)
+
             signal.signal(signal.SIGALRM, sigalrm_handler)
             try:
                 signal.setitimer(signal.ITIMER_REAL, duration, 0)
@@ -0,0 +1,1171 @@
+# (C) 2015  Kyoto University Mechatronics Laboratory
+# Released under the GNU General Public License, version 3
+"""
+Wire formats shared by the base station and the Raspberry Pi.
+
+Every message which is sent on each control cycle has a fixed binary layout,
+defined here once so that `opstn.server` and `rpi.client` cannot disagree
+about it. Fixed layouts keep the payload small and predictable, and decoding
+them on the Raspberry Pi takes a constant amount of time, unlike unpickling.
+
+All layouts are little endian, and are built with `struct`, which is also
+available on the Python 2 based ROS software. Since the Raspberry Pi encodes
+a telemetry record on every cycle, each field of the record is only packed
+again when its reading changes.
+
+Command frame
+-------------
+Sent by the base station in reply to a ``commands`` request.
+
+======== ========= ====================================================
+Field    Type      Description
+======== ========= ====================================================
+version  uint8     `COMMAND_FRAME_VERSION`.
+seq      uint32    Sequence number, incremented for each frame sent.
+time     float64   Time at which the frame was generated (Unix time).
+motors   4 float32 Left wheel, right wheel, left flipper, right flipper.
+arm      4 int8    Mode, linear, pitch, and yaw.
+======== ========= ====================================================
+
+Telemetry datagram
+------------------
+Sent by the Raspberry Pi to the base station over UDP on each cycle. Each
+datagram starts with a header:
+
+======== ======= ========================================================
+Field    Type    Description
+======== ======= ========================================================
+version  uint8   `TELEMETRY_VERSION`.
+flags    uint8   `TELEMETRY_KEYFRAME` if the datagram is a keyframe, and
+                 `TELEMETRY_BATCH` if it carries a batch of samples.
+keyframe uint16  The ID of the keyframe the datagram is or refers to.
+mask     uint16  Bit `i` is set if field `i` of the record is included.
+seq      uint32  Sequence number, incremented for each datagram sent.
+time     float64 Time at which the datagram was sent (monotonic clock).
+======== ======= ========================================================
+
+It is followed by the fields of the telemetry record which are included, in
+order. The record layout is given by `TELEMETRY_FIELDS`. See
+`TelemetryEncoder` for how fields are chosen.
+
+The arm data is quantized to int16 fixed point, with the scale given in
+`TELEMETRY_SCALES`: a value `x` is sent as ``round(x * scale)``. Other values
+are float32. Missing readings are sent as NaN, or as `QUANTIZED_MISSING` if
+quantized.
+
+============= ========== ===================================================
+Field         Type       Description
+============= ========== ===================================================
+flippers      2 float32  Left and right flipper positions.
+currents      8 float32  Current (A) and voltage (V) of each current sensor.
+poses         6 float32  Roll, pitch, and yaw of the front and rear IMUs.
+arm_positions 3 int16    Positions of the linear, pitch, and yaw servos, in
+                         tenths of a degree.
+servo_vii     3 int16    Linear servo voltage, pitch and yaw servo currents,
+                         in tenths of a volt or milliampere.
+thermo        32 int16   Left then right 4x4 temperature matrices, in tenths
+                         of a degree Celsius.
+co2           1 int16    |CO2| reading in PPM.
+loop_timing   4 float32  Duration and slack of the last control loop cycle
+                         (s), and the numbers of overruns and missed
+                         deadlines.
+stage_times   16 int16   Median and 99th percentile duration of each stage
+                         of the control loop in `LOOP_STAGES`, in units of
+                         10 microseconds.
+baud_rates    2 float32  Baud rates of the serial links to the body and arm
+                         mbeds.
+============= ========== ===================================================
+
+If `TELEMETRY_BATCH` is set, the record is followed by a uint8 sample count
+and that many samples, oldest first. Samples are taken faster than datagrams
+are sent, and are queued in a `SampleRing` until they are sent. The sample
+layout is given by `SAMPLE_FIELDS`.
+
+========= ========= =========================================================
+Field     Type      Description
+========= ========= =========================================================
+timestamp float64   Time at which the sample was taken (monotonic clock).
+currents  8 float32 Current (A) and voltage (V) of each current sensor.
+poses     6 float32 Roll, pitch, and yaw of the front and rear IMUs.
+========= ========= =========================================================
+
+Framed streams
+--------------
+TCP does not preserve message boundaries: one ``recv`` can return part of a
+message, or several messages at once. Messages sent over the TCP connection
+are therefore prefixed with their length as a uint16, and read back with a
+`FramedStream`.
+
+.. |CO2| replace:: CO\ :sub:`2`
+
+"""
+from collections import namedtuple
+from itertools import accumulate, chain
+import select
+import struct
+import threading
+import time
+
+import numpy as np
+
+from common.exceptions import BadDataError
+
+
+COMMAND_FRAME_VERSION = 1
+
+_command_frame = struct.Struct("<BId4f4b")
+COMMAND_FRAME_SIZE = _command_frame.size
+
+CommandFrame = namedtuple("CommandFrame",
+                          "seq timestamp motor_commands arm_commands")
+
+TELEMETRY_VERSION = 8
+TELEMETRY_KEYFRAME = 0x01
+TELEMETRY_BATCH = 0x02
+
+# The largest UDP payload which fits in an Ethernet frame.
+TELEMETRY_MAX_SIZE = 1472
+
+# (name, struct format character, count)
+TELEMETRY_FIELDS = (("flippers", "f", 2),
+                    ("currents", "f", 8),
+                    ("poses", "f", 6),
+                    ("arm_positions", "h", 3),
+                    ("servo_vii", "h", 3),
+                    ("thermo", "h", 32),
+                    ("co2", "h", 1),
+                    ("loop_timing", "f", 4),
+                    ("stage_times", "h", 16),
+                    ("baud_rates", "f", 2))
+
+# The stages of the control loop which are profiled, in order.
+LOOP_STAGES = ("commands", "flippers", "motors", "arm", "currents", "imus",
+               "arm_data", "send")
+
+# Fixed-point scale of each quantized field. The CO2 sensor reads up to 5400
+# PPM, which does not fit in an int16 at a finer scale.
+TELEMETRY_SCALES = {"arm_positions": 10,
+                    "servo_vii": 10,
+                    "thermo": 10,
+                    "co2": 1,
+                    "stage_times": 100000}
+QUANTIZED_MISSING = -0x8000
+_QUANTIZED_MAX = 0x7FFF
+
+_telemetry_header = struct.Struct("<BBHHId")
+TelemetryHeader = namedtuple("TelemetryHeader",
+                             "version flags keyframe mask seq timestamp")
+_telemetry_record = struct.Struct("<" + "".join("{n}{fmt}".format(n=n, fmt=fmt)
+                                  for _, fmt, n in TELEMETRY_FIELDS))
+TELEMETRY_RECORD_SIZE = _telemetry_record.size
+
+# (mask bit, start, end) of each field in the record.
+_field_sizes = [struct.calcsize("<{n}{fmt}".format(n=n, fmt=fmt))
+                for _, fmt, n in TELEMETRY_FIELDS]
+_field_slices = [(1 << i, end - size, end) for i, (size, end)
+                 in enumerate(zip(_field_sizes, accumulate(_field_sizes)))]
+_ALL_FIELDS = (1 << len(TELEMETRY_FIELDS)) - 1
+
+# The encoder packs each field with a struct of its own, and only when its
+# input changes. (mask bit, start, end, struct, scale, nested) of each field,
+# where the scale is None for float32 fields, and nested fields are given as
+# lists of rows.
+_NESTED_FIELDS = ("currents", "poses", "thermo")
+_field_packers = [(bit, start, end,
+                   struct.Struct("<{n}{fmt}".format(n=n, fmt=fmt)),
+                   TELEMETRY_SCALES.get(name), name in _NESTED_FIELDS)
+                  for (name, fmt, n), (bit, start, end)
+                  in zip(TELEMETRY_FIELDS, _field_slices)]
+
+# The flippers, currents, and poses change on almost every cycle, so they are
+# compared and packed together.
+_MOTION_FIELDS = 3
+_motion = struct.Struct("<{n}f".format(
+    n=sum(n for _, _, n in TELEMETRY_FIELDS[:_MOTION_FIELDS])))
+_MOTION_BITS = (1 << _MOTION_FIELDS) - 1
+
+# (name, struct format character, count)
+SAMPLE_FIELDS = (("timestamp", "d", 1),
+                 ("currents", "f", 8),
+                 ("poses", "f", 6))
+
+_sample = struct.Struct("<" + "".join("{n}{fmt}".format(n=n, fmt=fmt)
+                        for _, fmt, n in SAMPLE_FIELDS))
+SAMPLE_SIZE = _sample.size
+_sample_count = struct.Struct("<B")
+_MAX_SAMPLES = 0xFF
+
+_NAN = float("nan")
+_NO_LOOP_TIMING = (None,) * 4
+_NO_STAGE_TIMES = (None,) * 2 * len(LOOP_STAGES)
+_NO_BAUD_RATES = (None,) * 2
+
+_length_prefix = struct.Struct("<H")
+LENGTH_PREFIX_SIZE = _length_prefix.size
+
+
+def encode_commands(motor_commands, arm_commands, seq, timestamp=None):
+    """
+    Pack motor and arm commands into a command frame.
+
+    Parameters
+    ----------
+    motor_commands : 4-list of float
+        The speeds requested of each motor, between -1 and 1.
+    arm_commands : 4-tuple of int
+        The mode, linear, pitch, and yaw commands for the arm.
+    seq : int
+        The sequence number of the frame. It wraps around at 2**32.
+    timestamp : float, optional
+        The time at which the commands were generated. Defaults to now.
+
+    Returns
+    -------
+    bytes
+        The encoded frame, `COMMAND_FRAME_SIZE` bytes long.
+
+    Examples
+    --------
+    >>> frame = encode_commands([0.5, 0.5, 0, 0], (0, 1, 0, -1), seq=3,
+    ...                         timestamp=0)
+    >>> len(frame) == COMMAND_FRAME_SIZE
+    True
+    >>> decode_commands(frame).motor_commands
+    [0.5, 0.5, 0.0, 0.0]
+    >>> decode_commands(frame).arm_commands
+    (0, 1, 0, -1)
+
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    values = tuple(motor_commands) + tuple(arm_commands)
+    return _command_frame.pack(COMMAND_FRAME_VERSION, seq & 0xFFFFFFFF,
+                               timestamp, *values)
+
+
+def decode_commands(data):
+    """
+    Unpack a command frame.
+
+    Parameters
+    ----------
+    data : bytes-like
+        The received frame.
+
+    Returns
+    -------
+    CommandFrame
+        A namedtuple containing `seq`, `timestamp`, `motor_commands` (a list,
+        so that it can be modified in place), and `arm_commands`.
+
+    Raises
+    ------
+    BadDataError
+        The frame has the wrong length or version.
+
+    """
+    if len(data) != COMMAND_FRAME_SIZE:
+        raise BadDataError("Command frame has {n} bytes instead of {size}"
+                           .format(n=len(data), size=COMMAND_FRAME_SIZE))
+
+    (version, seq, timestamp, lwheel, rwheel, lflipper, rflipper,
+     mode, linear, pitch, yaw) = _command_frame.unpack(data)
+    if version != COMMAND_FRAME_VERSION:
+        raise BadDataError("Unsupported command frame version: {v}"
+                           .format(v=version))
+
+    return CommandFrame(seq, timestamp,
+                        [lwheel, rwheel, lflipper, rflipper],
+                        (mode, linear, pitch, yaw))
+
+
+def quantize(value, scale):
+    """
+    Convert a value to int16 fixed point.
+
+    Parameters
+    ----------
+    value : float
+        The value to be converted. None and NaN mean that it is missing.
+    scale : int
+        The number of steps per unit.
+
+    Returns
+    -------
+    int
+        The rounded, scaled value, saturated to the int16 range. Missing
+        values are returned as `QUANTIZED_MISSING`.
+
+    Examples
+    --------
+    >>> quantize(21.46, 10)
+    215
+    >>> quantize(None, 10) == QUANTIZED_MISSING
+    True
+
+    """
+    if value is None or value != value:  # NaN is not equal to itself.
+        return QUANTIZED_MISSING
+    return max(-_QUANTIZED_MAX, min(_QUANTIZED_MAX, int(round(value * scale))))
+
+
+def quantize_array(values, scales):
+    """
+    Convert an array of values to int16 fixed point.
+
+    This is the vectorized form of `quantize`, and gives the same results.
+
+    Parameters
+    ----------
+    values : ndarray of float
+        The values to be converted. NaN means that a value is missing.
+    scales : float or ndarray of float
+        The number of steps per unit of each value.
+
+    Returns
+    -------
+    ndarray of int16
+        The rounded, scaled values, saturated to the int16 range. Missing
+        values are returned as `QUANTIZED_MISSING`.
+
+    Examples
+    --------
+    >>> quantize_array(np.array([21.46, np.nan, 5000]), 10).tolist()
+    [215, -32768, 32767]
+
+    """
+    scaled = np.multiply(values, scales)
+    np.rint(scaled, out=scaled)  # Rounds half to even, like round.
+    np.minimum(scaled, _QUANTIZED_MAX, out=scaled)
+    np.maximum(scaled, -_QUANTIZED_MAX, out=scaled)
+    scaled[np.isnan(scaled)] = QUANTIZED_MISSING
+    return scaled.astype(np.int16)
+
+
+def _pack_field(packer, scale, nested, record, offset, value):
+    """
+    Pack the input of a telemetry field into the record.
+
+    Values are packed as they are whenever possible, and only go through
+    `quantize_array` if one is missing or out of range.
+
+    Parameters
+    ----------
+    packer : struct.Struct
+        The layout of the field.
+    scale : int
+        The number of steps per unit of a quantized field, or None if the
+        field is float32.
+    nested : bool
+        Whether the input is a list of rows of values.
+    record : bytearray
+        The record.
+    offset : int
+        The position of the field in the record.
+    value : sequence
+        The input of the field.
+
+    """
+    values = chain.from_iterable(value) if nested else value
+    try:
+        if scale is None:
+            packer.pack_into(record, offset, *values)
+            return
+        quantized = [round(value * scale) for value in values]
+        if min(quantized) > QUANTIZED_MISSING:
+            packer.pack_into(record, offset, *quantized)
+            return
+    except (TypeError, ValueError, OverflowError, struct.error):
+        pass  # A value is None or NaN, or does not fit.
+
+    values = np.array(value, dtype=float).ravel()  # None becomes NaN.
+    if scale is not None:
+        values = quantize_array(values, scale)
+    packer.pack_into(record, offset, *values.tolist())
+
+
+def dequantize(value, scale):
+    """
+    Convert an int16 fixed point value back to a float.
+
+    Parameters
+    ----------
+    value : int
+        The quantized value.
+    scale : int
+        The number of steps per unit.
+
+    Returns
+    -------
+    float
+        The value, or NaN if it is `QUANTIZED_MISSING`.
+
+    Examples
+    --------
+    >>> dequantize(215, 10)
+    21.5
+
+    """
+    return _NAN if value == QUANTIZED_MISSING else value / scale
+
+
+def unpack_telemetry_header(data):
+    """
+    Unpack the header of a telemetry datagram.
+
+    Parameters
+    ----------
+    data : bytes-like
+        The received datagram.
+
+    Returns
+    -------
+    TelemetryHeader
+        A namedtuple containing `version`, `flags`, `keyframe`, `mask`, `seq`,
+        and `timestamp`.
+
+    Raises
+    ------
+    BadDataError
+        The datagram is too short, or has the wrong version.
+
+    """
+    if len(data) < _telemetry_header.size:
+        raise BadDataError("Telemetry has only {n} bytes".format(n=len(data)))
+
+    header = TelemetryHeader._make(_telemetry_header.unpack_from(data))
+    if header.version != TELEMETRY_VERSION:
+        raise BadDataError("Unsupported telemetry version: {v}"
+                           .format(v=header.version))
+    return header
+
+
+def _spans(mask):
+    """
+    Find the runs of consecutive fields of the record in a mask.
+
+    Parameters
+    ----------
+    mask : int
+        Bit `i` is set if field `i` of the record is included.
+
+    Returns
+    -------
+    list of 2-tuple of int
+        The start and end of each run in the record.
+
+    """
+    spans = []
+    for bit, start, end in _field_slices:
+        if not mask & bit:
+            continue
+        if spans and spans[-1][1] == start:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    return spans
+
+
+class TelemetryEncoder(object):
+    """
+    Pack sensor data into telemetry datagrams.
+
+    Most of the telemetry, such as the temperature matrices and the servo
+    data, rarely changes between cycles. A keyframe containing every field is
+    sent every `keyframe_interval` datagrams. In between, only the fields
+    which differ from the last keyframe are sent. Since every delta refers to
+    the keyframe rather than to the previous datagram, losing a delta does not
+    affect the datagrams which follow it.
+
+    The record is kept packed between datagrams, and a field is only packed
+    again when its input differs from the last one. The flippers, currents,
+    and poses, which change on almost every cycle, are compared and packed
+    together. Copies of the inputs are kept for the comparison, so the caller
+    may modify them afterwards.
+
+    Queued samples can be appended to any datagram, as long as it stays within
+    `max_size` bytes.
+
+    Parameters
+    ----------
+    keyframe_interval : int, optional
+        The number of datagrams between two keyframes. If it is 1, every
+        datagram is a keyframe.
+    max_size : int, optional
+        The byte budget of a datagram when batching samples.
+
+    Attributes
+    ----------
+    keyframe_interval : int
+        The number of datagrams between two keyframes.
+    max_size : int
+        The byte budget of a datagram when batching samples.
+
+    Examples
+    --------
+    >>> encoder = TelemetryEncoder(keyframe_interval=10)
+    >>> arm_data = ([200, 250, 300], [11.5, 100, 125],
+    ...             [[20.5] * 16, [21.0] * 16], 450)
+    >>> len(encoder.encode([0.5, 0.5], [[1, 12]] * 4, [[0, 0, 0]] * 2,
+    ...                    arm_data))  # Keyframe
+    216
+    >>> len(encoder.encode([0.6, 0.5], [[1, 12]] * 4, [[0, 0, 0]] * 2,
+    ...                    arm_data))  # Only the flippers changed
+    26
+
+    """
+    def __init__(self, keyframe_interval=20, max_size=TELEMETRY_MAX_SIZE):
+        self.keyframe_interval = keyframe_interval
+        self.max_size = max_size
+        self._record = bytearray(TELEMETRY_RECORD_SIZE)
+        self._keyframe = bytes(TELEMETRY_RECORD_SIZE)
+        self._keyframe_id = 0
+        self._count = 0
+        self._seq = 0
+        self._motion = None  # The flippers, currents, and poses as packed.
+        self._inputs = (None,) * (len(TELEMETRY_FIELDS) - _MOTION_FIELDS)
+        self._changed = 0  # The mask of the fields unlike the keyframe.
+        self._spans = []  # (start, end) of each run of those fields.
+        self._delta = b""  # Those runs, or None once a field is repacked.
+
+    def encode(self, flipper_positions, current_data, imu_data, arm_data,
+               samples=None, loop_timing=None, stage_times=None,
+               baud_rates=None):
+        """
+        Pack sensor data into the next telemetry datagram.
+
+        Parameters
+        ----------
+        flipper_positions : 2-list of float
+            The positions of the flippers.
+        current_data : 4-list of 2-list of float
+            The current sensor measurements.
+        imu_data : 2-list of 3-list of float
+            The IMU measurements.
+        arm_data : list of lists and float
+            The data returned from the arm, as given by
+            `rpi.client.Client._get_arm_data`.
+        samples : SampleRing, optional
+            Queued samples to send. As many of the oldest samples as fit in
+            `max_size` are removed from the ring and added to the datagram.
+        loop_timing : 4-tuple of float, optional
+            The timing of the control loop, as given by
+            `rpi.scheduler.LoopScheduler.timing`.
+        stage_times : 16-tuple of float, optional
+            The median and 99th percentile duration of each stage in
+            `LOOP_STAGES` in seconds, as given by
+            `rpi.profiling.LoopProfiler.flat_report`.
+        baud_rates : 2-tuple of int, optional
+            The baud rates of the serial links to the body and arm mbeds.
+
+        Returns
+        -------
+        bytes
+            The encoded datagram. Any value which is ``None`` is encoded as
+            missing.
+
+        """
+        arm_positions, servo_vii, thermo_sensors, co2 = arm_data
+        if loop_timing is None:
+            loop_timing = _NO_LOOP_TIMING
+        if stage_times is None:
+            stage_times = _NO_STAGE_TIMES
+        if baud_rates is None:
+            baud_rates = _NO_BAUD_RATES
+        inputs = (arm_positions, servo_vii, thermo_sensors, (co2,),
+                  loop_timing, stage_times, baud_rates)
+        if inputs != self._inputs:
+            self._pack(inputs)
+        motion = (flipper_positions, current_data, imu_data)
+        if motion != self._motion:
+            self._pack_motion(motion)
+
+        seq = self._seq
+        self._seq = (seq + 1) & 0xFFFFFFFF
+
+        if self._count % self.keyframe_interval == 0:
+            self._count = 1
+            self._keyframe = body = bytes(self._record)
+            self._keyframe_id = (self._keyframe_id + 1) & 0xFFFF
+            self._changed = 0
+            self._spans = []
+            self._delta = b""
+            flags = TELEMETRY_KEYFRAME
+            mask = _ALL_FIELDS
+        else:
+            self._count += 1
+            flags = 0
+            mask = self._changed
+            body = self._delta
+            if body is None:
+                record = self._record
+                body = self._delta = b"".join([record[start:end]
+                                               for start, end in self._spans])
+
+        if samples:
+            size = _telemetry_header.size + len(body) + _sample_count.size
+            batch = samples.pop(min(_MAX_SAMPLES,
+                                    (self.max_size - size) // SAMPLE_SIZE))
+            if batch:
+                return b"".join((
+                    _telemetry_header.pack(TELEMETRY_VERSION,
+                                           flags | TELEMETRY_BATCH,
+                                           self._keyframe_id, mask, seq,
+                                           time.monotonic()),
+                    body, _sample_count.pack(len(batch) // SAMPLE_SIZE),
+                    batch))
+
+        return _telemetry_header.pack(TELEMETRY_VERSION, flags,
+                                      self._keyframe_id, mask, seq,
+                                      time.monotonic()) + body
+
+    def _pack_motion(self, inputs):
+        """
+        Pack the flippers, currents, and poses into the record.
+
+        Parameters
+        ----------
+        inputs : 3-tuple
+            The flipper positions, current sensor measurements, and IMU
+            measurements.
+
+        """
+        flipper_positions, current_data, imu_data = inputs
+        record = self._record
+        try:
+            current_0, current_1, current_2, current_3 = current_data
+            imu_0, imu_1 = imu_data
+            _motion.pack_into(record, 0, *flipper_positions, *current_0,
+                              *current_1, *current_2, *current_3, *imu_0,
+                              *imu_1)
+            self._motion = (flipper_positions[:],
+                            [current_0[:], current_1[:], current_2[:],
+                             current_3[:]],
+                            [imu_0[:], imu_1[:]])
+        except (TypeError, ValueError, struct.error):  # A value is missing.
+            for field, value in zip(_field_packers, inputs):
+                _pack_field(field[3], field[4], field[5], record, field[1],
+                            value)
+            self._motion = (flipper_positions[:],
+                            [row[:] for row in current_data],
+                            [row[:] for row in imu_data])
+        self._delta = None
+
+        keyframe = self._keyframe
+        changed = self._changed & ~_MOTION_BITS
+        for bit, start, end in _field_slices[:_MOTION_FIELDS]:
+            if record[start:end] != keyframe[start:end]:
+                changed |= bit
+        if changed != self._changed:
+            self._changed = changed
+            self._spans = _spans(changed)
+
+    def _pack(self, inputs):
+        """
+        Pack the other fields whose inputs changed into the record.
+
+        Parameters
+        ----------
+        inputs : tuple
+            The input of each field in `TELEMETRY_FIELDS` after the poses.
+
+        """
+        record = self._record
+        keyframe = self._keyframe
+        changed = self._changed
+        copies = list(self._inputs)
+        for i, (value, last) in enumerate(zip(inputs, self._inputs)):
+            if value == last:
+                continue
+            bit, start, end, packer, scale, nested = \
+                _field_packers[_MOTION_FIELDS + i]
+            if nested:
+                copies[i] = [row[:] for row in value]
+            else:
+                copies[i] = value[:]
+            _pack_field(packer, scale, nested, record, start, value)
+            if record[start:end] == keyframe[start:end]:
+                changed &= ~bit
+            else:
+                changed |= bit
+        self._inputs = tuple(copies)
+        self._delta = None
+        if changed != self._changed:
+            self._changed = changed
+            self._spans = _spans(changed)
+
+
+class TelemetryDecoder(object):
+    """
+    Rebuild the full telemetry record from telemetry datagrams.
+
+    Deltas are applied to the keyframe they refer to. Deltas which refer to a
+    keyframe which has not been received are rejected until the next keyframe
+    arrives, as are deltas which are older than the latest datagram.
+
+    Batched samples do not depend on the keyframe, and are extracted from
+    every well-formed datagram, even if its record is rejected.
+
+    Attributes
+    ----------
+    record : bytearray
+        The latest full record, laid out according to `TELEMETRY_FIELDS`. It
+        is updated in place, so views of it remain valid.
+    samples : memoryview
+        The samples batched in the last datagram, laid out according to
+        `SAMPLE_FIELDS`. It is a view of that datagram, and is empty if the
+        datagram had no samples.
+    seq : int
+        The sequence number of the datagram which last updated `record`.
+    timestamp : float
+        The time at which that datagram was sent, on the robot's monotonic
+        clock.
+
+    """
+    def __init__(self):
+        self.record = bytearray(TELEMETRY_RECORD_SIZE)
+        self.seq = None
+        self.timestamp = None
+        self.samples = memoryview(b"")
+        self._keyframe = bytearray(TELEMETRY_RECORD_SIZE)
+        self._keyframe_id = None
+
+    def decode(self, data):
+        """
+        Apply a telemetry datagram to `record`.
+
+        Parameters
+        ----------
+        data : bytes-like
+            The received datagram.
+
+        Returns
+        -------
+        bytearray
+            The updated `record`.
+
+        Raises
+        ------
+        BadDataError
+            The datagram is invalid, refers to an unknown keyframe, or is an
+            out-of-order delta.
+
+        """
+        self.samples = memoryview(b"")
+        version, flags, keyframe_id, mask, seq, timestamp =\
+            unpack_telemetry_header(data)
+
+        if flags & TELEMETRY_KEYFRAME:
+            mask = _ALL_FIELDS
+        offset = _telemetry_header.size
+        end = offset + sum(end - start for bit, start, end in _field_slices
+                           if mask & bit)
+        self.samples = self._split_samples(data, flags, end)
+
+        if flags & TELEMETRY_KEYFRAME:
+            self._keyframe[:] = data[offset:end]
+            self._keyframe_id = keyframe_id
+            self.record[:] = self._keyframe
+            self.seq, self.timestamp = seq, timestamp
+            return self.record
+
+        if keyframe_id != self._keyframe_id:
+            raise BadDataError("Delta refers to unknown keyframe {k}"
+                               .format(k=keyframe_id))
+        if (seq - self.seq) & 0xFFFFFFFF >= 0x80000000:
+            raise BadDataError("Delta {seq} is older than {last}"
+                               .format(seq=seq, last=self.seq))
+
+        self.record[:] = self._keyframe
+        for bit, start, end in _field_slices:
+            if mask & bit:
+                self.record[start:end] = data[offset:offset + end - start]
+                offset += end - start
+        self.seq, self.timestamp = seq, timestamp
+        return self.record
+
+    def _split_samples(self, data, flags, offset):
+        """
+        Check the length of a datagram, and find its batched samples.
+
+        Parameters
+        ----------
+        data : bytes-like
+            The received datagram.
+        flags : int
+            The flags in the header of the datagram.
+        offset : int
+            The end of the record fields in the datagram.
+
+        Returns
+        -------
+        memoryview
+            The samples in the datagram.
+
+        Raises
+        ------
+        BadDataError
+            The length of the datagram does not match its header.
+
+        """
+        if flags & TELEMETRY_BATCH and len(data) > offset:
+            n_samples, = _sample_count.unpack_from(data, offset)
+            offset += _sample_count.size
+            size = offset + n_samples * SAMPLE_SIZE
+        else:
+            size = offset
+
+        if len(data) != size:
+            raise BadDataError("Telemetry has {n} bytes instead of {size}"
+                               .format(n=len(data), size=size))
+        return memoryview(data)[offset:size]
+
+    def unpack(self):
+        """
+        Unpack `record` without NumPy.
+
+        Returns
+        -------
+        dict
+            The values of each field in `TELEMETRY_FIELDS`, as tuples of
+            floats. Quantized fields are converted back to their units.
+            Missing readings are NaN.
+
+        """
+        values = _telemetry_record.unpack(self.record)
+        telemetry = {}
+        start = 0
+        for name, _, n in TELEMETRY_FIELDS:
+            field = values[start:start + n]
+            scale = TELEMETRY_SCALES.get(name)
+            if scale is not None:
+                field = tuple(dequantize(value, scale) for value in field)
+            telemetry[name] = field
+            start += n
+        return telemetry
+
+    def unpack_samples(self):
+        """
+        Unpack `samples` without NumPy.
+
+        Returns
+        -------
+        dict
+            For each field in `SAMPLE_FIELDS`, a list containing its value in
+            each sample, oldest first. Multi-valued fields are tuples.
+
+        """
+        samples = {name: [] for name, _, _ in SAMPLE_FIELDS}
+        for values in _sample.iter_unpack(self.samples):
+            start = 0
+            for name, _, n in SAMPLE_FIELDS:
+                samples[name].append(values[start] if n == 1
+                                     else values[start:start + n])
+                start += n
+        return samples
+
+
+class SampleRing(object):
+    """
+    A bounded queue of timestamped sensor samples waiting to be sent.
+
+    Samples are packed into a preallocated buffer as they are appended. When
+    the ring is full, the oldest sample is dropped to make room for the
+    newest. Samples can be appended from one thread and popped from another.
+
+    Parameters
+    ----------
+    size : int, optional
+        The maximum number of samples held.
+
+    Attributes
+    ----------
+    dropped : int
+        The number of samples which were dropped because the ring was full.
+
+    Examples
+    --------
+    >>> ring = SampleRing(size=2)
+    >>> for i in range(3):
+    ...     ring.append([[i, 12]] * 4, [[0, 0, 0]] * 2, timestamp=i)
+    >>> len(ring), ring.dropped
+    (2, 1)
+    >>> len(ring.pop(5)) // SAMPLE_SIZE
+    2
+
+    """
+    def __init__(self, size=256):
+        self._buffer = bytearray(size * SAMPLE_SIZE)
+        self._view = memoryview(self._buffer)
+        self._size = size
+        self._first = 0  # The index of the oldest sample.
+        self._count = 0
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def append(self, current_data, imu_data, timestamp=None):
+        """
+        Pack a sample and add it to the ring.
+
+        Parameters
+        ----------
+        current_data : 4-list of 2-list of float
+            The current sensor measurements.
+        imu_data : 2-list of 3-list of float
+            The IMU measurements.
+        timestamp : float, optional
+            The time at which the sample was taken. Defaults to now, on the
+            monotonic clock.
+
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        with self._lock:
+            if self._count == self._size:
+                self.dropped += 1
+                self._first = (self._first + 1) % self._size
+                self._count -= 1
+            offset = (self._first + self._count) % self._size * SAMPLE_SIZE
+            current_0, current_1, current_2, current_3 = current_data
+            imu_0, imu_1 = imu_data
+            try:
+                _sample.pack_into(self._buffer, offset, timestamp,
+                                  *current_0, *current_1, *current_2,
+                                  *current_3, *imu_0, *imu_1)
+            except struct.error:  # A reading is missing.
+                values = chain(chain.from_iterable(current_data),
+                               chain.from_iterable(imu_data))
+                _sample.pack_into(self._buffer, offset, timestamp,
+                                  *[_NAN if value is None else value
+                                    for value in values])
+            self._count += 1
+
+    def pop(self, n):
+        """
+        Remove the oldest samples from the ring.
+
+        Parameters
+        ----------
+        n : int
+            The maximum number of samples to remove.
+
+        Returns
+        -------
+        bytes
+            The packed samples, oldest first.
+
+        """
+        with self._lock:
+            n = min(n, self._count)
+            start = self._first * SAMPLE_SIZE
+            end = start + n * SAMPLE_SIZE
+            if end <= len(self._buffer):
+                samples = bytes(self._view[start:end])
+            else:  # The samples wrap around.
+                samples = (bytes(self._view[start:]) +
+                           self._view[:end - len(self._buffer)])
+            self._first = (self._first + n) % self._size
+            self._count -= n
+        return samples
+
+    def __len__(self):
+        return self._count
+
+
+def frame(message):
+    """
+    Prefix a message with its length, as expected by `FramedStream`.
+
+    Parameters
+    ----------
+    message : bytes-like
+        The message. It must be shorter than 65536 bytes.
+
+    Returns
+    -------
+    bytes
+        The framed message. The length prefix is `LENGTH_PREFIX_SIZE` bytes
+        long, and little-endian.
+
+    Examples
+    --------
+    >>> frame(b"commands")
+    b'\\x08\\x00commands'
+
+    """
+    return _length_prefix.pack(len(message)) + message
+
+
+class FramedStream(object):
+    """
+    Send and receive length-prefixed messages over a stream socket.
+
+    Incoming data is read with ``recv_into`` into a buffer which is allocated
+    once, so partial and coalesced messages are handled without allocating a
+    new buffer for each message.
+
+    Parameters
+    ----------
+    sock : socket
+        The connected stream socket. Its timeout is respected.
+    buffer_size : int, optional
+        The size of the receive buffer. It limits the size of the messages
+        which can be received.
+
+    Attributes
+    ----------
+    sock : socket
+        The connected stream socket.
+
+    Examples
+    --------
+    >>> import socket
+    >>> a, b = socket.socketpair()
+    >>> sender, receiver = FramedStream(a), FramedStream(b)
+    >>> sender.send(b"commands")
+    >>> sender.send(b"state")
+    >>> bytes(receiver.recv())
+    b'commands'
+    >>> bytes(receiver.recv())
+    b'state'
+
+    """
+    def __init__(self, sock, buffer_size=4096):
+        self.sock = sock
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # Start of the unread data.
+        self._end = 0  # End of the received data.
+
+    def send(self, message):
+        """
+        Send a message.
+
+        Parameters
+        ----------
+        message : bytes-like
+            The message to be sent. It must be shorter than 65536 bytes.
+
+        """
+        self.sock.sendall(frame(message))
+
+    def recv(self, latest=False):
+        """
+        Receive a message, blocking until one is complete.
+
+        Parameters
+        ----------
+        latest : bool, optional
+            Whether to discard every message except the newest one that can be
+            received without blocking.
+
+        Returns
+        -------
+        memoryview
+            A view of the message in the receive buffer. It is only valid until
+            the next call to `recv`. If the connection was closed, returns
+            None instead.
+
+        Raises
+        ------
+        BadDataError
+            A message is longer than the receive buffer. The buffer is cleared.
+
+        """
+        if latest:
+            while select.select([self.sock], [], [], 0)[0]:
+                self._skip_stale()
+                self._compact()
+                if self._end == len(self._buffer):
+                    break  # The rest is received after this message.
+                if not self._fill():
+                    return None
+
+        while True:
+            if latest:
+                self._skip_stale()
+            message = self._pop()
+            if message is not None:
+                return message
+            if not self._fill():
+                return None
+
+    def _compact(self):
+        """Move unread data to the front of the buffer if the end is full."""
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            n_unread = self._end - self._start
+            self._view[:n_unread] = self._view[self._start:self._end]
+            self._start, self._end = 0, n_unread
+
+    def _fill(self):
+        """
+        Receive data into the free end of the buffer.
+
+        Unread data is moved to the front of the buffer if there is no space
+        left at the end. There is always space left when the unread data does
+        not start with a complete message.
+
+        Returns
+        -------
+        int
+            The number of bytes received. Zero means the connection was closed.
+
+        """
+        self._compact()
+        n_bytes = self.sock.recv_into(self._view[self._end:])
+        self._end += n_bytes
+        return n_bytes
+
+    def _message_end(self, offset):
+        """
+        Find where the message starting at `offset` ends.
+
+        Parameters
+        ----------
+        offset : int
+            The position of the message's length prefix in the buffer.
+
+        Returns
+        -------
+        int
+            The end of the message, or None if it has not been fully received.
+
+        Raises
+        ------
+        BadDataError
+            The message would not fit in the buffer.
+
+        """
+        if self._end - offset < _length_prefix.size:
+            return None
+
+        length, = _length_prefix.unpack_from(self._buffer, offset)
+        if _length_prefix.size + length > len(self._buffer):
+            self._start = self._end = 0
+            raise BadDataError("Message of {n} bytes does not fit the buffer"
+                               .format(n=length))
+
+        end = offset + _length_prefix.size + length
+        return end if end <= self._end else None
+
+    def _pop(self):
+        """Return the next complete message in the buffer, or None."""
+        end = self._message_end(self._start)
+        if end is None:
+            return None
+
+        begin = self._start + _length_prefix.size
+        self._start = end
+        return self._view[begin:end]
+
+    def _skip_stale(self):
+        """Discard complete messages which are followed by another one."""
+        end = self._message_end(self._start)
+        while end is not None:
+            next_end = self._message_end(end)
+            if next_end is None:
+                return
+            self._start, end = end, next_end
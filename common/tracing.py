@@ -0,0 +1,308 @@
+# (C) 2015  Kyoto University Mechatronics Laboratory
+# Released under the GNU General Public License, version 3
+"""
+Record diagnostics in a binary trace.
+
+Formatting a log message takes time on every cycle, even when nobody reads it.
+A `Tracer` instead packs each event into a fixed-size binary record in a
+preallocated ring buffer, and nothing is formatted until the trace is read.
+Each record contains an event ID, a timestamp, and up to `TRACE_FIELDS`
+numbers.
+
+Events are declared once, with `event`, along with the format string used to
+display their fields. The trace can be dumped to a file on demand, or when the
+process receives a signal, and decoded offline into text by running::
+
+    python3 -m common.tracing TRACE_FILE
+
+"""
+import argparse
+from collections import namedtuple
+from itertools import count
+import json
+import signal
+import struct
+import time
+
+
+TRACE_MAGIC = b"YZTR"
+TRACE_VERSION = 1
+TRACE_FIELDS = 4  # The number of numeric fields in a record.
+
+# Event ID, timestamp (monotonic clock), and fields.
+_record = struct.Struct("<Hd{n}d".format(n=TRACE_FIELDS))
+RECORD_SIZE = _record.size
+
+# Magic, version, and length of the JSON event table which follows.
+_file_header = struct.Struct("<4sBI")
+
+_NAN = float("nan")
+
+Event = namedtuple("Event", "name format")
+TraceRecord = namedtuple("TraceRecord", "timestamp name fields")
+
+# The events declared in this process, indexed by ID.
+_events = []
+
+
+def event(name, format_string=""):
+    """
+    Declare an event which can be traced.
+
+    Parameters
+    ----------
+    name : str
+        The name of the event.
+    format_string : str, optional
+        The format string used to display the fields of the event, which are
+        passed as positional arguments.
+
+    Returns
+    -------
+    int
+        The ID of the event, to be passed to `Tracer.record`.
+
+    Examples
+    --------
+    >>> flippers = event("flippers", "left {0:.3f} right {1:.3f}")
+    >>> _events[flippers].name
+    'flippers'
+
+    """
+    _events.append(Event(name, format_string))
+    return len(_events) - 1
+
+
+class Tracer(object):
+    """
+    Record events into a ring buffer of binary records.
+
+    Once the buffer is full, each new record overwrites the oldest one.
+    Records can be added from several threads.
+
+    Parameters
+    ----------
+    size : int, optional
+        The number of records kept.
+    enabled : bool, optional
+        Whether events are recorded.
+
+    Attributes
+    ----------
+    size : int
+        The number of records kept.
+    enabled : bool
+        Whether events are recorded. If not, `record` returns immediately.
+
+    Examples
+    --------
+    >>> speed = event("speed", "{0:+.2f}")
+    >>> tracer = Tracer(size=2)
+    >>> for i in range(3):
+    ...     tracer.record(speed, i / 4)
+    >>> [record.fields[0] for record in tracer.records()]
+    [0.25, 0.5]
+
+    """
+    def __init__(self, size=4096, enabled=True):
+        self.size = size
+        self.enabled = enabled
+        self._buffer = bytearray(size * RECORD_SIZE)
+        self._slots = count()
+        self._count = 0
+
+    def record(self, event_id, a=_NAN, b=_NAN, c=_NAN, d=_NAN):
+        """
+        Record an event.
+
+        Parameters
+        ----------
+        event_id : int
+            The ID of the event, as returned by `event`.
+        a, b, c, d : float, optional
+            The fields of the event. Missing fields, and fields which are
+            None, are recorded as NaN.
+
+        """
+        if not self.enabled:
+            return
+        slot = next(self._slots)  # Atomic.
+        _record.pack_into(self._buffer, (slot % self.size) * RECORD_SIZE,
+                          event_id, time.monotonic(),
+                          _NAN if a is None else a, _NAN if b is None else b,
+                          _NAN if c is None else c, _NAN if d is None else d)
+        self._count = slot + 1
+
+    def _raw_records(self):
+        """
+        Get the packed records, oldest first.
+
+        Returns
+        -------
+        bytes
+            The records currently kept.
+
+        """
+        data = bytes(self._buffer)
+        n_records = self._count
+        if n_records <= self.size:
+            return data[:n_records * RECORD_SIZE]
+        split = (n_records % self.size) * RECORD_SIZE
+        return data[split:] + data[:split]
+
+    def records(self):
+        """
+        Decode the records currently kept.
+
+        Returns
+        -------
+        list of TraceRecord
+            A namedtuple containing the `timestamp`, event `name`, and
+            `fields` of each record, oldest first.
+
+        """
+        return _decode_records(self._raw_records(), _events)
+
+    def dump(self, filename):
+        """
+        Write the trace to a file.
+
+        The file contains the declared events, followed by the records.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file.
+
+        """
+        table = json.dumps(_events).encode()
+        with open(filename, "wb") as trace_file:
+            trace_file.write(_file_header.pack(TRACE_MAGIC, TRACE_VERSION,
+                                               len(table)))
+            trace_file.write(table)
+            trace_file.write(self._raw_records())
+
+    def dump_on_signal(self, filename, signum=signal.SIGUSR1):
+        """
+        Write the trace to a file whenever a signal is received.
+
+        This method must be called from the main thread.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file.
+        signum : int, optional
+            The signal.
+
+        """
+        signal.signal(signum, lambda signum, frame: self.dump(filename))
+
+    def clear(self):
+        """Forget every record."""
+        self._slots = count()
+        self._count = 0
+
+
+def _decode_records(data, events):
+    """
+    Decode packed records.
+
+    Parameters
+    ----------
+    data : bytes
+        The packed records.
+    events : list of 2-list of str
+        The name and format string of each event, indexed by ID.
+
+    Returns
+    -------
+    list of TraceRecord
+        The records, sorted by timestamp.
+
+    """
+    records = []
+    for event_id, timestamp, *fields in _record.iter_unpack(data):
+        records.append(TraceRecord(timestamp, events[event_id][0],
+                                   tuple(fields)))
+    records.sort(key=lambda record: record.timestamp)
+    return records
+
+
+def read_trace(filename):
+    """
+    Read a trace written by `Tracer.dump`.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file.
+
+    Returns
+    -------
+    events : dict
+        The format string of each event.
+
+        **Dictionary format :** {name (str): format_string (str)}
+    records : list of TraceRecord
+        The records, oldest first.
+
+    Raises
+    ------
+    ValueError
+        The file is not a trace, or has the wrong version.
+
+    """
+    with open(filename, "rb") as trace_file:
+        data = trace_file.read()
+
+    magic, version, table_size = _file_header.unpack_from(data)
+    if magic != TRACE_MAGIC:
+        raise ValueError("{f} is not a trace".format(f=filename))
+    if version != TRACE_VERSION:
+        raise ValueError("Unsupported trace version: {v}".format(v=version))
+
+    start = _file_header.size
+    events = json.loads(data[start:start + table_size].decode())
+    records = _decode_records(data[start + table_size:], events)
+    return dict(events), records
+
+
+def format_trace(events, records):
+    """
+    Format trace records as text.
+
+    Parameters
+    ----------
+    events : dict
+        The format string of each event, as returned by `read_trace`.
+    records : list of TraceRecord
+        The records.
+
+    Yields
+    ------
+    str
+        One line per record, with the time since the first record in
+        seconds, the name of the event, and its formatted fields.
+
+    """
+    if not records:
+        return
+    start = records[0].timestamp
+    for timestamp, name, fields in records:
+        yield "{t:10.6f}  {name:<20} {fields}".format(
+            t=timestamp - start, name=name,
+            fields=events[name].format(*fields))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("filename", help="trace written by Tracer.dump")
+    args = parser.parse_args()
+
+    for line in format_trace(*read_trace(args.filename)):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -364,7 +364,7 @@ epub_exclude_files = ['search.html']
 
 # Intersphinx
 intersphinx_mapping = {
-    'python': ('https://docs.python.org/3.4', None),
+    'python': ('https://docs.python.org/3.7', None),
 }
 
 # Do not import RPi files.
@@ -3,6 +3,15 @@
 #include "Dynamixel.h"
 #include "MEMS.h"
 
+// A bitfield representing the arm packet received from the RPi.
+//
+// In mode 3, the packet runs a function chosen by the other bits:
+//
+//   linear 1: Send the identity of the mbed.
+//   linear 2: Send binary frames from now on.
+//   linear 3: Change the baud rate to the one whose index is in the next byte.
+//   linear 0, pitch 1: Send lines of text again.
+//   Otherwise: Send the arm home, and turn the servos off.
 struct ArmPacketBits {
                       unsigned int mode : 2;
                       unsigned int linear : 2;
@@ -73,6 +82,170 @@ float GetCO2() {
   return co2.read() * 5000 + 400;  // ppm
 }
 
+// The baud rates which can be negotiated with the RPi, in increasing order.
+// The RPi requests a rate by its index, so this must match BAUD_RATES in
+// rpi/mbed.py.
+const int kBaudRates[] = {38400, 57600, 115200, 230400, 460800, 921600};
+const int kNumBaudRates = sizeof(kBaudRates) / sizeof(kBaudRates[0]);
+// The identity request. A confirmation which arrives too late is harmless.
+const int kBaudConfirm = 7;
+
+// Change the baud rate, as requested by the RPi.
+//
+// The byte after the request is the index of the new rate in kBaudRates. The
+// mbed acknowledges it at the old rate with "baud RATE", or refuses it with
+// "baud 0", and then switches. It echoes one line back at the new rate, and
+// keeps the new rate only if the RPi confirms the echo within 200 ms, in which
+// case the caller sends its identity at the new rate. Otherwise, it goes back
+// to the old rate.
+//
+// Parameters:
+//   baud: The current baud rate, which is updated.
+//
+// Returns:
+//   Whether the new rate was confirmed.
+bool NegotiateBaud(int &baud) {
+  int index = rpi.getc();
+  if (index >= kNumBaudRates) {
+    rpi.printf("baud 0\n");
+    return false;
+  }
+  int new_baud = kBaudRates[index];
+  rpi.printf("baud %d\n", new_baud);
+  wait_ms(5);  // Let the reply leave at the old rate.
+  rpi.baud(new_baud);
+
+  Timer timer;
+  timer.start();
+  bool echoed = false;
+  while (timer.read_ms() < 200) {
+    if (not rpi.readable()) {
+      continue;
+    }
+    int c = rpi.getc();
+    if (echoed) {
+      if (c == kBaudConfirm) {
+        baud = new_baud;
+        return true;
+      }
+      break;
+    }
+    rpi.putc(c);
+    echoed = c == '\n';
+  }
+  rpi.baud(baud);
+  return false;
+}
+
+
+const int kBreak = -1;  // Returned by ReadByte at the end of a break.
+
+// Wait for the next byte from the RPi.
+//
+// A break from the RPi, which holds the line low for longer than a byte, puts
+// the mbed back in its initial state. The mbed interface usually resets the
+// mbed on a break instead of passing it on, and main then runs DxInitialize
+// and DxGoHome again, homing the arm. The RPi therefore only sends one if the
+// mbed does not answer at the first rate. Otherwise, it asks for lines of text
+// with a command, and it negotiates the first rate again before it leaves.
+//
+// The USB port is UART0, and its line status is read here because
+// Serial::getc clears it.
+//
+// Returns:
+//   The byte, or kBreak if it ended a break.
+int ReadByte() {
+  while (true) {
+    uint32_t status = LPC_UART0->LSR;
+    if (status & 0x01) {  // Receiver data ready.
+      int c = LPC_UART0->RBR;
+      return status & 0x10 ? kBreak : c;  // Break interrupt.
+    }
+  }
+}
+
+// Calculate the CRC-16-CCITT of some data.
+//
+// The polynomial is 0x1021, and the initial value is 0xFFFF.
+uint16_t Crc16(const uint8_t data[], int length) {
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < length; i++) {
+    crc ^= data[i] << 8;
+    for (int bit = 0; bit < 8; bit++) {
+      crc = crc & 0x8000 ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+// Send data to the RPi with COBS, followed by a zero byte.
+//
+// The data must be shorter than 254 bytes.
+void SendCobs(const uint8_t data[], int length) {
+  uint8_t encoded[length + 1];
+  int code_index = 0;  // Where the length of the current block goes.
+  int n_encoded = 1;
+  uint8_t code = 1;
+
+  for (int i = 0; i < length; i++) {
+    if (data[i] == 0) {
+      encoded[code_index] = code;
+      code_index = n_encoded++;
+      code = 1;
+    } else {
+      encoded[n_encoded++] = data[i];
+      code++;
+    }
+  }
+  encoded[code_index] = code;
+
+  for (int i = 0; i < n_encoded; i++) {
+    rpi.putc(encoded[i]);
+  }
+  rpi.putc(0);
+}
+
+// Append a value to a frame as a little-endian 16-bit integer.
+void PutInt16(uint8_t frame[], int &length, int value) {
+  frame[length++] = value & 0xFF;
+  frame[length++] = (value >> 8) & 0xFF;
+}
+
+// Convert a value to tenths, rounded to the nearest integer.
+int Tenths(float value) {
+  return value < 0 ? (int) (value * 10 - 0.5) : (int) (value * 10 + 0.5);
+}
+
+// Send the data to the RPi in a binary frame.
+//
+// The frame contains a sequence number, the servo positions and voltage and
+// currents, the thermal sensor cells, all as int16 in tenths, the CO2 reading
+// as uint16 in PPM, and the CRC of everything before it. Every value is
+// little-endian.
+void SendFrame(float positions[], float values[], float thermo_data[][16],
+               float co2_data) {
+  static uint8_t sequence = 0;
+  uint8_t frame[1 + 2 * 39 + 2];
+  int length = 0;
+
+  frame[length++] = sequence++;
+  for (int i = 0; i < 3; i++) {
+    PutInt16(frame, length, Tenths(positions[i]));
+  }
+  for (int i = 0; i < 3; i++) {
+    PutInt16(frame, length, Tenths(values[i]));
+  }
+  for (int i = 0; i < 2; i++) {
+    for (int j = 0; j < 16; j++) {
+      PutInt16(frame, length, Tenths(thermo_data[i][j]));
+    }
+  }
+  PutInt16(frame, length, (int) (co2_data + 0.5));
+
+  PutInt16(frame, length, Crc16(frame, length));
+  SendCobs(frame, length);
+}
+
 int main() {
   servos.push_back(linear);
   servos.push_back(pitch);
@@ -83,16 +256,25 @@ int main() {
   float thermo_data[2][16];
   float co2_data;
   int commands[3];
+  bool binary = false;  // Whether to send binary frames.
+  int baud = kBaudRates[0];  // Until the RPi negotiates a faster rate.
 
   union ArmPacket packet;
 
-  rpi.baud(38400);  // Match this in the RPi settings.
+  rpi.baud(baud);
 
   DxInitialize();  // Comment this out when testing without the arm.
   DxGoHome();
   
   while (1) {
-    packet.as_byte = rpi.getc();
+    int c = ReadByte();
+    if (c == kBreak) {
+      binary = false;
+      baud = kBaudRates[0];
+      rpi.baud(baud);
+      continue;
+    }
+    packet.as_byte = c;
 
     for (int i = 0; i < 3; i++) {
       positions[i] = -1;
@@ -136,8 +318,16 @@ int main() {
         DxReset();
         break;
       } case 3: {
-        if (packet.b.linear) {
+        if (packet.b.linear == 1) {
           rpi.printf("arm\n");
+        } else if (packet.b.linear == 2) {
+          binary = true;  // Send binary frames from now on.
+        } else if (packet.b.linear == 3) {
+          if (NegotiateBaud(baud)) {
+            rpi.printf("arm\n");
+          }
+        } else if (packet.b.pitch == 1) {
+          binary = false;  // Send lines of text again.
         } else {
           if (dx_relay) {
             DxEnd();
@@ -152,7 +342,12 @@ int main() {
     }
     
     co2_data = GetCO2();
-    
+
+    if (binary) {
+      SendFrame(positions, values, thermo_data, co2_data);
+      continue;
+    }
+
     // Send Dynamixel position
     for (int i=0; i < 3; i++) {
       rpi.printf("%4.1f ", positions[i]);
@@ -165,7 +360,7 @@ int main() {
     
     // Send thermo data
     for (int i=0; i < 2; i++) {
-      for (int j=0; i < 16; i++) {
+      for (int j=0; j < 16; j++) {
         rpi.printf("%4.1f ", thermo_data[i][j]);
       }
     }
@@ -11,8 +11,21 @@ Serial rpi(USBTX, USBRX); // USB port acts as a serial connection with rpi.
 // positive. The last five bits represent the speed, with a value between 0
 // and 31. [0:31] corresponds to a [0:1] requested speed.
 //
+// Motor packets are sent in batches, and the flipper positions are only sent
+// once per batch, at its end.
+//
 // If the sign is 1 and the speed is zero, the packet can instead be used for
-// running up to four functions based on the Motor ID.
+// running up to four functions based on the Motor ID:
+//
+//   0: End a batch of motor packets, and send the flipper positions.
+//   1: Send the flipper positions as binary frames from now on.
+//   2: Change the baud rate to the one whose index is in the next byte.
+//   3: Send the identity of the mbed.
+//
+// A break from the RPi, which holds the line low for longer than a byte, puts
+// the mbed back in its initial state, usually by having the mbed interface
+// reset it. The RPi sends one whenever it connects, and waits for the identity
+// of the mbed before going on.
 //
 // Note that bitfields on the mbed are little endian by default.
 struct MotorPacketBits {
@@ -75,6 +88,189 @@ class Motor {
 };
 
 
+// The baud rates which can be negotiated with the RPi, in increasing order.
+// The RPi requests a rate by its index, so this must match BAUD_RATES in
+// rpi/mbed.py.
+const int kBaudRates[] = {38400, 57600, 115200, 230400, 460800, 921600};
+const int kNumBaudRates = sizeof(kBaudRates) / sizeof(kBaudRates[0]);
+// The identity request. A confirmation which arrives too late is harmless.
+const int kBaudConfirm = 7;
+
+
+// Change the baud rate, as requested by the RPi.
+//
+// The byte after the request is the index of the new rate in kBaudRates. The
+// mbed acknowledges it at the old rate with "baud RATE", or refuses it with
+// "baud 0", and then switches. It echoes one line back at the new rate, and
+// keeps the new rate only if the RPi confirms the echo within 200 ms, in which
+// case the caller sends its identity at the new rate. Otherwise, it goes back
+// to the old rate.
+//
+// Parameters:
+//   baud: The current baud rate, which is updated.
+//
+// Returns:
+//   Whether the new rate was confirmed.
+bool NegotiateBaud(int &baud) {
+  int index = rpi.getc();
+  if (index >= kNumBaudRates) {
+    rpi.printf("baud 0\n");
+    return false;
+  }
+  int new_baud = kBaudRates[index];
+  rpi.printf("baud %d\n", new_baud);
+  wait_ms(5);  // Let the reply leave at the old rate.
+  rpi.baud(new_baud);
+
+  Timer timer;
+  timer.start();
+  bool echoed = false;
+  while (timer.read_ms() < 200) {
+    if (not rpi.readable()) {
+      continue;
+    }
+    int c = rpi.getc();
+    if (echoed) {
+      if (c == kBaudConfirm) {
+        baud = new_baud;
+        return true;
+      }
+      break;
+    }
+    rpi.putc(c);
+    echoed = c == '\n';
+  }
+  rpi.baud(baud);
+  return false;
+}
+
+
+const int kBreak = -1;  // Returned by ReadByte at the end of a break.
+
+
+// Wait for the next byte from the RPi.
+//
+// The USB port is UART0. Its line status tells whether the byte ended a
+// break, and is read here because Serial::getc clears it. If the mbed
+// interface resets the mbed on a break instead of passing it on, the mbed is
+// in its initial state anyway.
+//
+// Returns:
+//   The byte, or kBreak if it ended a break.
+int ReadByte() {
+  while (true) {
+    uint32_t status = LPC_UART0->LSR;
+    if (status & 0x01) {  // Receiver data ready.
+      int c = LPC_UART0->RBR;
+      return status & 0x10 ? kBreak : c;  // Break interrupt.
+    }
+  }
+}
+
+
+// Calculate the CRC-16-CCITT of some data.
+//
+// The polynomial is 0x1021, and the initial value is 0xFFFF.
+//
+// Parameters:
+//   data: The data.
+//   length: The number of bytes in the data.
+uint16_t Crc16(const uint8_t data[], int length) {
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < length; i++) {
+    crc ^= data[i] << 8;
+    for (int bit = 0; bit < 8; bit++) {
+      crc = crc & 0x8000 ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+
+// Send data to the RPi with COBS, followed by a zero byte.
+//
+// COBS replaces every zero byte, so that a zero byte only ever ends a frame.
+// The data must be shorter than 254 bytes.
+//
+// Parameters:
+//   data: The data.
+//   length: The number of bytes in the data.
+void SendCobs(const uint8_t data[], int length) {
+  uint8_t encoded[length + 1];
+  int code_index = 0;  // Where the length of the current block goes.
+  int n_encoded = 1;
+  uint8_t code = 1;
+
+  for (int i = 0; i < length; i++) {
+    if (data[i] == 0) {
+      encoded[code_index] = code;
+      code_index = n_encoded++;
+      code = 1;
+    } else {
+      encoded[n_encoded++] = data[i];
+      code++;
+    }
+  }
+  encoded[code_index] = code;
+
+  for (int i = 0; i < n_encoded; i++) {
+    rpi.putc(encoded[i]);
+  }
+  rpi.putc(0);
+}
+
+
+// Send ADC results to the RPi in a binary frame.
+//
+// The frame contains a sequence number, the results as little-endian uint16,
+// and the CRC of both, also little-endian.
+//
+// Parameters:
+//   results: The latest result of each ADC.
+//   n_adc: The number of ADCs in use.
+void SendFrame(uint16_t results[], int n_adc) {
+  static uint8_t sequence = 0;
+  int length = 1 + 2 * n_adc;
+  uint8_t frame[length + 2];
+
+  frame[0] = sequence++;
+  for (int i = 0; i < n_adc; i++) {
+    frame[1 + 2 * i] = results[i] & 0xFF;
+    frame[2 + 2 * i] = results[i] >> 8;
+  }
+  uint16_t crc = Crc16(frame, length);
+  frame[length] = crc & 0xFF;
+  frame[length + 1] = crc >> 8;
+
+  SendCobs(frame, length + 2);
+}
+
+
+// Read the ADCs, and send their results to the RPi.
+//
+// The results are sent on one line of text, or in a binary frame.
+//
+// Parameters:
+//   adcs: The ADCs connected to the flipper potentiometers.
+//   results: The latest result of each ADC.
+//   n_adc: The number of ADCs in use.
+//   binary: Whether to send a binary frame.
+void SendPositions(AnalogIn adcs[], uint16_t results[], int n_adc,
+                   bool binary) {
+  results[n_adc - 2] = adcs[4].read_u16();  // Left flipper position
+  results[n_adc - 1] = adcs[5].read_u16();  // Right flipper position
+
+  if (binary) {
+    SendFrame(results, n_adc);
+    return;
+  }
+  for (int i = 0; i < n_adc; i++) {
+    rpi.printf("%X ", results[i]);
+  }
+  rpi.printf("\n");
+}
+
+
 int main() {
   // The four motors are in an array. The raspberry pi expects this order; do
   // not change it without changing the code for the RPi as well.
@@ -95,29 +291,38 @@ int main() {
 
   union MotorPacket packet;
   int sign;
+  bool binary = false;  // Whether to send binary frames.
+  int baud = kBaudRates[0];  // Until the RPi negotiates a faster rate.
 
-  rpi.baud(38400);  // Match this in the RPi settings.
+  rpi.baud(baud);
 
   while (1) {
     // Get packet from RPi.
-    packet.as_byte = rpi.getc();
+    int c = ReadByte();
+    if (c == kBreak) {
+      binary = false;
+      baud = kBaudRates[0];
+      rpi.baud(baud);
+      continue;
+    }
+    packet.as_byte = c;
 
-    if (packet.b.motor_id == 3 and packet.b.negative and not packet.b.speed) {
-      rpi.printf("body\n");
+    if (packet.b.negative and not packet.b.speed) {
+      if (packet.b.motor_id == 3) {
+        rpi.printf("body\n");
+      } else if (packet.b.motor_id == 0) {
+        SendPositions(adcs, adc_results, n_adc, binary);
+      } else if (packet.b.motor_id == 1) {
+        binary = true;
+      } else if (packet.b.motor_id == 2) {
+        if (NegotiateBaud(baud)) {
+          rpi.printf("body\n");
+        }
+      }
     } else {
       // Drive motor.
       sign = packet.b.negative ? -1 : 1;
       motors[packet.b.motor_id].Drive(sign * packet.b.speed / 31.0);
-
-      // Update flipper positions.
-      adc_results[n_adc - 2] = adcs[4].read_u16();  // Left flipper position
-      adc_results[n_adc - 1] = adcs[5].read_u16();  // Right flipper position
-
-      // Send data to RPi.
-      for (int i = 0; i < n_adc; i++) {
-        rpi.printf("%X ", adc_results[i]);
-      }
-      rpi.printf("\n");
     }
   }
 }
@@ -12,7 +12,9 @@ positions, current sensor measurements, and pose information that was sent back
 by Yozakura via UDP.
 
 """
+from collections import deque
 import logging
+import math
 import pickle
 import select
 import socket
@@ -21,7 +23,184 @@ import time
 
 import numpy as np
 
-from common.exceptions import YozakuraExit
+from common.exceptions import BadDataError, YozakuraExit
+from common.networking import encode_commands, unpack_telemetry_header,\
+    FramedStream, TelemetryDecoder, TELEMETRY_FIELDS, TELEMETRY_MAX_SIZE,\
+    TELEMETRY_KEYFRAME, TELEMETRY_SCALES, QUANTIZED_MISSING, SAMPLE_FIELDS,\
+    LOOP_STAGES
+
+
+# Structured view of a telemetry record, as sent.
+_RAW_TELEMETRY_DTYPE = np.dtype([(name, "<" + fmt, (n,))
+                                 for name, fmt, n in TELEMETRY_FIELDS])
+
+# Telemetry record, with quantized fields converted back to their units.
+TELEMETRY_DTYPE = np.dtype([(name, "<f4", (n,))
+                            for name, _, n in TELEMETRY_FIELDS])
+
+# Structured view of a batched sample.
+SAMPLE_DTYPE = np.dtype([(name, "<" + fmt) if n == 1 else
+                         (name, "<" + fmt, (n,))
+                         for name, fmt, n in SAMPLE_FIELDS])
+
+# How often the controller is checked for changes while streaming, in seconds.
+_STREAM_POLL_INTERVAL = 0.005
+
+# How often link statistics are logged, in seconds.
+_LINK_STATS_INTERVAL = 5
+
+
+class LinkStatistics(object):
+    """
+    Rolling statistics about the quality of the telemetry link.
+
+    The loss rate, reordering rate, and throughput are computed over the
+    datagrams which arrived within the last `window` seconds. The jitter is a
+    running estimate of the variation in transit time, as defined in RFC 3550.
+    [#]_ Since it only uses differences in transit time, the clocks of the robot
+    and the base station do not need to be synchronized.
+
+    Parameters
+    ----------
+    window : float, optional
+        The duration over which statistics are computed, in seconds.
+
+    Attributes
+    ----------
+    window : float
+        The duration over which statistics are computed, in seconds.
+    received : int
+        The total number of datagrams received.
+    jitter : float
+        The inter-arrival jitter, in seconds.
+
+    References
+    ----------
+    .. [#] Schulzrinne, H. et al., "RTP: A Transport Protocol for Real-Time
+           Applications." RFC 3550, section 6.4.1.
+           https://tools.ietf.org/html/rfc3550#section-6.4.1
+
+    """
+    max_reorder = 100  # Larger jumps back mean the robot restarted.
+
+    def __init__(self, window=5):
+        self.window = window
+        self.received = 0
+        self.jitter = 0
+        self._samples = deque()  # (arrival, seq, size, reordered)
+        self._highest_seq = None
+        self._last_transit = None
+
+    def update(self, seq, timestamp, size, arrival=None, restart=False):
+        """
+        Record the arrival of a datagram.
+
+        If the robot restarted, its sequence numbers start again from zero.
+        The statistics are then cleared, rather than counting the jump back
+        as reordering or loss.
+
+        Parameters
+        ----------
+        seq : int
+            The sequence number of the datagram.
+        timestamp : float
+            The time at which the datagram was sent, in seconds.
+        size : int
+            The size of the datagram, in bytes.
+        arrival : float, optional
+            The time at which the datagram arrived, on the monotonic clock.
+            Defaults to now.
+        restart : bool, optional
+            Whether the datagram is known to be the first one sent since the
+            robot started, such as a keyframe with a sequence number of zero.
+
+        """
+        if arrival is None:
+            arrival = time.monotonic()
+        self.received += 1
+
+        if restart:
+            self._reset()
+
+        # Extend the sequence number past 32 bits relative to the highest one.
+        reordered = False
+        if self._highest_seq is not None:
+            delta = (seq - self._highest_seq) & 0xFFFFFFFF
+            if delta >= 0x80000000:
+                delta -= 0x100000000
+            if delta < -self.max_reorder:
+                self._reset()
+            else:
+                seq = self._highest_seq + delta
+                reordered = delta < 0
+        if not reordered:
+            self._highest_seq = seq
+
+        transit = arrival - timestamp
+        if self._last_transit is not None:
+            self.jitter += (abs(transit - self._last_transit) - self.jitter) / 16
+        self._last_transit = transit
+
+        self._samples.append((arrival, seq, size, reordered))
+        while self._samples[0][0] < arrival - self.window:
+            self._samples.popleft()
+
+    def _reset(self):
+        """Forget the datagrams in the window and the last transit time."""
+        self._samples.clear()
+        self._highest_seq = None
+        self._last_transit = None
+
+    @property
+    def loss_rate(self):
+        """The fraction of datagrams which were lost."""
+        if not self._samples:
+            return 0
+        seqs = {sample[1] for sample in self._samples}
+        return 1 - len(seqs) / (max(seqs) - min(seqs) + 1)
+
+    @property
+    def reorder_rate(self):
+        """The fraction of datagrams which arrived out of order."""
+        if not self._samples:
+            return 0
+        return sum(sample[3] for sample in self._samples) / len(self._samples)
+
+    @property
+    def packet_rate(self):
+        """The number of datagrams received per second."""
+        return len(self._samples) / self.window
+
+    @property
+    def throughput(self):
+        """The number of bytes received per second."""
+        return sum(sample[2] for sample in self._samples) / self.window
+
+    def summary(self):
+        """
+        Return all the statistics.
+
+        Returns
+        -------
+        dict
+            The `received`, `loss_rate`, `reorder_rate`, `jitter`,
+            `packet_rate`, and `throughput`.
+
+        """
+        return {"received": self.received,
+                "loss_rate": self.loss_rate,
+                "reorder_rate": self.reorder_rate,
+                "jitter": self.jitter,
+                "packet_rate": self.packet_rate,
+                "throughput": self.throughput}
+
+    def __str__(self):
+        return ("{rate:5.1f} datagrams/s  {bytes:7.1f} B/s  "
+                "loss: {loss:5.1%}  reordered: {reorder:5.1%}  "
+                "jitter: {jitter:5.1f} ms"
+                .format(rate=self.packet_rate, bytes=self.throughput,
+                        loss=self.loss_rate, reorder=self.reorder_rate,
+                        jitter=self.jitter * 1000))
 
 
 class Handler(socketserver.BaseRequestHandler):
@@ -34,6 +213,18 @@ class Handler(socketserver.BaseRequestHandler):
     ----------
     request : socket
         Handles communication with the client
+    link_stats : LinkStatistics
+        Statistics about the telemetry received from the client.
+    telemetry : numpy.void
+        The latest telemetry record, as a record of `TELEMETRY_DTYPE`. It is
+        updated in place, so it and views of its fields always hold the latest
+        values.
+    traces : numpy.ndarray
+        The samples batched in the telemetry received in the last cycle, as
+        an array of `SAMPLE_DTYPE`, oldest first. Each field is a per-channel
+        array; for instance, ``traces["currents"]`` has one row per sample.
+        It is a view of a buffer which is reused, and is only valid until the
+        next cycle.
     wheels_single_stick : bool
         Whether the wheels are controlled by only the left analog stick.
     reverse_mode : bool
@@ -45,9 +236,24 @@ class Handler(socketserver.BaseRequestHandler):
         self._logger = logging.getLogger("{client_ip}_handler"
                                          .format(client_ip=client_address[0]))
         self._logger.debug("New handler created")
-        super().__init__(request, client_address, server)
         self.wheels_single_stick = False
         self.reverse_mode = False
+        self._command_seq = 0
+        self.link_stats = LinkStatistics()
+        self._link_stats_timestamp = time.time()
+        self._datagram = bytearray(TELEMETRY_MAX_SIZE)
+        self._telemetry = TelemetryDecoder()
+        raw_telemetry = np.frombuffer(self._telemetry.record,
+                                      dtype=_RAW_TELEMETRY_DTYPE)[0]
+        self.telemetry = np.zeros(1, dtype=TELEMETRY_DTYPE)[0]
+        # (sent field, field in units, scale) of each field.
+        self._telemetry_fields = [(raw_telemetry[name], self.telemetry[name],
+                                   TELEMETRY_SCALES.get(name))
+                                  for name, _, _ in TELEMETRY_FIELDS]
+        self._traces = np.empty(64, dtype=SAMPLE_DTYPE)
+        self.traces = self._traces[:0]
+        self._poses = np.empty((2, 3), dtype=np.float32)
+        super().__init__(request, client_address, server)
 
     def handle(self):
         """
@@ -58,27 +264,31 @@ class Handler(socketserver.BaseRequestHandler):
         and also allows for a much higher communication rate with the robot
         compared to reopening upon each request.
 
-        Pickle is used on the server and client sides to transfer Python
-        objects.
+        Requests and replies are sent as length-prefixed messages through a
+        `FramedStream`.
 
         Requests handled:
 
-        - state : Reply with the state of the controller.
-        - inputs : Reply with the raw input data from the state.
+        - state : Reply with the state of the controller, pickled.
+        - inputs : Reply with the raw input data from the state, pickled.
         - commands : Perform calculations and send the required motor and arm
-          speed data.
+          speed data as a command frame.
+        - stream : Stop handling requests, and push command frames to the
+          client until it disconnects.
         - echo : Reply with what the client has said.
         - print : ``echo``, and print to ``stdout``.
 
         """
         self._logger.info("Connected to client")
         self.request.settimeout(0.5)  # seconds
+        self._channel = FramedStream(self.request)
         self._sticks_timestamp = self._reverse_timestamp = time.time()
 
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sensors_client:
             sensors_client.setsockopt(socket.SOL_SOCKET,
                                             socket.SO_REUSEADDR, True)
             sensors_client.bind(("", 9999))
+            self._sensors_client = sensors_client
             try:
                 self._loop()
             finally:
@@ -88,32 +298,146 @@ class Handler(socketserver.BaseRequestHandler):
         """The main handler loop."""
         while True:
             try:
-                data = self.request.recv(64).decode().strip()
+                message = self._channel.recv()
             except socket.timeout:
                 self._logger.warning("Lost connection to robot")
                 self._logger.info("Robot has shut down motors")
                 continue
-            self._logger.debug('Received: "{data}"'.format(data=data))
+            except BadDataError as e:
+                self._logger.debug(e)
+                continue
 
-            if data == "":  # Client exited
+            if message is None:  # Client exited
                 self._logger.info("Terminating client session")
                 break
 
+            data = bytes(message).decode().strip()
+            self._logger.debug('Received: "{data}"'.format(data=data))
+
+            if data == "stream":
+                self._stream()
+                break
+
             reply = self._generate_reply(data)
+            if isinstance(reply, str):  # Not yet bytecode (e.g., echo)
+                reply = reply.encode()
+            self._channel.send(reply)
+
+            self._receive_sensor_data()
+
+    def _stream(self):
+        """
+        Push command frames to the client until it disconnects.
+
+        A frame is sent whenever the commands change, and at least once per
+        period as given by the server's `push_rate`. The client does not need
+        to request commands, which saves one network traversal per cycle.
+
+        """
+        self._logger.info("Streaming commands at {rate} Hz"
+                          .format(rate=self.server.push_rate))
+        period = 1 / self.server.push_rate
+        next_push = time.time()
+        last_commands = None
+
+        while True:
+            timeout = max(0, min(next_push - time.time(),
+                                 _STREAM_POLL_INTERVAL))
+            readable, o, e = select.select([self.request], [], [], timeout)
+            if readable:
+                try:
+                    message = self._channel.recv()
+                except (socket.timeout, ConnectionResetError) as e:
+                    self._logger.warning("Lost connection to robot: {e}"
+                                         .format(e=e))
+                    message = None
+                if message is None:  # Client exited
+                    self._logger.info("Terminating client session")
+                    break
+
+            state = self.server.controllers["main"].state
+            commands = self._generate_commands(state)
+            current_time = time.time()
+
+            if commands != last_commands or current_time >= next_push:
+                try:
+                    self._channel.send(self._command_frame(*commands))
+                except (BrokenPipeError, ConnectionResetError):
+                    self._logger.info("Terminating client session")
+                    break
+                last_commands = commands
+                next_push = current_time + period
+
+            self._receive_sensor_data()
+
+    def _command_frame(self, motor_commands, arm_commands):
+        """
+        Encode commands into the next command frame.
+
+        Parameters
+        ----------
+        motor_commands : 4-list of float
+            The speeds requested of each motor.
+        arm_commands : 4-tuple of int
+            The commands for the arm servos.
+
+        Returns
+        -------
+        bytes
+            The encoded command frame.
 
+        """
+        frame = encode_commands(motor_commands, arm_commands,
+                                self._command_seq)
+        self._command_seq += 1
+        return frame
+
+    def _receive_sensor_data(self):
+        """
+        Receive all pending sensor data, and log the latest.
+
+        Every datagram is accounted for in `link_stats`, which is logged
+        periodically. Since datagrams are only read between requests, arrival
+        times, and thus the jitter, are only as precise as the handler loop.
+
+        The samples batched in the datagrams are gathered in `traces`.
+
+        """
+        telemetry = None
+        n_samples = 0
+        for raw_data in self._udp_receive():
             try:
-                self.request.sendall(reply.encode())
-            except TypeError:  # Already bytecode (e.g., pickled object)
-                self.request.sendall(reply)
+                header = unpack_telemetry_header(raw_data)
+            except BadDataError as e:
+                self._logger.debug("Bad data received from robot: {e}"
+                                   .format(e=e))
+                continue
 
-            # Receive sensor data
-            raw_data = self._udp_receive(self, size=1024)
+            self.link_stats.update(
+                header.seq, header.timestamp, len(raw_data),
+                restart=header.seq == 0 and
+                bool(header.flags & TELEMETRY_KEYFRAME))
             try:
-                flippers, currents, poses, arm_data = pickle.loads(raw_data)
-                self._log_sensor_data(flippers, currents, poses, arm_data)
-            except (AttributeError, EOFError, IndexError, TypeError) as e:
-                self._logger.debug("No or bad data received from robot: {e}"
+                telemetry = self._decode_telemetry(raw_data)
+            except BadDataError as e:
+                self._logger.debug("Bad data received from robot: {e}"
                                    .format(e=e))
+            if self._telemetry.samples:
+                n_samples = self._gather_samples(n_samples)
+
+        if telemetry is None:
+            self._logger.debug("No data received from robot")
+        else:
+            self._log_sensor_data(telemetry)
+
+        self.traces = self._traces[:n_samples]
+        if n_samples:
+            self._logger.debug("Received {n} samples".format(n=n_samples))
+
+        current_time = time.time()
+        if current_time - self._link_stats_timestamp >= _LINK_STATS_INTERVAL:
+            self._logger.info("Link: {stats}".format(stats=self.link_stats))
+            self._link_stats_timestamp = current_time
 
     def _generate_reply(self, data):
         """
@@ -129,6 +453,10 @@ class Handler(socketserver.BaseRequestHandler):
         str or bytes
             The reply to send back to the client.
 
+        See Also
+        --------
+        common.networking.encode_commands
+
         """
         if data == "state":
                 state = self.server.controllers["main"].state
@@ -142,8 +470,7 @@ class Handler(socketserver.BaseRequestHandler):
                                   buttons.buttons))
         elif data == "commands":
             state = self.server.controllers["main"].state
-            motor_commands, arm_commands = self._generate_commands(state)
-            reply = pickle.dumps(motor_commands, arm_commands)
+            reply = self._command_frame(*self._generate_commands(state))
         elif data.split()[0] == "echo":
             reply = " ".join(data.split()[1:])
         elif data.split()[0] == "print":
@@ -312,6 +639,7 @@ class Handler(socketserver.BaseRequestHandler):
             - yaw
 
         """
+        linear = pitch = yaw = 0
         if buttons.is_pressed("○"):
             linear = dpad.y
         else:
@@ -370,44 +698,119 @@ class Handler(socketserver.BaseRequestHandler):
                 self._logger.info("Reverse mode enabled")
             self._reverse_timestamp = current_time
 
-    def _log_sensor_data(self, flippers, currents, poses, arm_data):
+    def _decode_telemetry(self, raw_data):
+        """
+        Apply a telemetry datagram to the telemetry record.
+
+        Quantized fields are converted back to their units, and missing
+        readings to NaN.
+
+        Parameters
+        ----------
+        raw_data : bytes-like
+            The received datagram.
+
+        Returns
+        -------
+        numpy.void
+            The full telemetry record, `telemetry`.
+
+        Raises
+        ------
+        BadDataError
+            No datagram was received, or it could not be decoded.
+
+        See Also
+        --------
+        common.networking.TelemetryDecoder
+
+        """
+        if raw_data is None:
+            raise BadDataError("No telemetry received")
+
+        self._telemetry.decode(raw_data)
+        for raw, field, scale in self._telemetry_fields:
+            if scale is None:
+                field[:] = raw
+            else:
+                np.divide(raw, scale, out=field)
+                field[raw == QUANTIZED_MISSING] = np.nan
+        return self.telemetry
+
+    def _gather_samples(self, n_samples):
+        """
+        Copy the samples batched in the last telemetry datagram to the traces.
+
+        The traces buffer is grown if needed, but never shrunk, so that it
+        stops being reallocated once it fits the samples of a cycle.
+
+        Parameters
+        ----------
+        n_samples : int
+            The number of samples already gathered this cycle.
+
+        Returns
+        -------
+        int
+            The number of samples gathered this cycle, including the new ones.
+
+        """
+        samples = np.frombuffer(self._telemetry.samples, dtype=SAMPLE_DTYPE)
+        end = n_samples + len(samples)
+        if end > len(self._traces):
+            traces = np.empty(max(end, 2 * len(self._traces)),
+                              dtype=SAMPLE_DTYPE)
+            traces[:n_samples] = self._traces[:n_samples]
+            self._traces = traces
+        self._traces[n_samples:end] = samples
+        return end
+
+    def _log_sensor_data(self, telemetry):
         """
         Log sensor data to debug.
 
+        Nothing is formatted unless debug logging is enabled.
+
         Parameters
         ----------
-        flippers : 2-list of floats
-            ADC data containing flipper positions, in radians.
-        currents : list of 2-list of float
-            Current sensor data containing current (A) and voltage (V) values.
-        poses : list of 3-list of float
-            Pose data containing yaw, pitch, and roll values.
-        arm_data : list of lists and float
-            The data returned from the arm.
+        telemetry : numpy.void
+            A record of `TELEMETRY_DTYPE`. Missing values are NaN.
 
         """
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+
         def check(x):
             """General checker."""
-            return "None  " if x is None else "{:6.3f}".format(x)
+            return "None  " if math.isnan(x) else "{:6.3f}".format(x)
 
         def check_t(x):
             """Check temperature array."""
-            return "None" if x is None else "{4.1f}".format(x)
+            return "None" if math.isnan(x) else "{:4.1f}".format(x)
 
         def check_c(x):
             """Check |CO2| result."""
-            return "None  " if x is None else "{:6.1f}".format(x)
+            return "None  " if math.isnan(x) else "{:6.1f}".format(x)
 
+        flippers = telemetry["flippers"]
+        currents = telemetry["currents"].reshape(4, 2)
         lwheel, rwheel, lflip, rflip = currents
-        front, rear = np.rad2deg(poses)
-        arm_pos, servo_vii, (thermo_l, thermo_r), co2_sensor = arm_data
+        front, rear = np.rad2deg(telemetry["poses"].reshape(2, 3),
+                                 out=self._poses)
+        arm_pos = telemetry["arm_positions"]
+        servo_vii = telemetry["servo_vii"]
+        thermo_l, thermo_r = telemetry["thermo"].reshape(2, 16)
+        co2_sensor = telemetry["co2"][0]
+        duration, slack, overruns, missed = telemetry["loop_timing"]
+        stage_times = telemetry["stage_times"].reshape(-1, 2)
+        body_baud, arm_baud = telemetry["baud_rates"]
 
         self._logger.debug("lflipper: {lf}  rflipper: {rf}"
                            .format(lf=check(flippers[0]),
                                    rf=check(flippers[1])))
         self._logger.debug("total_iv: {i} A  {v} V"
-                           .format(i=check(sum(i[0] for i in currents)),
-                                   v=check(sum(i[1] for i in currents)/4)))
+                           .format(i=check(currents[:, 0].sum()),
+                                   v=check(currents[:, 1].mean())))
         self._logger.debug("lwheel_current: {i} A  {v} V"
                            .format(i=check(lwheel[0]), v=check(lwheel[1])))
         self._logger.debug("rwheel_current: {i} A  {v} V"
@@ -434,69 +837,56 @@ class Handler(socketserver.BaseRequestHandler):
                                    y=check(servo_vii[2])))
         thermo_l_string = " ".join([check_t(i) for i in thermo_l])
         thermo_r_string = " ".join([check_t(i) for i in thermo_r])
-        self._logger.debug("thermo_l: [{l}]".format(thermo_l_string))
-        self._logger.debug("thermo_r: [{r}]".format(thermo_r_string))
+        self._logger.debug("thermo_l: [{l}]".format(l=thermo_l_string))
+        self._logger.debug("thermo_r: [{r}]".format(r=thermo_r_string))
         self._logger.debug("co2_sensor: {c}".format(c=check_c(co2_sensor)))
+        if not math.isnan(duration):
+            self._logger.debug("loop: {d:6.2f} ms  slack: {s:6.2f} ms  "
+                               "overruns: {o:.0f}  missed: {m:.0f}"
+                               .format(d=duration * 1000, s=slack * 1000,
+                                       o=overruns, m=missed))
+        stages = ["{stage} {p50:.2f}/{p99:.2f}".format(stage=stage,
+                                                       p50=p50 * 1000,
+                                                       p99=p99 * 1000)
+                  for stage, (p50, p99) in zip(LOOP_STAGES, stage_times)
+                  if not math.isnan(p50)]
+        if stages:
+            self._logger.debug("stages (p50/p99 ms): {s}"
+                               .format(s="  ".join(stages)))
+        if not math.isnan(body_baud):
+            self._logger.debug("baud body: {b:.0f}  arm: {a}"
+                               .format(b=body_baud,
+                                       a="None" if math.isnan(arm_baud)
+                                       else "{:.0f}".format(arm_baud)))
         self._logger.debug(20 * "=")
 
-    def _udp_get_latest(self, size=1, n_bytes=1):
+    def _udp_receive(self):
         """
-        Get the latest input.
-
-        This function automatically empties the given socket queue.
+        Receive all pending UDP datagrams without blocking.
 
-        Parameters
-        ----------
-        size : int, optional
-            The number of bytes to read at a time.
-        n_bytes : int, optional
-            The number of bytes to return.
+        This function automatically empties the given socket queue. Each
+        datagram is received into the same preallocated buffer.
 
-        Returns
-        -------
-        bytes
-            The last received message, or None if the socket was not ready.
+        Yields
+        ------
+        memoryview
+            A view of each received datagram in the buffer, oldest first. It
+            is only valid until the next datagram is received.
 
         """
-        data = []
-        input_ready, o, e = select.select([self._server_client],
+        view = memoryview(self._datagram)
+        input_ready, o, e = select.select([self._sensors_client],
                                           [], [], 0)  # Check ready.
 
         while input_ready:
-            data.append(input_ready[0].recv(size))  # Read once.
-            input_ready, o, e = select.select([self._server_client],
+            try:
+                n_bytes, address = input_ready[0].recvfrom_into(view)
+            except BlockingIOError:
+                break
+            yield view[:n_bytes]
+            input_ready, o, e = select.select([self._sensors_client],
                                               [], [], 0)  # Check ready.
 
-        if not data:
-            return None
-        elif n_bytes == 1:
-            return data[-1]
-        else:
-            return data[-n_bytes:]
-
-    def _udp_receive(self, size=32):
-        """
-        Receive UDP data without blocking.
-
-        Parameters
-        ----------
-        size : int, optional
-            The number of bytes to read at a time.
-
-        Returns
-        -------
-        recv_msg : bytes
-            The received message, or None if the buffer was empty.
-        """
-        recv_msg = None
-
-        try:
-            recv_msg = self._udp_get_latest(size)
-        except BlockingIOError:
-            pass
-
-        return recv_msg
-
 
 class Server(socketserver.ForkingMixIn, socketserver.TCPServer):
     """
@@ -510,6 +900,9 @@ class Server(socketserver.ForkingMixIn, socketserver.TCPServer):
     handler_class : Handler
         The request handler. Each new request generates a separate process
         running that handler.
+    push_rate : float, optional
+        The minimum rate, in Hz, at which command frames are pushed to clients
+        which requested streaming.
 
     Attributes
     ----------
@@ -517,11 +910,14 @@ class Server(socketserver.ForkingMixIn, socketserver.TCPServer):
         Contains all registered controllers.
 
         **Dictionary format :** {name (str): controller (Controller)}
+    push_rate : float
+        The minimum rate, in Hz, at which command frames are pushed to clients
+        which requested streaming.
 
     """
     allow_reuse_address = True  # Can resume immediately after shutdown
 
-    def __init__(self, server_address, handler_class):
+    def __init__(self, server_address, handler_class, push_rate=20):
         self._logger = logging.getLogger("{ip}_server"
                                          .format(ip=server_address[0]))
         self._logger.debug("Creating server")
@@ -529,6 +925,7 @@ class Server(socketserver.ForkingMixIn, socketserver.TCPServer):
         self._logger.info("Listening to port {port}"
                           .format(port=server_address[1]))
         self.controllers = {}
+        self.push_rate = push_rate
 
     def add_controller(self, controller):
         """
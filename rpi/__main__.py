@@ -1,6 +1,7 @@
 # (C) 2015  Kyoto University Mechatronics Laboratory
 # Released under the GNU General Public License, version 3
 import logging
+import signal
 
 from common.exceptions import YozakuraTimeoutError, NoConnectionError,\
     NoMbedError, UnknownMbedError, I2CSlotEmptyError
@@ -12,6 +13,25 @@ from rpi.motor import Motor
 
 
 LOG_TO_FILE = False
+STREAM_COMMANDS = False  # Have the base station push commands.
+BATCH_SAMPLES = False  # Send queued current and IMU samples with telemetry.
+BACKGROUND_SENSORS = False  # Read the sensors in one thread per bus.
+ASYNC_CLIENT = False  # Run the client on an asyncio event loop.
+CONTROL_RATE = None  # Hz. None runs the loop as fast as commands arrive.
+PROFILE_INTERVAL = 10  # Seconds between reports of the loop stage durations.
+TRACE_FILE = "/tmp/rpi.trace"  # Written on SIGUSR1 and on exit.
+# Hz. None drives the flippers without holding them. Keep it None until the
+# gains of rpi.flippers.FlipperServo are tuned on the robot.
+FLIPPER_RATE = None
+# Seconds. Commands must arrive faster than this, so use it with
+# BACKGROUND_SENSORS or ASYNC_CLIENT. None only stops after a 0.5 s timeout.
+WATCHDOG_DEADLINE = None
+RECONNECT = True  # Reconnect to the base station instead of shutting down.
+BODY_FRAMES = False  # Have the body mbed send binary frames instead of text.
+ARM_FRAMES = False  # Have the arm mbed send binary frames instead of text.
+# Identities of the mbeds by USB serial number. None probes them on each boot.
+MBED_IDENTITY_CACHE = "/var/tmp/yozakura_mbeds.json"
+MAX_BAUDRATE = 921600  # Negotiated with each mbed. None stays at 38400.
 
 
 def main():
@@ -24,7 +44,26 @@ def main():
         opstn_address = "10.249.255.172"
 
     try:
-        client = Client(client_address, (opstn_address, 9999))
+        if ASYNC_CLIENT:
+            from rpi.async_client import AsyncClient
+            client = AsyncClient(client_address, (opstn_address, 9999),
+                                 stream_commands=STREAM_COMMANDS,
+                                 batch_samples=BATCH_SAMPLES,
+                                 rate=CONTROL_RATE,
+                                 profile_interval=PROFILE_INTERVAL,
+                                 flipper_rate=FLIPPER_RATE,
+                                 watchdog_deadline=WATCHDOG_DEADLINE,
+                                 reconnect=RECONNECT)
+        else:
+            client = Client(client_address, (opstn_address, 9999),
+                            stream_commands=STREAM_COMMANDS,
+                            batch_samples=BATCH_SAMPLES,
+                            background_sensors=BACKGROUND_SENSORS,
+                            rate=CONTROL_RATE,
+                            profile_interval=PROFILE_INTERVAL,
+                            flipper_rate=FLIPPER_RATE,
+                            watchdog_deadline=WATCHDOG_DEADLINE,
+                            reconnect=RECONNECT)
     except NoConnectionError as e:
         logging.critical(e.split("! ")[0])
         logging.help(e.split("! ")[1])
@@ -32,6 +71,7 @@ def main():
 
     _initialize_motors(client)
     _initialize_sensors(client)
+    client.tracer.dump_on_signal(TRACE_FILE, signal.SIGUSR1)
 
     try:
         client.run()
@@ -41,6 +81,7 @@ def main():
         print()  # Keep the console log aligned
     finally:
         logging.info("Shutting down...")
+        client.tracer.dump(TRACE_FILE)
         client.shutdown()
 
     logging.info("All done")
@@ -56,7 +97,9 @@ def _initialize_motors(client):
 
     logging.info("Connecting to mbeds")
     try:
-        mbed_arm, mbed_body = Mbed.connect_to_mbeds()
+        mbed_arm, mbed_body = Mbed.connect_to_mbeds(
+            body_frames=BODY_FRAMES, arm_frames=ARM_FRAMES,
+            identity_cache=MBED_IDENTITY_CACHE, max_baudrate=MAX_BAUDRATE)
     except (NoMbedError, UnknownMbedError, YozakuraTimeoutError) as e:
         logging.critical(e)
         Motor.shutdown_all()
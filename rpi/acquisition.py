@@ -0,0 +1,184 @@
+# (C) 2015  Kyoto University Mechatronics Laboratory
+# Released under the GNU General Public License, version 3
+"""
+Acquire sensor data in the background.
+
+Reading a sensor over I2C or serial can take a while, and a slow read should
+not delay the motors. Instead, each bus is read continuously by its own
+`SensorWorker` thread, which stores the latest reading of each sensor in a
+`SensorCache`. The control loop reads the cache, which never blocks.
+
+"""
+from collections import namedtuple
+import logging
+import threading
+import time
+
+from common.exceptions import YozakuraTimeoutError
+
+
+Reading = namedtuple("Reading", "value timestamp")
+
+
+class SensorCache(object):
+    """
+    Store the latest reading of each sensor.
+
+    Readings are stored with the time at which they were taken, and can be
+    updated and read from different threads.
+
+    Examples
+    --------
+    >>> cache = SensorCache()
+    >>> cache.update("co2", 450, timestamp=time.monotonic())
+    >>> cache.get("co2")
+    450
+    >>> cache.get("thermo", default=[None] * 32) == [None] * 32
+    True
+
+    """
+    def __init__(self):
+        self._readings = {}
+
+    def update(self, name, value, timestamp=None):
+        """
+        Store a reading.
+
+        Parameters
+        ----------
+        name : str
+            The name of the sensor.
+        value : object
+            The reading.
+        timestamp : float, optional
+            The time at which the reading was taken. Defaults to now, on the
+            monotonic clock.
+
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self._readings[name] = Reading(value, timestamp)  # Atomic.
+
+    def reading(self, name):
+        """
+        Get the latest reading of a sensor, with its timestamp.
+
+        Parameters
+        ----------
+        name : str
+            The name of the sensor.
+
+        Returns
+        -------
+        Reading
+            A namedtuple containing `value` and `timestamp`, or None if the
+            sensor has not been read yet.
+
+        """
+        return self._readings.get(name)
+
+    def get(self, name, default=None, max_age=None):
+        """
+        Get the latest value of a sensor.
+
+        Parameters
+        ----------
+        name : str
+            The name of the sensor.
+        default : object, optional
+            The value returned if there is no reading, or if it is too old.
+        max_age : float, optional
+            The maximum age of the reading, in seconds.
+
+        Returns
+        -------
+        object
+            The latest value, or `default`.
+
+        """
+        reading = self._readings.get(name)
+        if reading is None:
+            return default
+        if max_age is not None and\
+                time.monotonic() - reading.timestamp > max_age:
+            return default
+        return reading.value
+
+
+class SensorWorker(threading.Thread):
+    """
+    A thread which continuously reads the sensors on one bus.
+
+    The readers are called in order, and each successful reading is stored in
+    the cache. If a reader raises one of the expected errors, the previous
+    reading is kept, and grows older.
+
+    Parameters
+    ----------
+    name : str
+        The name of the bus.
+    cache : SensorCache
+        The cache in which to store the readings.
+    readers : list of 2-tuple of (str, callable)
+        The name of each sensor, and a function returning its reading.
+    period : float, optional
+        The minimum time between two rounds of readings, in seconds.
+    callback : callable, optional
+        A function called with the cache after each round of readings.
+    errors : tuple of Exception, optional
+        The errors which mean that a reader has no new reading.
+
+    Attributes
+    ----------
+    cache : SensorCache
+        The cache in which the readings are stored.
+    period : float
+        The minimum time between two rounds of readings, in seconds.
+
+    """
+    def __init__(self, name, cache, readers, period=0.005, callback=None,
+                 errors=(OSError, ValueError, IndexError,
+                         YozakuraTimeoutError)):
+        super().__init__(name=name, daemon=True)
+        self._logger = logging.getLogger("{name}_worker".format(name=name))
+        self.cache = cache
+        self.period = period
+        self._readers = readers
+        self._callback = callback
+        self._errors = errors
+        self._stop_event = threading.Event()
+
+    def run(self):
+        """Read the sensors until `stop` is called."""
+        self._logger.debug("Worker started")
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            for name, read in self._readers:
+                try:
+                    value = read()
+                except self._errors as e:
+                    self._logger.debug("No reading from {name}: {e}"
+                                       .format(name=name, e=e))
+                else:
+                    self.cache.update(name, value)
+
+            if self._callback is not None:
+                self._callback(self.cache)
+
+            self._stop_event.wait(max(0, self.period -
+                                      (time.monotonic() - start)))
+        self._logger.debug("Worker stopped")
+
+    def stop(self, timeout=1):
+        """
+        Stop the thread, and wait for it to finish its current round.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum time to wait, in seconds.
+
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
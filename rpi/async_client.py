@@ -0,0 +1,310 @@
+# (C) 2015  Kyoto University Mechatronics Laboratory
+# Released under the GNU General Public License, version 3
+"""
+Run the client on an asyncio event loop.
+
+`AsyncClient` controls the robot in the same way as `Client`, but it waits for
+everything at once instead of in turn. A single event loop watches the TCP
+connection to the base station, and the I2C sensors, whose drivers block, are
+read in an executor. Waiting for the network overlaps with reading the
+sensors. The mbeds read their serial ports in threads of their own, and their
+latest lines are used directly.
+
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from common.exceptions import BadDataError, NoConnectionError
+from common.networking import decode_commands, frame, LENGTH_PREFIX_SIZE
+from rpi.client import Client, CURRENT_SENSORS, IMUS, _MISSING_DATA,\
+    _SENSOR_MAX_AGE, TRACE_MOTOR_COMMANDS
+
+
+# The minimum time between two readings of the I2C bus, in seconds.
+_I2C_PERIOD = 0.005
+
+
+class AsyncClient(Client):
+    """
+    A client which runs on an asyncio event loop.
+
+    The parameters, attributes, and methods used to register devices are the
+    same as those of `Client`. The sensors are always acquired in the
+    background, and their latest readings are kept in `sensors`.
+
+    Raises
+    ------
+    NoConnectionError
+        The client cannot connect to the base station.
+
+    See Also
+    --------
+    Client
+
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._i2c = ThreadPoolExecutor(max_workers=1)
+        self._commands = None
+        self._new_commands = None
+        self._writer = None
+
+    def run(self):
+        """
+        Send and handle requests until a `KeyboardInterrupt` is received.
+
+        This method behaves like `Client.run`, but runs an event loop until the
+        connection to the base station is lost. If `reconnect` is set, the
+        client then reconnects, and runs a new event loop.
+
+        Raises
+        ------
+        MotorCountError
+            There are fewer than four motors registered.
+        NoMbedError
+            The body mbed is not registered, or no mbeds are registered.
+        NoConnectionError
+            The base station closed the connection, and `reconnect` is not
+            set.
+
+        """
+        self._check_setup()
+        self._logger.info("Client started")
+
+        if self._flipper_rate:
+            self._start_flipper_servo()
+        if self._watchdog_deadline:
+            self._start_watchdog()
+
+        while True:
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self._run(loop))
+            except NoConnectionError:
+                if not self.reconnect:
+                    raise
+            finally:
+                loop.close()
+            self._reconnect()
+
+    async def _run(self, loop):
+        """
+        Start the tasks reading the network and the sensors, and run the robot.
+
+        Parameters
+        ----------
+        loop : asyncio.AbstractEventLoop
+            The running event loop.
+
+        """
+        self._new_commands = asyncio.Event()
+        reader, self._writer = await asyncio.open_connection(sock=self.request)
+        self._sensors_server.setblocking(False)
+
+        tasks = [loop.create_task(self._receive_frames(reader)),
+                 loop.create_task(self._read_i2c(loop))]
+
+        if self.stream_commands:
+            self._logger.debug("Requesting command stream")
+            self._writer.write(frame("stream".encode()))
+
+        try:
+            await self._control_loop()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._writer.close()
+
+    async def _control_loop(self):
+        """Drive the robot with each new set of commands."""
+        profiler = self.profiler
+        while True:
+            if self.scheduler is not None:
+                await asyncio.sleep(self.scheduler.delay())
+
+            profiler.start()
+            try:
+                motor_commands, arm_commands =\
+                    await asyncio.wait_for(self._next_commands(), 0.5)
+            except asyncio.TimeoutError:
+                if not self._timed_out:
+                    self._handle_timeout()
+                continue
+            else:
+                self.tracer.record(TRACE_MOTOR_COMMANDS, *motor_commands)
+                if self.watchdog is not None:
+                    self.watchdog.feed()
+
+            if self._timed_out:
+                self._logger.info("Connection returned")
+                self._timed_out = False
+
+            profiler.lap("commands")
+
+            flipper_positions = self._get_sensor_data("flipper_positions")
+            profiler.lap("flippers")
+            self._drive_motors(motor_commands, flipper_positions)
+            profiler.lap("motors")
+            self._command_arm(arm_commands)
+            profiler.lap("arm")
+
+            current_data = self._get_sensor_data("current_data")
+            profiler.lap("currents")
+            imu_data = self._get_sensor_data("imu_data")
+            profiler.lap("imus")
+            arm_data = self._get_sensor_data("arm_data")
+            profiler.lap("arm_data")
+
+            self._send_data(flipper_positions, current_data, imu_data,
+                            arm_data)
+            profiler.lap("send")
+            self._report_profile()
+
+    async def _next_commands(self):
+        """
+        Wait for the next command frame.
+
+        Unless `stream_commands` is set, the commands are requested first,
+        and only the reply to this request is returned. Otherwise, only the
+        newest frame received since the last call is returned.
+
+        Returns
+        -------
+        motor_commands : 4-list of float
+            A list of the speeds requested of each motor.
+        arm_commands : 4-tuple of int
+            A list of commands for the arm servos.
+
+        Raises
+        ------
+        NoConnectionError
+            The base station closed the connection.
+
+        """
+        if not self.stream_commands:
+            if self._commands is not None:  # Its request timed out.
+                self._commands = None
+                self._new_commands.clear()
+            self._logger.debug("Requesting commands")
+            self._unanswered += 1
+            self._writer.write(frame("commands".encode()))
+
+        await self._new_commands.wait()
+        self._new_commands.clear()
+        if self._commands is None:
+            if not self.reconnect:
+                self._logger.critical("Base station turned off!")
+            raise NoConnectionError("Base station turned off!")
+
+        commands, self._commands = self._commands, None
+        return commands
+
+    async def _receive_frames(self, reader):
+        """
+        Receive command frames until the connection is closed.
+
+        Frames are read in a task of their own, so that a frame which arrives
+        after its request timed out is still read whole. Unless
+        `stream_commands` is set, such frames are then discarded, since a
+        newer request is awaiting its reply.
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+            The stream from the base station.
+
+        """
+        while True:
+            try:
+                prefix = await reader.readexactly(LENGTH_PREFIX_SIZE)
+                message = await reader.readexactly(int.from_bytes(prefix,
+                                                                  "little"))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self._commands = None
+                self._new_commands.set()
+                return
+
+            if not self.stream_commands:
+                self._unanswered -= 1
+                if self._unanswered > 0:
+                    continue
+
+            try:
+                commands = decode_commands(message)
+            except BadDataError as e:
+                self._logger.debug(e)
+                continue
+            self._commands = commands.motor_commands, commands.arm_commands
+            self._new_commands.set()
+
+    async def _read_i2c(self, loop):
+        """
+        Read the current sensors and the IMUs in the executor, forever.
+
+        If samples are batched, a sample is queued after every reading.
+
+        Parameters
+        ----------
+        loop : asyncio.AbstractEventLoop
+            The running event loop.
+
+        """
+        while True:
+            start = loop.time()
+            current_data = await loop.run_in_executor(
+                self._i2c, self._get_current_data, *CURRENT_SENSORS)
+            imu_data = await loop.run_in_executor(self._i2c,
+                                                  self._get_imu_data, *IMUS)
+            self.sensors.update("current_data", current_data)
+            self.sensors.update("imu_data", imu_data)
+            if self.samples is not None:
+                self._queue_sample(self.sensors)
+            await asyncio.sleep(max(0, _I2C_PERIOD - (loop.time() - start)))
+
+    def _get_sensor_data(self, name):
+        """
+        Get the latest reading of a sensor, without blocking.
+
+        I2C readings older than half a second are treated as missing. The mbed
+        data is taken from the latest line received by the mbed.
+
+        Parameters
+        ----------
+        name : str
+            The name of the data: "flipper_positions", "current_data",
+            "imu_data", or "arm_data".
+
+        Returns
+        -------
+        object
+            The data, as returned by the matching ``_get`` method of `Client`.
+
+        """
+        if name == "arm_data" or (name == "flipper_positions" and
+                                  self.flipper_servo is None):
+            return super()._get_sensor_data(name)
+        return self.sensors.get(name, default=_MISSING_DATA[name],
+                                max_age=_SENSOR_MAX_AGE)
+
+    def _send_data(self, flipper_positions, current_data, imu_data, arm_data):
+        """
+        Send data to base station without blocking.
+
+        If the socket's buffer is full, the datagram is dropped, since a newer
+        one will follow.
+
+        See Also
+        --------
+        Client._send_data
+
+        """
+        try:
+            super()._send_data(flipper_positions, current_data, imu_data,
+                               arm_data)
+        except BlockingIOError:
+            self._logger.debug("Telemetry dropped")
+
+    def shutdown(self):
+        """Shut down the client."""
+        self._i2c.shutdown(wait=False)
+        super().shutdown()
@@ -8,7 +8,9 @@ relays them to the respective mbed.
 
 If the received speed for a flipper is zero, it attempts to hold the position
 based on potentiometer data received from the body mbed. It also does not allow
-the flipper to move beyond the capabilities of the potentiometer.
+the flipper to move beyond the capabilities of the potentiometer. Holding needs
+a `flipper_rate`, at which a `rpi.flippers.FlipperServo` drives the flippers
+independently of the network.
 
 The client also obtains the currents going to individual motors from current
 sensors connected via I2C. In addition, front and rear body pose are returned
@@ -21,16 +23,67 @@ arm.
 All external sensor data is sent back to the base station asynchronously via
 UDP.
 
+Optionally, the sensors can be read in the background by one thread per bus,
+so that a slow sensor does not delay the motors.
+
+The commands and sensor data of each cycle are recorded in a binary trace
+rather than logged, since formatting them would slow down every cycle. See
+`common.tracing`.
+
 """
 from collections import OrderedDict
 import logging
-import pickle
 import socket
+import time
+
+import numpy as np
 
 from common.exceptions import BadDataError, YozakuraTimeoutError,\
     NoConnectionError, NoMbedError, MotorCountError, NoDriversError
+from common.networking import decode_commands, FramedStream,\
+    SampleRing, TelemetryEncoder, LOOP_STAGES
+from common.tracing import event, Tracer
+from rpi.acquisition import SensorCache, SensorWorker
+from rpi.flippers import FlipperServo, parse_positions
 from rpi.motor import Motor
 from rpi.bitfields import ArmPacket
+from rpi.profiling import LoopProfiler
+from rpi.scheduler import LoopScheduler
+from rpi.watchdog import Watchdog
+
+
+CURRENT_SENSORS = ("left_wheel_current", "right_wheel_current",
+                   "left_flipper_current", "right_flipper_current")
+IMUS = ("front_imu", "rear_imu")
+
+# Readings acquired in the background are treated as missing after this long.
+_SENSOR_MAX_AGE = 0.5  # seconds
+
+# Events recorded in the trace on each cycle.
+TRACE_MOTOR_COMMANDS = event("motor_commands",
+                             "{0:+.2f} {1:+.2f} {2:+.2f} {3:+.2f}")
+TRACE_ARM_COMMANDS = event("arm_commands", "mode {0:.0f}  linear {1:+.0f}  "
+                           "pitch {2:+.0f}  yaw {3:+.0f}")
+TRACE_FLIPPERS = event("flipper_positions", "left {0:.3f}  right {1:.3f}")
+TRACE_SERVOS = event("servo_positions", "linear {0:.1f}  pitch {1:.1f}  "
+                     "yaw {2:.1f}")
+TRACE_SERVO_VII = event("servo_vii", "linear {0:.1f} V  pitch {1:.0f} mA  "
+                        "yaw {2:.0f} mA")
+TRACE_THERMO_CO2 = event("thermo_co2", "max left {0:.1f}  max right {1:.1f}  "
+                         "co2 {2:.0f} PPM")
+TRACE_IMU = event("imu_data", "{0:.0f}: roll {1:+.3f}  pitch {2:+.3f}  "
+                  "yaw {3:+.3f}")
+
+# The first and longest delays between two attempts to reconnect.
+_RECONNECT_DELAY = 0.05  # seconds
+_MAX_RECONNECT_DELAY = 2  # seconds
+
+# The data used when a sensor has no valid reading.
+_MISSING_DATA = {"flipper_positions": [None, None],
+                 "current_data": [[None, None]] * len(CURRENT_SENSORS),
+                 "imu_data": [[None, None, None]] * len(IMUS),
+                 "arm_data": ([None] * 3, [None] * 3, [[None] * 16] * 2,
+                              None)}
 
 
 class Client(object):
@@ -44,6 +97,39 @@ class Client(object):
     server_address : 2-tuple of (str, int)
         The address at which the server is listening. The elements are the
         server IP address and the port number respectively.
+    stream_commands : bool, optional
+        Whether the base station should push command frames to the client,
+        instead of the client requesting them on every cycle.
+    keyframe_interval : int, optional
+        The number of telemetry datagrams between two keyframes. Datagrams in
+        between only contain the sensor data which has changed.
+    batch_samples : bool, optional
+        Whether to queue timestamped current and IMU samples, and send them in
+        batches with the telemetry. This keeps samples which are taken faster
+        than the telemetry is sent.
+    background_sensors : bool, optional
+        Whether to read the sensors continuously in background threads, one
+        per bus, instead of once per cycle in the control loop.
+    rate : float, optional
+        The rate of the control loop, in Hz. By default, the loop runs as
+        fast as commands arrive.
+    profile_interval : float, optional
+        The time between two reports of the duration of each stage of the
+        control loop, in seconds.
+    trace_size : int, optional
+        The number of events kept in the trace.
+    flipper_rate : float, optional
+        The rate at which the flippers are driven to hold their position, in
+        Hz. By default, the flippers are driven with the other motors, and do
+        not hold their position.
+    watchdog_deadline : float, optional
+        The maximum age of the last command before the motors are stopped by
+        a watchdog thread, in seconds. By default, the motors are only
+        stopped when the control loop times out waiting for commands.
+    reconnect : bool, optional
+        Whether to reconnect to the base station when the connection is lost,
+        instead of raising `NoConnectionError` from `run`. The devices stay
+        initialised while reconnecting.
 
     Raises
     ------
@@ -57,6 +143,32 @@ class Client(object):
     server_address : 2-tuple of (str, int)
         The address at which the server is listening. The elements are the
         server IP address and the port number respectively.
+    stream_commands : bool
+        Whether the base station pushes command frames to the client.
+    samples : SampleRing
+        The current and IMU samples waiting to be sent, or None if samples are
+        not batched.
+    background_sensors : bool
+        Whether the sensors are read in background threads.
+    sensors : SensorCache
+        The latest sensor readings, if they are read in the background.
+    scheduler : LoopScheduler
+        Paces the control loop and accounts for its timing, or None if the
+        loop is not paced.
+    profiler : LoopProfiler
+        Times each stage of the control loop, as listed in
+        `common.networking.LOOP_STAGES`.
+    tracer : Tracer
+        Records the commands and sensor data of each cycle.
+    flipper_servo : FlipperServo
+        Drives the flippers, or None if they are driven with the other motors.
+    watchdog : Watchdog
+        Stops the motors if commands stop arriving, or None if there is no
+        watchdog.
+    reconnect : bool
+        Whether the client reconnects when the connection is lost.
+    reconnections : int
+        The number of times the client reconnected.
     motors : dict
         Contains all registered motors.
 
@@ -75,17 +187,68 @@ class Client(object):
         **Dictionary format :** {name (str): imu (IMU)}
 
     """
-    def __init__(self, client_address, server_address):
+    def __init__(self, client_address, server_address, stream_commands=False,
+                 keyframe_interval=20, batch_samples=False,
+                 background_sensors=False, rate=None, profile_interval=10,
+                 trace_size=4096, flipper_rate=None, watchdog_deadline=None,
+                 reconnect=False):
         self._logger = logging.getLogger("{ip}_client"
                                          .format(ip=client_address))
         self._logger.debug("Creating client")
+        self._connect(server_address)
+
+        self.server_address = server_address
+        self.stream_commands = stream_commands
+        self._sensors_server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._telemetry = TelemetryEncoder(keyframe_interval)
+        self.samples = SampleRing() if batch_samples else None
+        self.background_sensors = background_sensors
+        self.sensors = SensorCache()
+        self._workers = []
+        self.scheduler = LoopScheduler(rate) if rate else None
+        self.profiler = LoopProfiler(LOOP_STAGES, interval=profile_interval)
+        self.tracer = Tracer(size=trace_size)
+        self.flipper_servo = None
+        self._flipper_rate = flipper_rate
+        self.watchdog = None
+        self._watchdog_deadline = watchdog_deadline
+        self.reconnect = reconnect
+        self.reconnections = 0
+        self.motors = OrderedDict()
+        self.mbeds = {}
+        self.current_sensors = {}
+        self.imus = {}
+
+        self._timed_out = False
+
+    def _connect(self, server_address, timeout=None):
+        """
+        Connect to the base station.
+
+        Parameters
+        ----------
+        server_address : 2-tuple of (str, int)
+            The address at which the server is listening.
+        timeout : float, optional
+            The maximum time to wait for the connection, in seconds. By
+            default, wait as long as the operating system does.
+
+        Raises
+        ------
+        NoConnectionError
+            The client cannot connect to the base station.
+
+        """
         self.request = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.request.settimeout(timeout)
         try:
             self.request.connect(server_address)
         except ConnectionRefusedError:
+            self.request.close()
             raise NoConnectionError("Base station is not connected! " +
                                     "Is the server on?")
         except OSError:
+            self.request.close()
             raise NoConnectionError("Base station is on the wrong network! " +
                                     "Is its IP address is static?")
         self._logger.info("Connected to {server}:{port}"
@@ -93,15 +256,42 @@ class Client(object):
                                   port=server_address[1]))
 
         self.request.settimeout(0.5)  # seconds
+        self._channel = FramedStream(self.request)
+        self._unanswered = 0  # Requests for commands not yet replied to.
 
-        self.server_address = server_address
-        self._sensors_server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.motors = OrderedDict()
-        self.mbeds = {}
-        self.current_sensors = {}
-        self.imus = {}
+    def _reconnect(self):
+        """
+        Reconnect to the base station after the connection was lost.
 
-        self._timed_out = False
+        The motors are stopped first. Attempts are repeated until one
+        succeeds, with the delay between them doubling up to
+        `_MAX_RECONNECT_DELAY`. The mbeds, sensors, and motors are left as
+        they are, so that the robot can resume as soon as it is connected.
+
+        """
+        self._logger.warning("Connection to base station lost; reconnecting")
+        self._stop_motors()
+        self._timed_out = True
+        self.request.close()
+
+        start = time.monotonic()
+        delay = _RECONNECT_DELAY
+        attempts = 1
+        while True:
+            try:
+                self._connect(self.server_address, timeout=_MAX_RECONNECT_DELAY)
+            except NoConnectionError as e:
+                self._logger.debug("Attempt {n} failed: {e}".format(n=attempts,
+                                                                     e=e))
+                time.sleep(delay)
+                delay = min(2 * delay, _MAX_RECONNECT_DELAY)
+                attempts += 1
+            else:
+                break
+
+        self.reconnections += 1
+        self._logger.info("Reconnected after {t:.2f} s ({n} attempts)"
+                          .format(t=time.monotonic() - start, n=attempts))
 
     def add_mbed(self, name, ser):
         """
@@ -194,9 +384,29 @@ class Client(object):
         speed and arm commands from the base station, and manages the outputs.
         It attempts to hold the flipper position if there is no input.
 
-        If the connection is lost, it shuts down the motors as an emergency
+        If the connection is lost, it stops the motors as an emergency
         measure. The motors would continue working if the connection to the
-        base station is re-established.
+        base station is re-established. If a `watchdog_deadline` was given,
+        the motors are stopped by the watchdog as soon as the last command is
+        older than the deadline, even if the loop is blocked.
+
+        If `reconnect` is set, a lost connection is re-established instead,
+        and the loop resumes where it was.
+
+        If `stream_commands` is set, the base station is asked to push command
+        frames, and the client acts on the newest one it has received.
+
+        If `background_sensors` is set, the sensor threads are started first,
+        and the loop only uses their latest readings.
+
+        If a `rate` was given, each cycle starts on a fixed deadline, and the
+        timing of the loop is sent with the telemetry.
+
+        Each stage of the loop is timed. Every `profile_interval` seconds, the
+        percentiles of their durations are logged, and sent with the
+        telemetry until the next report.
+
+        If a `flipper_rate` was given, the flipper servo is started first.
 
         Raises
         ------
@@ -204,23 +414,36 @@ class Client(object):
             There are fewer than four motors registered.
         NoMbedError
             The body mbed is not registered, or no mbeds are registered.
+        NoConnectionError
+            The base station closed the connection, and `reconnect` is not
+            set.
 
         """
-        if len(self.motors) < 4:
-            self._logger.critical("Insufficient motors registered!")
-            raise MotorCountError(len(self.motors))
-
-        if len(self.mbeds) == 0:
-            raise NoMbedError("No mbeds are registered.")
-
-        if "mbed_body" not in self.mbeds:
-            raise NoMbedError("The body mbed is not registered.")
-
+        self._check_setup()
         self._logger.info("Client started")
 
+        if self._flipper_rate:
+            self._start_flipper_servo()
+        if self.background_sensors:
+            self._start_acquisition()
+        if self._watchdog_deadline:
+            self._start_watchdog()
+
+        if self.stream_commands:
+            self._logger.debug("Requesting command stream")
+            self._channel.send("stream".encode())
+            get_commands = self._receive_commands
+        else:
+            get_commands = self._request_commands
+
+        profiler = self.profiler
         while True:
+            if self.scheduler is not None:
+                self.scheduler.wait()
+
+            profiler.start()
             try:
-                motor_commands, arm_commands = self._request_commands()
+                motor_commands, arm_commands = get_commands()
             except BadDataError as e:
                 self._logger.debug(e)
                 continue
@@ -228,40 +451,189 @@ class Client(object):
                 if not self._timed_out:
                     self._handle_timeout()
                 continue
-            except BrokenPipeError:
-                self._logger.critical("Base station turned off!")
-                raise NoConnectionError("Base station turned off!")
+            except ConnectionError:
+                if not self.reconnect:
+                    self._logger.critical("Base station turned off!")
+                    raise NoConnectionError("Base station turned off!")
+                self._reconnect()
+                if self.stream_commands:
+                    self._channel.send("stream".encode())
+                continue
             else:
-                self._logger.debug("Received speeds")
+                self.tracer.record(TRACE_MOTOR_COMMANDS, *motor_commands)
+                if self.watchdog is not None:
+                    self.watchdog.feed()
 
             if self._timed_out:
                 self._logger.info("Connection returned")
                 self._timed_out = False
 
-            flipper_positions = self._get_flipper_positions()
+            profiler.lap("commands")
+
+            flipper_positions = self._get_sensor_data("flipper_positions")
+            profiler.lap("flippers")
             self._drive_motors(motor_commands, flipper_positions)
+            profiler.lap("motors")
             self._command_arm(arm_commands)
+            profiler.lap("arm")
 
-            current_data = self._get_current_data("left_wheel_current",
-                                                  "right_wheel_current",
-                                                  "left_flipper_current",
-                                                  "right_flipper_current")
-            imu_data = self._get_imu_data("front_imu", "rear_imu")
-            arm_data = self._get_arm_data()
+            current_data = self._get_sensor_data("current_data")
+            profiler.lap("currents")
+            imu_data = self._get_sensor_data("imu_data")
+            profiler.lap("imus")
+            arm_data = self._get_sensor_data("arm_data")
+            profiler.lap("arm_data")
 
+            if self.samples is not None and not self._workers:
+                self.samples.append(current_data, imu_data)
             self._send_data(flipper_positions, current_data, imu_data, arm_data)
+            profiler.lap("send")
+            self._report_profile()
+
+    def _report_profile(self):
+        """Log the durations of the stages of the loop, if a report is due."""
+        if self.profiler.due():
+            self.profiler.take_report()
+            self._logger.info("Loop stages: {p}".format(p=self.profiler))
+
+    def _check_setup(self):
+        """
+        Check that the devices needed to run are registered.
+
+        Raises
+        ------
+        MotorCountError
+            There are fewer than four motors registered.
+        NoMbedError
+            The body mbed is not registered, or no mbeds are registered.
+
+        """
+        if len(self.motors) < 4:
+            self._logger.critical("Insufficient motors registered!")
+            raise MotorCountError(len(self.motors))
+
+        if len(self.mbeds) == 0:
+            raise NoMbedError("No mbeds are registered.")
+
+        if "mbed_body" not in self.mbeds:
+            raise NoMbedError("The body mbed is not registered.")
+
+    def _start_flipper_servo(self):
+        """
+        Start driving the flippers in the background.
+
+        The servo reads the body mbed, and stores the flipper positions in
+        `sensors`.
+
+        """
+        self._logger.info("Starting flipper servo")
+        self.flipper_servo = FlipperServo(self.mbeds["mbed_body"],
+                                          list(self.motors.values())[2:],
+                                          rate=self._flipper_rate,
+                                          cache=self.sensors)
+        self.flipper_servo.start()
+
+    def _start_watchdog(self):
+        """Start stopping the motors if commands stop arriving."""
+        self._logger.info("Starting watchdog")
+        self.watchdog = Watchdog(self._watchdog_deadline, self._stop_motors)
+        self.watchdog.start()
+
+    def _start_acquisition(self):
+        """
+        Start reading the sensors in the background.
+
+        The I2C bus, which has the current sensors and the IMUs, gets its own
+        thread. If samples are batched, a sample is queued after every reading
+        of the I2C bus. The mbeds need no thread here, since each `Mbed`
+        already reads its port in the background.
+
+        """
+        self._logger.info("Starting sensor threads")
+        buses = [("i2c", [("current_data",
+                           lambda: self._get_current_data(*CURRENT_SENSORS)),
+                          ("imu_data", lambda: self._get_imu_data(*IMUS))],
+                  None if self.samples is None else self._queue_sample)]
+
+        for name, readers, callback in buses:
+            worker = SensorWorker(name, self.sensors, readers,
+                                  callback=callback)
+            worker.start()
+            self._workers.append(worker)
+
+    def _queue_sample(self, cache):
+        """
+        Queue the latest current and IMU readings as a sample.
+
+        Parameters
+        ----------
+        cache : SensorCache
+            The cache containing the readings.
+
+        """
+        current_data = cache.reading("current_data")
+        imu_data = cache.reading("imu_data")
+        if current_data is not None and imu_data is not None:
+            self.samples.append(current_data.value, imu_data.value,
+                                timestamp=imu_data.timestamp)
+
+    def _get_sensor_data(self, name):
+        """
+        Get the latest data from a sensor.
+
+        If the I2C sensors are read in the background, their latest reading
+        is returned without blocking. Readings older than half a second are
+        treated as missing. Otherwise, the sensor is read now. The mbed data
+        is always read from the latest line received, which never blocks.
+
+        Parameters
+        ----------
+        name : str
+            The name of the data: "flipper_positions", "current_data",
+            "imu_data", or "arm_data".
+
+        Returns
+        -------
+        object
+            The data, as returned by the matching ``_get`` method.
+
+        """
+        if (self._workers and name in ("current_data", "imu_data")) or\
+                (name == "flipper_positions" and
+                 self.flipper_servo is not None):
+            return self.sensors.get(name, default=_MISSING_DATA[name],
+                                    max_age=_SENSOR_MAX_AGE)
+
+        if name == "flipper_positions":
+            return self._get_flipper_positions()
+        elif name == "current_data":
+            return self._get_current_data(*CURRENT_SENSORS)
+        elif name == "imu_data":
+            return self._get_imu_data(*IMUS)
+        else:
+            return self._get_arm_data()
 
     def _handle_timeout(self):
         """Turn off motors in case of a lost connection."""
         self._logger.warning("Lost connection to base station")
         self._logger.info("Turning off motors")
-        Motor.shutdown_all()
+        self._stop_motors()
         self._timed_out = True
 
+    def _stop_motors(self):
+        """Stop all the motors, including the flippers."""
+        if self.flipper_servo is not None:
+            self.flipper_servo.release()
+        Motor.stop_all()
+
     def _request_commands(self):
         """
         Request speed data from base station.
 
+        The base station replies to every request in order, even after the
+        request timed out. The replies to requests which timed out are read
+        and discarded first, so that the commands do not fall behind.
+
         Returns
         -------
         motor_commands : 4-list of float
@@ -280,33 +652,91 @@ class Client(object):
             - pitch
             - yaw
 
+        Raises
+        ------
+        BadDataError
+            No commands, or an invalid command frame, was received.
+        BrokenPipeError
+            The base station closed the connection.
+
+        See Also
+        --------
+        common.networking.decode_commands
+
         """
-        self._logger.debug("Requesting commands")
-        # TODO (murata): Change "speeds" to "commands" in opstn.
-        self.request.send("commands".encode())
-        result = self.request.recv(128)
+        self._channel.send("commands".encode())
+        self._unanswered += 1
+        while self._unanswered:
+            result = self._channel.recv()
+            if result is None:
+                raise BrokenPipeError("Base station closed the connection")
+            self._unanswered -= 1
         if not result:
             raise BadDataError("No motor or arm commands received")
 
-        try:
-            motor_commands, arm_commands = pickle.loads(result)
-        except (pickle.UnpicklingError, EOFError) as e:
-            raise BadDataError("Invalid motor or arm commands received: {e}"
-                               .format(e=e))
+        frame = decode_commands(result)
+        return frame.motor_commands, frame.arm_commands
 
-        return motor_commands, arm_commands
+    def _receive_commands(self):
+        """
+        Receive the newest command frame pushed by the base station.
+
+        This method blocks until at least one complete frame has arrived. Any
+        older frames which have already arrived are discarded.
+
+        Returns
+        -------
+        motor_commands : 4-list of float
+            A list of the speeds requested of each motor.
+        arm_commands : 4-tuple of int
+            A list of commands for the arm servos.
+
+        Raises
+        ------
+        BadDataError
+            An invalid command frame was received.
+        BrokenPipeError
+            The base station closed the connection.
+
+        See Also
+        --------
+        _request_commands
+
+        """
+        result = self._channel.recv(latest=True)
+        if result is None:
+            raise BrokenPipeError("Base station closed the connection")
+
+        frame = decode_commands(result)
+        return frame.motor_commands, frame.arm_commands
 
     def _drive_motors(self, motor_commands, positions):
         """
         Drive all the motors.
 
+        The motors are driven in a single batch, to which the body mbed
+        replies once with the flipper positions. If the flipper servo is
+        running, only the wheels are driven here, and the flipper commands are
+        passed on to the servo, which enforces the limits itself.
+
+        Nothing is driven if the watchdog has stopped the motors since the
+        commands were received, since they are out of date.
+
         Parameters
         ----------
         motor_commands : 4-list of float
             The speeds with which to drive the four motors.
 
         """
-        self._logger.debug("Driving motors")
+        if self.watchdog is not None and self.watchdog.tripped:
+            return
+
+        if self.flipper_servo is not None:
+            self.flipper_servo.set_speeds(motor_commands[2:])
+            Motor.drive_all(motor_commands[:2],
+                            motors=list(self.motors.values())[:2])
+            return
+
         # Stop when approaching potentiometer limits.
         if positions[0] is not None and not 0.05 < positions[0] < 0.95:
             if positions[0] <= 0.05 and motor_commands[2] == -1:
@@ -325,8 +755,7 @@ class Client(object):
                                  .format(pos=positions[1]))
             motor_commands[3] = 0
 
-        for motor, speed in zip(self.motors.values(), motor_commands):
-            motor.drive(speed)
+        Motor.drive_all(motor_commands, motors=self.motors.values())
 
     def _command_arm(self, commands):
         """
@@ -341,7 +770,6 @@ class Client(object):
             A list of commands for the arm servos.
 
         """
-        self._logger.debug("Commanding arm")
         if "mbed_arm" in self.mbeds:
             mode, linear, pitch, yaw = [2 if i == -1 else i for i in commands]
             packet = ArmPacket()
@@ -349,6 +777,7 @@ class Client(object):
             packet.linear = int(linear)
             packet.pitch = int(pitch)
             packet.yaw = int(yaw)
+            self.tracer.record(TRACE_ARM_COMMANDS, mode, linear, pitch, yaw)
 
             self.mbeds["mbed_arm"].write(bytes([packet.as_byte]))
 
@@ -383,18 +812,57 @@ class Client(object):
 
         """
         # TODO (masasin): What is the potentiometer used?
-        self._logger.debug("Requesting mbed body data")
         try:
-            mbed_body_data = self.mbeds["mbed_body"].data
-            positions = [int(i, 16) / 0xFFFF for i in mbed_body_data]
+            return self._read_flipper_positions()
         except (IndexError, ValueError, YozakuraTimeoutError):
             self._logger.debug("Bad mbed flipper data")
-            positions = [None, None]
-        else:
-            self._logger.debug("Received mbed body data")
+            return [None, None]
+
+    def _read_flipper_positions(self):
+        """
+        Read the flipper positions from the body mbed.
+
+        Returns
+        -------
+        positions : 2-list of float
+            The left and right flipper positions.
+
+        Raises
+        ------
+        IndexError, ValueError
+            No valid data was received.
+        YozakuraTimeoutError
+            The latest data from the mbed is too old.
 
-        self._logger.verbose("Flipper positions: {pos}".format(pos=positions))
+        See Also
+        --------
+        _get_flipper_positions
 
+        """
+        return self._parse_flipper_positions(self.mbeds["mbed_body"].data)
+
+    def _parse_flipper_positions(self, mbed_body_data):
+        """
+        Parse a line of data from the body mbed.
+
+        Parameters
+        ----------
+        mbed_body_data : list of str or tuple of int
+            The line, split at spaces, or the values of a frame.
+
+        Returns
+        -------
+        positions : 2-list of float
+            The left and right flipper positions.
+
+        Raises
+        ------
+        IndexError, ValueError
+            The data is invalid.
+
+        """
+        positions = parse_positions(mbed_body_data)
+        self.tracer.record(TRACE_FLIPPERS, *positions)
         return positions
 
     def _get_arm_data(self, ignore=False):
@@ -426,24 +894,76 @@ class Client(object):
             The reading of the carbon dioxide sensor in PPM.
 
         """
-        self._logger.debug("Requesting arm data")
-        if ignore:
-            float_arm_data = [None] * 39
-        else:
+        if not ignore:
             if "mbed_arm" in self.mbeds:
-                self._logger.debug("mbed connected")
                 try:
-                    mbed_arm_data = self.mbeds["mbed_arm"].data
-                    if len(mbed_arm_data) != 39:
-                        raise IndexError("Too few items received")
-                    float_arm_data = [float(i) for i in mbed_arm_data]
+                    return self._read_arm_data()
                 except (IndexError, ValueError, YozakuraTimeoutError) as e:
                     self._logger.debug("Bad mbed sensor data: {e}".format(e=e))
-                    float_arm_data = [None] * 39
             else:
                 self._logger.debug("Arm mbed not in mbeds")
-                float_arm_data = [None] * 39
+        return self._split_arm_data([None] * 39)
+
+    def _read_arm_data(self):
+        """
+        Read the data transmitted by the arm mbed.
+
+        Returns
+        -------
+        list of lists and float
+            The arm data, as returned by `_get_arm_data`.
+
+        Raises
+        ------
+        IndexError, ValueError
+            No valid data was received.
+        YozakuraTimeoutError
+            The latest data from the mbed is too old.
+
+        """
+        return self._parse_arm_data(self.mbeds["mbed_arm"].data)
 
+    def _parse_arm_data(self, mbed_arm_data):
+        """
+        Parse a line of data from the arm mbed.
+
+        Parameters
+        ----------
+        mbed_arm_data : list of str or numpy.ndarray
+            The line, split at spaces, or the values of a frame.
+
+        Returns
+        -------
+        list of lists and float
+            The arm data, as returned by `_get_arm_data`.
+
+        Raises
+        ------
+        IndexError, ValueError
+            The data is invalid.
+
+        """
+        if len(mbed_arm_data) != 39:
+            raise IndexError("Too few items received")
+        if isinstance(mbed_arm_data, np.ndarray):
+            return self._split_arm_data(mbed_arm_data.tolist())
+        return self._split_arm_data([float(i) for i in mbed_arm_data])
+
+    def _split_arm_data(self, float_arm_data):
+        """
+        Split the 39 values sent by the arm mbed.
+
+        Parameters
+        ----------
+        float_arm_data : 39-list of float
+            The values sent by the arm mbed. Servo values of -1 are missing.
+
+        Returns
+        -------
+        list of lists and float
+            The arm data, as returned by `_get_arm_data`.
+
+        """
         positions = [None if i == -1 else i for i in float_arm_data[0:3]]
         servo_vii = [None if i == -1 else i for i in float_arm_data[3:6]]
 
@@ -453,11 +973,11 @@ class Client(object):
 
         co2_sensor = float_arm_data[38]
 
-        self._logger.verbose("Servo positions: {pos}".format(pos=positions))
-        self._logger.verbose("Servo VII: {vii}".format(vii=servo_vii))
-        self._logger.verbose("Left temperature: {tl}".format(tl=thermo_l))
-        self._logger.verbose("Right temperature: {tr}".format(tr=thermo_r))
-        self._logger.verbose("CO2: {ppm} PPM".format(ppm=co2_sensor))
+        if co2_sensor is not None:  # Otherwise, no data was received.
+            self.tracer.record(TRACE_SERVOS, *positions)
+            self.tracer.record(TRACE_SERVO_VII, *servo_vii)
+            self.tracer.record(TRACE_THERMO_CO2, max(thermo_l), max(thermo_r),
+                               co2_sensor)
 
         return positions, servo_vii, thermo_sensors, co2_sensor
 
@@ -478,7 +998,6 @@ class Client(object):
             ``[None, None, None]`` by default.
 
         """
-        self._logger.debug("Requesting current data")
         current_data = []
         for sensor in current_sensors:
             try:
@@ -505,28 +1024,30 @@ class Client(object):
             set to ``[None, None, None]`` by default.
 
         """
-        self._logger.debug("Getting imu data")
         imu_data = []
-        for imu in imus:
+        for i, imu in enumerate(imus):
             try:
                 imu_data.append(self.imus[imu].rpy)
             except (KeyError, OSError) as e:
                 self._logger.debug("Bad IMU data: {e}".format(e=e))
                 imu_data.append([None, None, None])
-
-        self._logger.verbose("Front IMU data: {}".format(imu_data[0]))
-        self._logger.verbose(" Rear IMU data: {}".format(imu_data[1]))
-        self._logger.debug("Got imu data")
+            else:
+                self.tracer.record(TRACE_IMU, i, *imu_data[-1])
         return imu_data
 
-    def _send_data(self, flipper_positions, current_data, imu_data, arm_data,
-                   protocol=2):
+    def _send_data(self, flipper_positions, current_data, imu_data, arm_data):
         """
         Send data to base station.
 
         This method sends data via UDP. UDP is asynchronous, and allows the base
         station to work at a different rate than the robot, and ignore old data.
 
+        The data is packed into a telemetry datagram, with missing values sent
+        as NaN. Only a periodic keyframe contains all the data; the datagrams
+        in between only contain the data which has changed. Queued `samples`
+        are sent with it, as many as fit in a datagram, along with the baud
+        rates of the mbeds.
+
         Parameters
         ----------
         flipper_positions : 2-list of float
@@ -537,24 +1058,22 @@ class Client(object):
             The IMU measurements.
         arm_data : list of lists and float
             The data returned from the arm.
-        protocol : int, optional
-            The protocol to use to pickle the data. The ROS-based base station
-            software uses Python 2, and therefore the maximum usable protocol
-            version is 2. If you are sure that Python 2 will not be
-            used, feel free to use whatever protocol you want.
 
         See Also
         --------
         _get_arm_data
+        common.networking.TelemetryEncoder
 
         """
-        self._logger.debug("Sending data to base station")
-        self._sensors_server.sendto(pickle.dumps((flipper_positions,
-                                                  current_data,
-                                                  imu_data,
-                                                  arm_data),
-                                                 protocol=protocol),
-                                    self.server_address)
+        loop_timing = None if self.scheduler is None\
+            else self.scheduler.timing
+        baud_rates = [self.mbeds[name].baudrate if name in self.mbeds else None
+                      for name in ("mbed_body", "mbed_arm")]
+        datagram = self._telemetry.encode(
+            flipper_positions, current_data, imu_data, arm_data,
+            samples=self.samples, loop_timing=loop_timing,
+            stage_times=self.profiler.flat_report(), baud_rates=baud_rates)
+        self._sensors_server.sendto(datagram, self.server_address)
 
     def _read_last_line(self, ser):
         """
@@ -581,9 +1100,25 @@ class Client(object):
 
     def shutdown(self):
         """Shut down the client."""
+        bytes_sent = sum(motor.bytes_sent for motor in self.motors.values())
+        bytes_saved = sum(motor.bytes_saved for motor in self.motors.values())
+        self._logger.info("Motor bytes sent: {sent}  saved: {saved}"
+                          .format(sent=bytes_sent, saved=bytes_saved))
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            self._logger.info("Watchdog timeouts: {n}".format(
+                n=self.watchdog.timeouts))
         Motor.shutdown_all()
+        if self.scheduler is not None:
+            self._logger.info("Control loop: {s}".format(s=self.scheduler))
+        if self.flipper_servo is not None:
+            self._logger.debug("Stopping flipper servo")
+            self.flipper_servo.stop()
+        self._logger.debug("Stopping sensor threads")
+        for worker in self._workers:
+            worker.stop()
         self._logger.debug("Shutting down connections with mbeds")
-        for mbed in self.mbeds:
+        for mbed in self.mbeds.values():
             mbed.close()
         self._logger.debug("Shutting down client")
         self.request.close()
@@ -0,0 +1,383 @@
+# (C) 2015  Kyoto University Mechatronics Laboratory
+# Released under the GNU General Public License, version 3
+"""
+Hold the flippers in position.
+
+The flippers are driven by a `FlipperServo`, a thread which runs at a fixed
+rate well above that of the network. On each cycle, it reads the flipper
+positions sent by the body mbed, and drives the flipper motors:
+
+- If the operator requests a speed, the flipper is driven at that speed.
+- If the requested speed is zero, the flipper holds the position at which it
+  stopped, using a `PID` controller.
+- A target position can also be set directly, with `FlipperServo.set_target`.
+
+In every case, a flipper is not driven further past the limits of its
+potentiometer. Since holding only depends on the link to the body mbed, it is
+not affected by delays on the wireless network. If the body mbed stops sending
+positions, the flippers are not driven until it sends them again.
+
+Positions range from 0 to 1. The left and right potentiometers turn in
+opposite directions: a positive speed increases the position of the left
+flipper, and decreases that of the right flipper.
+
+"""
+import logging
+import threading
+import time
+
+from rpi.motor import Motor
+from rpi.scheduler import LoopScheduler
+
+
+# The direction in which each flipper's position changes for a positive speed.
+_DIRECTIONS = (1, -1)
+
+
+def parse_positions(fields):
+    """
+    Convert the ADC results sent by the body mbed into flipper positions.
+
+    Parameters
+    ----------
+    fields : list of str or tuple of int
+        The results, as hexadecimal strings if the mbed sends lines of text,
+        or as integers if it sends binary frames.
+
+    Returns
+    -------
+    positions : 2-list of float
+        The left and right flipper positions.
+
+    Raises
+    ------
+    IndexError, ValueError
+        The data is invalid.
+
+    Examples
+    --------
+    >>> parse_positions(["FFFF", "0"])
+    [1.0, 0.0]
+    >>> parse_positions((0xFFFF, 0))
+    [1.0, 0.0]
+
+    """
+    positions = [(int(i, 16) if isinstance(i, str) else i) / 0xFFFF
+                 for i in fields]
+    if len(positions) != 2:
+        raise IndexError("Received {n} flipper positions"
+                         .format(n=len(positions)))
+    return positions
+
+
+class PID(object):
+    """
+    A PID controller with a saturated output.
+
+    The derivative is taken on the measurement rather than on the error, so
+    that changing the target does not cause a spike. The integral stops
+    growing while the output is saturated.
+
+    Parameters
+    ----------
+    kp : float
+        The proportional gain.
+    ki : float, optional
+        The integral gain.
+    kd : float, optional
+        The derivative gain.
+    limit : float, optional
+        The largest magnitude of the output.
+
+    Attributes
+    ----------
+    kp : float
+        The proportional gain.
+    ki : float
+        The integral gain.
+    kd : float
+        The derivative gain.
+    limit : float
+        The largest magnitude of the output.
+
+    Examples
+    --------
+    >>> pid = PID(kp=2, limit=1)
+    >>> pid.update(target=0.5, measurement=0.25, dt=0.005)
+    0.5
+    >>> pid.update(target=0.5, measurement=-1, dt=0.005)
+    1
+
+    """
+    def __init__(self, kp, ki=0, kd=0, limit=1):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.limit = limit
+        self._integral = 0
+        self._last_measurement = None
+
+    def update(self, target, measurement, dt):
+        """
+        Get the next output of the controller.
+
+        Parameters
+        ----------
+        target : float
+            The value to reach.
+        measurement : float
+            The measured value.
+        dt : float
+            The time since the last update, in seconds.
+
+        Returns
+        -------
+        float
+            The output, between -`limit` and `limit`.
+
+        """
+        error = target - measurement
+        if self._last_measurement is None or dt <= 0:
+            derivative = 0
+        else:
+            derivative = -(measurement - self._last_measurement) / dt
+        self._last_measurement = measurement
+
+        integral = self._integral + error * dt
+        output = self.kp * error + self.ki * integral + self.kd * derivative
+        if abs(output) < self.limit:
+            self._integral = integral
+            return output
+        return self.limit if output > 0 else -self.limit
+
+    def reset(self):
+        """Forget the integral and the last measurement."""
+        self._integral = 0
+        self._last_measurement = None
+
+
+class FlipperServo(threading.Thread):
+    """
+    A thread which drives the flippers at a fixed rate.
+
+    The servo uses the latest line received by the body mbed on each cycle,
+    and ignores lines which it has already used. If no line was received for
+    `max_age` seconds, the positions are unknown, and the flippers are
+    stopped.
+
+    Parameters
+    ----------
+    mbed : Mbed
+        The body mbed, which drives the flipper motors and sends their
+        positions.
+    motors : 2-list of Motor
+        The left and right flipper motors.
+    rate : float, optional
+        The rate of the loop, in Hz.
+    gains : 3-tuple of float, optional
+        The proportional, integral, and derivative gains of the controllers.
+        They map an error in position to a motor speed. The defaults are a
+        first guess which has not been tuned on the robot: full speed at an
+        error of an eighth of the travel, with a quarter as much integral
+        gain and a little damping.
+    deadband : float, optional
+        The largest error in position which is left uncorrected, to avoid
+        chattering around the target.
+    limits : 2-tuple of float, optional
+        The lowest and highest positions past which the flippers are not
+        driven.
+    cache : SensorCache, optional
+        A cache in which to store the positions, as "flipper_positions".
+    max_age : float, optional
+        The age in seconds after which the latest positions are unknown.
+
+    Attributes
+    ----------
+    positions : 2-list of float
+        The latest left and right flipper positions. Positions which are
+        unknown are None.
+    max_age : float
+        The age in seconds after which the latest positions are unknown.
+    targets : 2-list of float
+        The positions held by each flipper, or None if it is not holding.
+    scheduler : LoopScheduler
+        Paces the loop.
+
+    """
+    def __init__(self, mbed, motors, rate=200, gains=(8, 2, 0.05),
+                 deadband=0.005, limits=(0.05, 0.95), cache=None,
+                 max_age=0.2):
+        super().__init__(name="flipper_servo", daemon=True)
+        self._logger = logging.getLogger("flipper_servo")
+        self.mbed = mbed
+        self.motors = motors
+        self.scheduler = LoopScheduler(rate)
+        self.deadband = deadband
+        self.limits = limits
+        self.cache = cache
+        self.max_age = max_age
+        self.positions = [None, None]
+        self.targets = [None, None]
+        self._speeds = [0, 0]
+        self._released = True
+        self._controllers = [PID(*gains), PID(*gains)]
+        self._last_sample = None
+        self._stop_event = threading.Event()
+
+    def set_speeds(self, speeds):
+        """
+        Set the speeds requested by the operator.
+
+        A flipper whose speed becomes zero holds its current position.
+
+        Parameters
+        ----------
+        speeds : 2-list of float
+            The requested speeds of the left and right flippers, from -1 to
+            1.
+
+        """
+        targets = list(self.targets)
+        for side, speed in enumerate(speeds):
+            if speed:
+                targets[side] = None
+            elif targets[side] is None and self.positions[side] is not None:
+                targets[side] = self.positions[side]
+                self._controllers[side].reset()
+        self._speeds = list(speeds)
+        self.targets = targets
+        self._released = False
+
+    def set_target(self, side, position):
+        """
+        Drive a flipper to a position, and hold it there.
+
+        Parameters
+        ----------
+        side : int
+            0 for the left flipper, and 1 for the right flipper.
+        position : float
+            The target position, between 0 and 1.
+
+        """
+        self._controllers[side].reset()
+        speeds = list(self._speeds)
+        speeds[side] = 0
+        self._speeds = speeds
+        targets = list(self.targets)
+        targets[side] = position
+        self.targets = targets
+        self._released = False
+
+    def release(self):
+        """
+        Stop driving the flippers until the next call to `set_speeds`.
+
+        A released flipper does not hold its position.
+
+        """
+        self._released = True
+        self._speeds = [0, 0]
+        self.targets = [None, None]
+
+    def run(self):
+        """Drive the flippers until `stop` is called."""
+        self._logger.debug("Flipper servo started")
+        while not self._stop_event.is_set():
+            self.scheduler.wait()
+            try:
+                self._read_positions()
+            except (ValueError, IndexError) as e:
+                self._logger.debug("Bad mbed flipper data: {e}".format(e=e))
+            Motor.drive_all(self._speeds_to_send(), motors=self.motors)
+        Motor.drive_all([0, 0], motors=self.motors)
+        self._logger.info("Flipper servo stopped: {s}"
+                          .format(s=self.scheduler))
+
+    def _read_positions(self):
+        """
+        Read the latest line of positions received from the body mbed, if any.
+
+        The mbed replies to each batch of motor bytes, so the reply to the
+        previous cycle has arrived by now. This method never blocks.
+
+        If the latest line is older than `max_age`, the positions become
+        unknown, and the controllers are reset so that their integrals do not
+        grow while the flippers are stopped.
+
+        Raises
+        ------
+        IndexError, ValueError
+            The line is invalid.
+
+        """
+        sample = self.mbed.latest
+        if sample is None or\
+                time.monotonic() - sample.timestamp > self.max_age:
+            if self.positions != [None, None]:
+                self._logger.warning("No flipper positions for {age:.0f} ms; "
+                                     "flippers stopped"
+                                     .format(age=self.max_age * 1000))
+                self.positions = [None, None]
+                for pid in self._controllers:
+                    pid.reset()
+            return
+        if sample is self._last_sample:
+            return
+        self._last_sample = sample
+
+        positions = parse_positions(sample.fields)
+        self.positions = positions
+        if self.cache is not None:
+            self.cache.update("flipper_positions", positions,
+                              timestamp=sample.timestamp)
+
+    def _speeds_to_send(self):
+        """
+        Get the speed of each flipper motor for this cycle.
+
+        Returns
+        -------
+        2-list of float
+            The speeds of the left and right flipper motors.
+
+        """
+        if self._released:
+            return [0, 0]
+
+        dt = self.scheduler.period
+        low, high = self.limits
+        speeds = []
+        for position, target, speed, pid, direction in zip(
+                self.positions, self.targets, self._speeds,
+                self._controllers, _DIRECTIONS):
+            if position is None:
+                speeds.append(0)
+                continue
+
+            if target is None:
+                effort = speed * direction  # Towards higher positions.
+            elif abs(target - position) <= self.deadband:
+                effort = 0
+            else:
+                effort = pid.update(target, position, dt)
+
+            if (position <= low and effort < 0) or\
+                    (position >= high and effort > 0):
+                effort = 0
+            speeds.append(effort * direction)
+        return speeds
+
+    def stop(self, timeout=1):
+        """
+        Stop the thread, and wait for it to stop the flippers.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum time to wait, in seconds.
+
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
@@ -5,21 +5,444 @@ Provides the Mbed class to interface with the mbed.
 
 The mbeds used in Yozakura are both LPC1768. [#]_
 
+Each `Mbed` reads its serial port continuously in a thread of its own, and
+keeps the latest complete lines in a ring of timestamped samples. Reading the
+data never blocks, and the age of the data is checked explicitly.
+
+By default, the mbeds send lines of text, which are split by a `LineDecoder`.
+They can instead send binary frames. Each frame contains a sequence number,
+the values, and a CRC-16-CCITT of both. It is encoded with Consistent Overhead
+Byte Stuffing (COBS) [#]_, and ends with a zero byte.
+
+- The body mbed sends its raw ADC results as little-endian uint16, decoded by
+  a `FrameDecoder`.
+- The arm mbed sends its data in the layout of `ARM_FRAME`, decoded into a
+  NumPy array by an `ArmFrameDecoder`.
+
+A break resets an mbed: the interface chip of the mbed LPC1768 restarts its
+program, which sends lines of text at the first rate again. The arm mbed also
+homes the arm as it starts, so it is only reset if nothing else works. When the
+RPi closes the port of the arm mbed, it sends `ARM_STOP_FRAMES` to go back to
+lines of text, and negotiates the first rate again. When it opens the port, it
+sends `ARM_STOP_FRAMES` again if the arm mbed answers at the first rate. The
+body mbed has no command to go back to lines of text, and is reset whenever
+the RPi opens its port.
+
+Both mbeds start at the first of `BAUD_RATES`. Once an mbed is identified, a
+faster rate can be negotiated with `Mbed.negotiate_baudrate`. For each rate,
+the RPi sends a request followed by the index of the rate, and the mbed
+acknowledges it with a line "baud RATE" before switching. The RPi then
+switches too, and sends a line which the mbed must echo back. If the echo is
+correct, the RPi confirms with `_BAUD_CONFIRM`, and both sides keep the new
+rate. The mbed then sends its identity at the new rate. Otherwise, both go
+back to the previous rate after a timeout. If the confirmation or its reply
+is lost, the RPi cannot tell which rate the mbed uses, and resets it.
+
 
 References
 ----------
 .. [#] ARM mbed, mbed LPC1768.
        https://developer.mbed.org/platforms/mbed-LPC1768/
+.. [#] Cheshire, S. and Baker, M. "Consistent Overhead Byte Stuffing".
+       IEEE/ACM Transactions on Networking 7.2 (1999), pp. 159-172.
 """
+import binascii
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import glob
+import json
 import logging
+import os
 import shutil
+import struct
+import threading
 import time
 
+import numpy as np
 import serial
 
-from common.exceptions import NoMbedError, UnknownMbedError
-from common.functions import interrupted
+from common.exceptions import NoMbedError, UnknownMbedError,\
+    YozakuraTimeoutError
+from rpi.bitfields import ArmPacket, MotorPacket
+
+
+Sample = namedtuple("Sample", "timestamp fields")
+
+# A negative zero for motor 1. The body mbed then sends binary frames.
+_start_frames = MotorPacket()
+_start_frames.motor_id = 1
+_start_frames.negative = True
+START_FRAMES = _start_frames.as_byte
+
+# Mode 3 with a linear command of 2. The arm mbed then sends binary frames.
+_arm_start_frames = ArmPacket()
+_arm_start_frames.mode = 3
+_arm_start_frames.linear = 2
+ARM_START_FRAMES = _arm_start_frames.as_byte
+
+# Mode 3 with a linear command of 0 and a pitch command of 1. The arm mbed then
+# sends lines of text again.
+_arm_stop_frames = ArmPacket()
+_arm_stop_frames.mode = 3
+_arm_stop_frames.pitch = 1
+ARM_STOP_FRAMES = _arm_stop_frames.as_byte
+
+# The values in a frame from the arm mbed. All but the CO2 reading are sent in
+# tenths, as the text lines were. Missing servo values are -1.
+ARM_FRAME = np.dtype([("positions", "<i2", 3),  # Linear, pitch, yaw.
+                      ("servo_vii", "<i2", 3),  # V, mA, mA.
+                      ("thermo_sensors", "<i2", 32),  # Left, then right.
+                      ("co2_sensor", "<u2")])  # PPM.
+
+# The baud rates which can be negotiated, in increasing order. The index of a
+# rate is sent to the mbeds to request it, so the mbed programs must match.
+BAUD_RATES = (38400, 57600, 115200, 230400, 460800, 921600)
+
+# A negative zero for motor 2. The body mbed then changes its baud rate.
+_set_baud = MotorPacket()
+_set_baud.motor_id = 2
+_set_baud.negative = True
+SET_BAUD = _set_baud.as_byte
+
+# Mode 3 with a linear command of 3. The arm mbed then changes its baud rate.
+_arm_set_baud = ArmPacket()
+_arm_set_baud.mode = 3
+_arm_set_baud.linear = 3
+ARM_SET_BAUD = _arm_set_baud.as_byte
+
+# The identity request, which the mbed answers at the new rate. If it arrives
+# too late, the mbed answers it at the old rate as usual.
+_BAUD_CONFIRM = 7
+_ECHO_LINE = b"echo UUUU 0123456789 ~~~~\n"  # U is 0x55, alternating bits.
+_BAUD_REPLY_TIMEOUT = 0.2  # seconds
+_BAUD_SETTLE_TIME = 0.02  # The mbed switches 5 ms after its reply.
+_BAUD_ECHO_TIMEOUT = 0.1  # seconds
+_BAUD_FALLBACK_TIME = 0.25  # The mbed gives up 200 ms after switching.
+
+# A break resets an mbed. It must be longer than a byte at the slowest rate.
+# The identity is requested again every interval until the mbed answers.
+_BREAK_DURATION = 0.25  # seconds
+_IDENTITY_INTERVAL = 0.1  # seconds
+_IDENTITY_TIMEOUT = 0.5  # seconds, for an mbed which is running.
+_RESET_TIMEOUT = 3  # seconds, for an mbed which is starting up.
+
+# The longest incomplete line or frame kept, in bytes. Longer ones are garbage.
+_MAX_LINE_LENGTH = 4096
+
+_sequence = struct.Struct("<B")
+_crc = struct.Struct("<H")
+
+
+def crc16(data):
+    """
+    Calculate the CRC-16-CCITT of some data, as the mbeds do.
+
+    The polynomial is 0x1021, and the initial value is 0xFFFF.
+
+    Parameters
+    ----------
+    data : bytes
+        The data.
+
+    Returns
+    -------
+    int
+        The CRC.
+
+    Examples
+    --------
+    >>> hex(crc16(b"123456789"))
+    '0x29b1'
+
+    """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def cobs_encode(data):
+    """
+    Encode data with COBS, so that it contains no zero bytes.
+
+    Parameters
+    ----------
+    data : bytes
+        The data to be encoded.
+
+    Returns
+    -------
+    bytes
+        The encoded data, without the trailing zero byte.
+
+    Examples
+    --------
+    >>> cobs_encode(b"\\x11\\x00\\x00\\x22")
+    b'\\x02\\x11\\x01\\x02"'
+    >>> cobs_decode(cobs_encode(b"\\x11\\x00\\x00\\x22"))
+    b'\\x11\\x00\\x00"'
+
+    """
+    encoded = bytearray()
+    for block in data.split(b"\x00"):
+        while len(block) >= 0xFE:
+            encoded.append(0xFF)
+            encoded += block[:0xFE]
+            block = block[0xFE:]
+        encoded.append(len(block) + 1)
+        encoded += block
+    return bytes(encoded)
+
+
+def cobs_decode(data):
+    """
+    Decode data encoded with COBS.
+
+    Parameters
+    ----------
+    data : bytes
+        The encoded data, without the trailing zero byte.
+
+    Returns
+    -------
+    bytes
+        The decoded data.
+
+    Raises
+    ------
+    ValueError
+        The data is not valid COBS.
+
+    """
+    decoded = bytearray()
+    i = 0
+    while i < len(data):
+        code = data[i]
+        end = i + code
+        if not code or end > len(data):
+            raise ValueError("Invalid COBS block at byte {i}".format(i=i))
+        decoded += data[i + 1:end]
+        i = end
+        if code < 0xFF and i < len(data):
+            decoded.append(0)
+    return bytes(decoded)
+
+
+class LineDecoder(object):
+    """
+    Split the output of an mbed into lines of fields.
+
+    Examples
+    --------
+    >>> decoder = LineDecoder()
+    >>> decoder.feed(b"0 FFFF\\n8000 ")
+    [['0', 'FFFF']]
+    >>> decoder.feed(b"0\\n")
+    [['8000', '0']]
+
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Decode the lines completed by some data.
+
+        Parameters
+        ----------
+        data : bytes
+            The data received.
+
+        Returns
+        -------
+        list of list of str
+            The fields of each complete line which is not empty.
+
+        """
+        buffer = self._buffer
+        buffer.extend(data)
+        end = buffer.rfind(b"\n")
+        if end == -1:
+            if len(buffer) > _MAX_LINE_LENGTH:
+                del buffer[:]
+            return []
+        lines = buffer[:end].split(b"\n")
+        del buffer[:end + 1]
+        return [fields for fields in (line.decode(errors="replace").split()
+                                      for line in lines) if fields]
+
+
+class FrameDecoder(object):
+    """
+    Decode the binary frames sent by the body mbed.
+
+    Frames which are corrupted are discarded, and counted.
+
+    Attributes
+    ----------
+    frames : int
+        The number of valid frames decoded.
+    errors : int
+        The number of frames discarded because of a bad encoding or CRC.
+    dropped : int
+        The number of frames which never arrived, according to the sequence
+        numbers.
+
+    Examples
+    --------
+    >>> payload = bytes([0]) + struct.pack("<2H", 0x8000, 0xFFFF)
+    >>> frame = cobs_encode(payload + _crc.pack(crc16(payload))) + b"\\x00"
+    >>> decoder = FrameDecoder()
+    >>> decoder.feed(frame[:3])
+    []
+    >>> decoder.feed(frame[3:])
+    [(32768, 65535)]
+
+    """
+    def __init__(self):
+        self.frames = 0
+        self.errors = 0
+        self.dropped = 0
+        self._buffer = bytearray()
+        self._last_sequence = None
+
+    def feed(self, data):
+        """
+        Decode the frames completed by some data.
+
+        Parameters
+        ----------
+        data : bytes
+            The data received.
+
+        Returns
+        -------
+        list of tuple of int
+            The ADC results in each valid frame.
+
+        """
+        buffer = self._buffer
+        buffer.extend(data)
+        end = buffer.rfind(b"\x00")
+        if end == -1:
+            if len(buffer) > _MAX_LINE_LENGTH:
+                del buffer[:]
+            return []
+        encoded_frames = buffer[:end].split(b"\x00")
+        del buffer[:end + 1]
+
+        results = []
+        for encoded in encoded_frames:
+            try:
+                results.append(self._decode(bytes(encoded)))
+            except ValueError:
+                self.errors += 1
+        return results
+
+    def _decode(self, encoded):
+        """
+        Decode a single frame.
+
+        Parameters
+        ----------
+        encoded : bytes
+            The frame, without its trailing zero byte.
+
+        Returns
+        -------
+        tuple of int
+            The ADC results.
+
+        Raises
+        ------
+        ValueError
+            The frame is invalid.
+
+        """
+        frame = cobs_decode(encoded)
+        payload_size = len(frame) - _crc.size
+        if payload_size < _sequence.size or\
+                (payload_size - _sequence.size) % 2:
+            raise ValueError("Bad frame size: {n}".format(n=len(frame)))
+        payload = frame[:payload_size]
+        crc, = _crc.unpack_from(frame, payload_size)
+        if crc != crc16(payload):
+            raise ValueError("Bad CRC")
+
+        values = self._parse(payload[_sequence.size:])
+
+        sequence, = _sequence.unpack_from(payload)
+        if self._last_sequence is not None:
+            self.dropped += (sequence - self._last_sequence - 1) % 256
+        self._last_sequence = sequence
+        self.frames += 1
+        return values
+
+    def _parse(self, values):
+        """
+        Parse the values in a frame.
+
+        Parameters
+        ----------
+        values : bytes
+            The payload of the frame, after the sequence number.
+
+        Returns
+        -------
+        tuple of int
+            The ADC results.
+
+        """
+        return struct.unpack("<{n}H".format(n=len(values) // 2), values)
+
+
+class ArmFrameDecoder(FrameDecoder):
+    """
+    Decode the binary frames sent by the arm mbed.
+
+    The values are converted all at once, into the 39 values of a line of
+    text: the positions and the voltage and currents of the servos, the 32
+    cells of the thermal sensors, and the CO2 reading.
+
+    Examples
+    --------
+    >>> record = np.zeros(1, ARM_FRAME)
+    >>> record["positions"] = [-10, 1805, 0]
+    >>> record["co2_sensor"] = 450
+    >>> payload = bytes([0]) + record.tobytes()
+    >>> frame = cobs_encode(payload + _crc.pack(crc16(payload))) + b"\\x00"
+    >>> values, = ArmFrameDecoder().feed(frame)
+    >>> values[:3].tolist(), float(values[-1])
+    ([-1.0, 180.5, 0.0], 450.0)
+
+    """
+    def _parse(self, values):
+        """
+        Parse the values in a frame.
+
+        Parameters
+        ----------
+        values : bytes
+            The payload of the frame, after the sequence number.
+
+        Returns
+        -------
+        numpy.ndarray
+            The 39 values, as float.
+
+        Raises
+        ------
+        ValueError
+            The frame has the wrong size.
+
+        """
+        if len(values) != ARM_FRAME.itemsize:
+            raise ValueError("Bad arm frame size: {n}".format(n=len(values)))
+        record = np.frombuffer(values, ARM_FRAME)[0]
+        result = np.empty(39)
+        result[0:3] = record["positions"]
+        result[3:6] = record["servo_vii"]
+        result[6:38] = record["thermo_sensors"]
+        result[0:38] /= 10
+        result[38] = record["co2_sensor"]
+        return result
 
 
 class Mbed(serial.Serial):
@@ -36,6 +459,29 @@ class Mbed(serial.Serial):
         Device name or port number.
     baurdate : int, optional
         The baudrate with which to communicate with the mbed.
+    ring_size : int, optional
+        The number of lines kept in `samples`.
+    max_age : float, optional
+        The age in seconds after which the latest line is too old to be
+        returned by `data`.
+    identity : str, optional
+        The identity of the mbed, if it is already known. The mbed is then
+        not asked for it.
+
+    Attributes
+    ----------
+    samples : deque of Sample
+        The latest lines received, oldest first. Each is a namedtuple
+        containing the `timestamp` at which the line was read, on the
+        monotonic clock, and its `fields`: a list of str, or a tuple of int
+        if the mbed sends frames.
+    max_age : float
+        The age in seconds after which the latest line is too old to be
+        returned by `data`.
+    lines_read : int
+        The number of lines received since the port was opened.
+    decoder : LineDecoder or FrameDecoder
+        Decodes the output of the mbed into lines of fields.
 
     See Also
     --------
@@ -47,50 +493,309 @@ class Mbed(serial.Serial):
            https://developer.mbed.org/platforms/mbed-LPC1768/
 
     """
-    def __init__(self, *args, **kwargs):
-        self._identity = None
+    def __init__(self, *args, ring_size=64, max_age=0.2, identity=None,
+                 **kwargs):
+        self._identity = identity
+        self.samples = deque(maxlen=ring_size)
+        self.max_age = max_age
+        self.lines_read = 0
+        self.decoder = LineDecoder()
+        self._new_sample = threading.Condition()
+        self._reader = None
+        self._stop_reading = threading.Event()
         self._logger = logging.getLogger("mbed-{port}".format(port=args[0]))
         self._logger.debug("Initializing mbed")
+        kwargs.setdefault("timeout", 0.1)  # So that the reader can stop.
         try:
             super().__init__(*args, **kwargs)
         except serial.SerialException:
             self._logger.warning("mbed not connected")
         else:
+            self.flushInput()  # Left over from a previous run.
+            self._reader = threading.Thread(target=self._read_lines,
+                                            name="mbed-{port}".format(
+                                                port=args[0]),
+                                            daemon=True)
+            self._reader.start()
+            self._resume()
             self._logger = logging.getLogger("mbed-{mbed_id}"
                                              .format(mbed_id=self.identity))
             self._logger.debug("mbed initialized")
 
+    def _resume(self):
+        """
+        Bring the mbed back to lines of text at the first rate.
+
+        The mbed may still be sending frames, or using a faster rate, for a
+        previous run. If the arm mbed answers at the first rate, it is told to
+        send lines of text. Otherwise, the mbed is reset.
+
+        """
+        if self._identity != "body" and\
+                self._request_identity(_IDENTITY_TIMEOUT) == "arm":
+            self.write(bytes([ARM_STOP_FRAMES]))
+        else:
+            self._reset()
+
+    def _reset(self):
+        """
+        Reset the mbed with a break, and wait until it answers again.
+
+        The mbed then sends lines of text at the first rate. If it is the arm
+        mbed, it also homes the arm.
+
+        """
+        self._logger.debug("Resetting the mbed")
+        self.baudrate = BAUD_RATES[0]
+        self.sendBreak(_BREAK_DURATION)
+        self.flushInput()
+        self.decoder = LineDecoder()
+        if self._request_identity(_RESET_TIMEOUT) is None:
+            self._logger.warning("No reply after a reset")
+
+    def _request_identity(self, timeout):
+        """
+        Ask the mbed for its identity until it answers.
+
+        The request is sent again every `_IDENTITY_INTERVAL` seconds, since an
+        mbed which is starting up does not answer it.
+
+        Parameters
+        ----------
+        timeout : float
+            The maximum time to wait, in seconds.
+
+        Returns
+        -------
+        str
+            The identity of the mbed, or None if it did not answer in time.
+
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            since = self.lines_read
+            self.write(bytes([7]))
+            remaining = deadline - time.monotonic()
+            sample = self.wait_for_line(min(_IDENTITY_INTERVAL, remaining),
+                                        since=since)
+            if sample is not None:
+                self._identity = sample.fields[0]
+                return self._identity
+            if remaining <= _IDENTITY_INTERVAL:
+                return None
+
+    def _read_lines(self):
+        """Decode lines into `samples` until the port is closed."""
+        while not self._stop_reading.is_set():
+            try:
+                chunk = self.read(max(1, self.inWaiting()))
+            except (OSError, TypeError, serial.SerialException) as e:
+                if not self._stop_reading.is_set():
+                    self._logger.warning("Stopped reading: {e}".format(e=e))
+                return
+            if not chunk:
+                continue
+
+            timestamp = time.monotonic()
+            lines = self.decoder.feed(chunk)
+            if not lines:
+                continue
+            with self._new_sample:
+                for fields in lines:
+                    self.samples.append(Sample(timestamp, fields))
+                self.lines_read += len(lines)
+                self._new_sample.notify_all()
+
+    @property
+    def latest(self):
+        """
+        Return the latest line received, whatever its age.
+
+        Returns
+        -------
+        Sample
+            The timestamp and fields of the line, or None if no line was
+            received yet.
+
+        """
+        try:
+            return self.samples[-1]
+        except IndexError:
+            return None
+
     @property
-    @interrupted(0.2)
     def data(self):
         """
-        Return the latest line in the mbed's output buffer.
+        Return the latest line received.
+
+        This method returns immediately.
+
+        Returns
+        -------
+        list of str or tuple of int
+            The latest line of data, split at spaces, or the values in the
+            latest frame.
+
+        Raises
+        ------
+        YozakuraTimeoutError
+            No line was received in the last `max_age` seconds.
+
+        """
+        sample = self.latest
+        if sample is None:
+            raise YozakuraTimeoutError("No data received from the mbed")
+        age = time.monotonic() - sample.timestamp
+        if age > self.max_age:
+            raise YozakuraTimeoutError("The mbed data is {age:.3f} s old"
+                                       .format(age=age))
+        return sample.fields
+
+    def wait_for_line(self, timeout, since=None):
+        """
+        Wait for a new line to be received.
+
+        Parameters
+        ----------
+        timeout : float
+            The maximum time to wait, in seconds.
+        since : int, optional
+            The value of `lines_read` after which the line must have been
+            received. Defaults to its current value.
+
+        Returns
+        -------
+        Sample
+            The latest line, or None if no new line was received in time.
+
+        """
+        with self._new_sample:
+            if since is None:
+                since = self.lines_read
+            if self._new_sample.wait_for(lambda: self.lines_read > since,
+                                         timeout):
+                return self.latest
+        return None
 
-        If the buffer contains output with no endline, wait for the rest of the
-        line to be printed.
+    def _wait_for_reply(self, replies, timeout, since):
+        """
+        Wait for one of several lines to be received.
 
-        This method will be interrupted after 0.2 seconds if it has not finished
-        by then.
+        Parameters
+        ----------
+        replies : list of list of str
+            The fields of the lines awaited.
+        timeout : float
+            The maximum time to wait, in seconds.
+        since : int
+            The value of `lines_read` after which the line must have been
+            received.
 
         Returns
         -------
         list of str
-            The latest line of data, split at spaces. If the data is invalid,
-            returns a list containing a single empty string.
+            The fields of the first line received among `replies`, or None if
+            none of them was received in time.
 
         """
-        self._logger.debug("Reading data")
-        try:
-            data = self.read(self.inWaiting()).decode().split("\n")
-            if not data[-1]:
-                return data[-2].split()
-            else:
-                return (data[-1] + self.readline().decode()).split()
-        except IndexError:
-            return [""]
-        except (OSError, TypeError) as e:
-            self._logger.warning("An unknown error occured: {}".format(e))
-            return [""]
+        def received():
+            n_new = min(self.lines_read - since, len(self.samples))
+            for sample in list(self.samples)[len(self.samples) - n_new:]:
+                if sample.fields in replies:
+                    return sample.fields
+            return None
+
+        with self._new_sample:
+            return self._new_sample.wait_for(received, timeout)
+
+    def negotiate_baudrate(self, max_baudrate=BAUD_RATES[-1]):
+        """
+        Step the baud rate up as far as both the mbed and the link allow.
+
+        Each rate in `BAUD_RATES` above the current one is tried in turn, and
+        the mbed stays at the last one which passed the echo test and was
+        confirmed. Nothing else may be sent to the mbed in the meantime.
+
+        Parameters
+        ----------
+        max_baudrate : int, optional
+            The highest rate to try.
+
+        Returns
+        -------
+        int
+            The baud rate in use.
+
+        """
+        request = ARM_SET_BAUD if self.identity == "arm" else SET_BAUD
+        for index, baudrate in enumerate(BAUD_RATES):
+            if baudrate <= self.baudrate:
+                continue
+            if baudrate > max_baudrate or\
+                    not self._switch_baudrate(request, index, baudrate):
+                break
+        self._logger.info("Baud rate: {rate}".format(rate=self.baudrate))
+        return self.baudrate
+
+    def _switch_baudrate(self, request, index, baudrate):
+        """
+        Try to switch to a faster baud rate.
+
+        Parameters
+        ----------
+        request : int
+            The byte requesting a new rate from this mbed.
+        index : int
+            The index of the rate in `BAUD_RATES`.
+        baudrate : int
+            The rate.
+
+        Returns
+        -------
+        bool
+            Whether the mbed and the RPi now use the new rate. If not, both
+            use the previous rate, or the first rate if the mbed did not
+            answer the confirmation.
+
+        """
+        previous = self.baudrate
+        since = self.lines_read
+        self.write(bytes([request, index]))
+        reply = self._wait_for_reply([["baud", str(baudrate)], ["baud", "0"]],
+                                     _BAUD_REPLY_TIMEOUT, since)
+        if reply != ["baud", str(baudrate)]:
+            self._logger.debug("{rate} baud refused".format(rate=baudrate))
+            return False
+
+        self.baudrate = baudrate
+        time.sleep(_BAUD_SETTLE_TIME)
+        since = self.lines_read
+        self.write(_ECHO_LINE)
+        if self._wait_for_reply([_ECHO_LINE.decode().split()],
+                                _BAUD_ECHO_TIMEOUT, since):
+            since = self.lines_read
+            self.write(bytes([_BAUD_CONFIRM]))
+            if self._wait_for_reply([[self.identity]], _BAUD_ECHO_TIMEOUT,
+                                    since):
+                self._logger.debug("Switched to {rate} baud"
+                                   .format(rate=baudrate))
+                return True
+
+            # The mbed may or may not have switched. Once it has given up,
+            # a reset puts it back at the first rate.
+            self._logger.warning("No confirmation at {rate} baud; resetting "
+                                 "to {first} baud".format(
+                                     rate=baudrate, first=BAUD_RATES[0]))
+            time.sleep(_BAUD_FALLBACK_TIME)
+            self._reset()
+            return False
+
+        self._logger.warning("Echo test failed at {rate} baud; falling back "
+                             "to {previous} baud".format(rate=baudrate,
+                                                         previous=previous))
+        self.baudrate = previous
+        time.sleep(_BAUD_FALLBACK_TIME)
+        return False
 
     @property
     def identity(self):
@@ -99,10 +804,12 @@ class Mbed(serial.Serial):
 
         The mbed must return a string containing its ID when it receives a char
         with a value of 0x7. In addition, asynchronous mbeds must not produce
-        any new output until the identity has been read (i.e., after a delay
-        of one second).
+        any new output until the identity has been read.
 
-        In order to speed up subsequent reads, the value of identity is cached.
+        The request is repeated for up to one second, and the first line
+        received is taken to be the identity, so this returns as soon as the
+        mbed replies. In order to speed up subsequent reads, the value of
+        identity is cached.
 
         Returns
         -------
@@ -110,16 +817,28 @@ class Mbed(serial.Serial):
             The identity of the mbed, or None if no data was returned.
         """
         if not self._identity:
-            self.write(bytes([7]))
-            time.sleep(1)
-            data = self.data[0]
-            if not data:
-                return None
-            else:
-                self._identity = data
+            self._request_identity(1)
 
         return self._identity
 
+    def use_frames(self):
+        """
+        Ask the mbed to send binary frames instead of lines of text.
+
+        Lines received afterwards are decoded by an `ArmFrameDecoder` if this
+        is the arm mbed, and by a `FrameDecoder` otherwise. The arm mbed is
+        told to go back to lines of text when the port is closed. The body
+        mbed goes back to them when it is reset as the port is opened.
+
+        """
+        self._logger.info("Switching to binary frames")
+        if self.identity == "arm":
+            self.decoder = ArmFrameDecoder()
+            self.write(bytes([ARM_START_FRAMES]))
+        else:
+            self.decoder = FrameDecoder()
+            self.write(bytes([START_FRAMES]))
+
     def write(self, data):
         """
         Write the string data to the port.
@@ -144,19 +863,65 @@ class Mbed(serial.Serial):
             self._logger.debug("Wrote data")
 
     def close(self):
-        """Close the port immediately."""
+        """
+        Close the port.
+
+        The arm mbed is first told to send lines of text at the first rate.
+
+        """
         self._logger.debug("Closing mbed")
+        if isinstance(self.decoder, FrameDecoder):
+            self._logger.info("Frames: {n}  errors: {errors}  dropped: "
+                              "{dropped}".format(n=self.decoder.frames,
+                                                 errors=self.decoder.errors,
+                                                 dropped=self.decoder.dropped))
+        if self._identity == "arm" and self._reader is not None and\
+                self.isOpen():
+            # Leave the arm mbed as the next run expects it, without a reset.
+            if isinstance(self.decoder, ArmFrameDecoder):
+                self.write(bytes([ARM_STOP_FRAMES]))
+                self.decoder = LineDecoder()
+            if self.baudrate != BAUD_RATES[0]:
+                self._switch_baudrate(ARM_SET_BAUD, 0, BAUD_RATES[0])
+        self._stop_reading.set()
         super().close()
+        if self._reader is not None and\
+                self._reader is not threading.current_thread():
+            self._reader.join(1)
         self._logger.debug("mbed closed")
 
     @staticmethod
-    def connect_to_mbeds():
+    def connect_to_mbeds(body_frames=False, arm_frames=False,
+                         identity_cache=None, max_baudrate=None):
         """
         Connect to the arm and body mbed, if attached.
 
         This method requires the body mbed to be attached, and the arm mbed is
         optional.
 
+        Every port is probed at once, in its own thread, so that connecting
+        takes as long as the slowest mbed rather than all of them in turn.
+
+        If an `identity_cache` is given, the identity of each mbed is stored in
+        it against the USB serial number of the mbed. On later connections, an
+        mbed whose serial number is in the cache is not probed. Delete the
+        cache after flashing an mbed with a different program.
+
+        Parameters
+        ----------
+        body_frames : bool, optional
+            Whether the body mbed should send binary frames instead of lines of
+            text.
+        arm_frames : bool, optional
+            Whether the arm mbed should send binary frames instead of lines of
+            text.
+        identity_cache : str, optional
+            The name of the JSON file in which identities are cached.
+        max_baudrate : int, optional
+            The highest baud rate to negotiate with each mbed once it is
+            identified. By default, the mbeds stay at the first of
+            `BAUD_RATES`.
+
         Returns
         -------
         mbed_arm : Mbed
@@ -174,12 +939,25 @@ class Mbed(serial.Serial):
             an unknown identity is attached.
 
         """
-        mbed = mbed_arm = mbed_body = None
+        ports = sorted(glob.glob("/dev/ttyACM*"))
+        cache = _load_identity_cache(identity_cache) if identity_cache else {}
+        serial_numbers = {port: _usb_serial_number(port) for port in ports}
+
+        def connect(port):
+            identity = cache.get(serial_numbers[port])
+            if identity is not None:
+                logging.debug("Cached identity of {p}: {ident}"
+                              .format(p=port, ident=identity))
+            return Mbed(port, baudrate=BAUD_RATES[0], identity=identity)
+
+        with ThreadPoolExecutor(max_workers=max(1, len(ports))) as executor:
+            mbeds = list(executor.map(connect, ports))
+
+        mbed_arm = mbed_body = None
         no_reply = False
 
         try:
-            for port in glob.glob("/dev/ttyACM*"):
-                mbed = Mbed(port, baudrate=38400)
+            for port, mbed in zip(ports, mbeds):
                 identity = mbed._identity
                 if identity is None:
                     logging.warning("The mbed at {p} did not reply"
@@ -199,15 +977,36 @@ class Mbed(serial.Serial):
 
             if not mbed_body:
                 raise NoMbedError("The body mbed is not connected!")
+            if max_baudrate:
+                found = [mbed for mbed in (mbed_body, mbed_arm) if mbed]
+                with ThreadPoolExecutor(max_workers=len(found)) as executor:
+                    list(executor.map(lambda mbed: mbed.negotiate_baudrate(
+                        max_baudrate), found))
+            if body_frames:
+                mbed_body.use_frames()
+            if arm_frames and mbed_arm:
+                mbed_arm.use_frames()
             if not mbed_arm:
                 logging.warning("The arm mbed is not connected!")
                 if no_reply:
                     logging.help("Is the arm on?")
 
         except (NoMbedError, UnknownMbedError):
-            [device.close() for device in (mbed, mbed_arm, mbed_body) if device]
+            [device.close() for device in mbeds]
             raise
 
+        [device.close() for device in mbeds
+         if device is not mbed_arm and device is not mbed_body]
+
+        if identity_cache:
+            identities = {serial_numbers[port]: mbed._identity
+                          for port, mbed in zip(ports, mbeds)
+                          if serial_numbers[port] and mbed._identity}
+            if any(cache.get(number) != identity
+                   for number, identity in identities.items()):
+                cache.update(identities)
+                _save_identity_cache(identity_cache, cache)
+
         return mbed_arm, mbed_body
 
     @staticmethod
@@ -234,3 +1033,78 @@ class Mbed(serial.Serial):
                                 "/dev/ttyACM{}".format(i))
         if extra_numbers:
             logging.warning("ACM ports still active: {}".format(extra_numbers))
+
+
+def _usb_serial_number(port):
+    """
+    Get the USB serial number of the device attached to a port, from sysfs.
+
+    Parameters
+    ----------
+    port : str
+        The device name of the port, such as "/dev/ttyACM0".
+
+    Returns
+    -------
+    str
+        The serial number, or None if it is not known.
+
+    """
+    device = "/sys/class/tty/{name}/device".format(name=os.path.basename(port))
+    # The device is a USB interface, whose parent is the USB device.
+    usb_device = os.path.dirname(os.path.realpath(device))
+    try:
+        with open(os.path.join(usb_device, "serial")) as serial_file:
+            return serial_file.read().strip() or None
+    except OSError:
+        return None
+
+
+def _load_identity_cache(filename):
+    """
+    Read the identities cached by `Mbed.connect_to_mbeds`.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the JSON file.
+
+    Returns
+    -------
+    dict
+        The identity of each mbed, or an empty dictionary if the file cannot
+        be read.
+
+        **Dictionary format :** {serial_number (str): identity (str)}
+
+    """
+    try:
+        with open(filename) as cache_file:
+            return json.load(cache_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring the mbed identity cache: {e}".format(e=e))
+        return {}
+
+
+def _save_identity_cache(filename, cache):
+    """
+    Write the identities of the mbeds to the cache.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the JSON file.
+    cache : dict
+        The identity of each mbed.
+
+        **Dictionary format :** {serial_number (str): identity (str)}
+
+    """
+    try:
+        with open(filename, "w") as cache_file:
+            json.dump(cache, cache_file)
+    except OSError as e:
+        logging.warning("Could not cache the mbed identities: {e}"
+                        .format(e=e))
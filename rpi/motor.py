@@ -9,6 +9,14 @@ used.
 
 The supported motor driver is the Pololu High-Power Motor Driver 18v15. [#]_
 
+Over serial, a motor's byte is only sent when it changes, or when the last one
+is older than the motor's keepalive interval. The serial link is slow, and is
+shared with the replies of the mbed.
+
+All the motors can be driven at once with `Motor.drive_all`, which sends the
+bytes for each serial port in a single write. Each batch ends with
+`END_OF_BATCH`, to which the mbed replies with the flipper positions.
+
 References
 ----------
 .. [#] Pololu, High-Power Motor Driver 18v15 datasheet.
@@ -16,7 +24,7 @@ References
 
 """
 import logging
-from time import sleep
+from time import monotonic, sleep
 
 from RPi import GPIO as gpio
 
@@ -24,6 +32,13 @@ from common.exceptions import BadArgError, MotorCountError, NoDriversError
 from rpi.bitfields import MotorPacket
 
 
+# A negative zero for motor 0. The body mbed replies with the flipper positions.
+_end_of_batch = MotorPacket()
+_end_of_batch.motor_id = 0
+_end_of_batch.negative = True
+END_OF_BATCH = _end_of_batch.as_byte
+
+
 class Motor(object):
     """
     A class representing the motor drivers used on Yozakura.
@@ -54,6 +69,9 @@ class Motor(object):
         28%, and 50% would be scaled up to 60%. Can range between 0 and 1.
     max_speed : float, optional
         The maximum speed to use with the motor. Can range between 0 and 1.
+    keepalive : float, optional
+        The longest time for which an unchanged byte is not resent over
+        serial, in seconds.
 
     Raises
     ------
@@ -88,6 +106,13 @@ class Motor(object):
         The input at which the motor starts responding.
     max_speed : float
         The maximum speed at which to run the motor.
+    keepalive : float
+        The longest time for which an unchanged byte is not resent over
+        serial, in seconds.
+    bytes_sent : int
+        The number of bytes sent over serial.
+    bytes_saved : int
+        The number of unchanged bytes which were not resent.
     motors : list
         Contains all registered motors.
 
@@ -103,7 +128,7 @@ class Motor(object):
     _count = 0
 
     def __init__(self, name, fault_1, fault_2, reset,
-                 start_input=0, max_speed=1):
+                 start_input=0, max_speed=1, keepalive=0.25):
         cls = self.__class__
         if Motor._count == 4:
             raise MotorCountError(Motor._count)
@@ -121,6 +146,11 @@ class Motor(object):
         self.pin_reset = reset
         self.start_input = start_input
         self.max_speed = max_speed
+        self.keepalive = keepalive
+        self.bytes_sent = 0
+        self.bytes_saved = 0
+        self._last_byte = None  # The last byte sent over serial.
+        self._last_sent = 0  # When it was sent.
         self.has_serial = False
         self.has_pwm = False
 
@@ -166,6 +196,7 @@ class Motor(object):
         """
         self.ser = ser
         self.has_serial = True
+        self._last_byte = None
 
     def enable_soft_pwm(self, pwm, direction, frequency=28000):
         """
@@ -211,6 +242,11 @@ class Motor(object):
         speed : float
             A value from -1 to 1 indicating the requested speed.
 
+        Returns
+        -------
+        bool
+            Whether a byte was sent over serial.
+
         Raises
         ------
         BadArgError
@@ -225,9 +261,10 @@ class Motor(object):
         scaled_speed = self._scale_speed(speed)
 
         if self.has_serial:
-            self._transmit(scaled_speed)
+            return self._transmit(scaled_speed)
         elif self.has_pwm:
             self._pwm_drive(scaled_speed)
+            return False
         else:
             raise NoDriversError(self)
 
@@ -275,13 +312,55 @@ class Motor(object):
         speed : float
             A value from -1 to 1 indicating the requested speed.
 
+        Returns
+        -------
+        bool
+            Whether the byte was sent.
+
+        """
+        byte = self._encode(speed)
+        if byte is None:
+            return False
+        self.ser.write(bytes([byte]))
+        return True
+
+    def _encode(self, speed):
+        """
+        Get the byte to send for a speed, if it needs to be sent.
+
+        A zero speed is never encoded as negative, since the mbed reads
+        negative zeros as function calls.
+
+        The byte is not sent if it is the same as the last one, unless the
+        last one was sent more than `keepalive` seconds ago. The byte is
+        counted as sent as soon as it is returned.
+
+        Parameters
+        ----------
+        speed : float
+            A value from -1 to 1 indicating the requested speed.
+
+        Returns
+        -------
+        int
+            The byte, or None if it does not need to be sent.
+
         """
         packet = MotorPacket()
         packet.motor_id = self.motor_id
-        packet.negative = True if speed < 0 else False
         packet.speed = int(abs(speed) * 31)
+        packet.negative = speed < 0 and packet.speed > 0
+
+        now = monotonic()
+        if packet.as_byte == self._last_byte and\
+                now - self._last_sent < self.keepalive:
+            self.bytes_saved += 1
+            return None
 
-        self.ser.write(bytes([packet.as_byte]))
+        self._last_byte = packet.as_byte
+        self._last_sent = now
+        self.bytes_sent += 1
+        return packet.as_byte
 
     def _pwm_drive(self, speed):
         """
@@ -306,11 +385,74 @@ class Motor(object):
         sleep(0.1)
         gpio.output(self.pin_reset, gpio.HIGH)
 
+    @classmethod
+    def drive_all(cls, speeds, motors=None):
+        """
+        Drive several motors at once.
+
+        The bytes of the motors which share a serial port are sent in a single
+        write, followed by `END_OF_BATCH`, so that the mbed replies once per
+        batch. Motors without serial use software PWM.
+
+        Parameters
+        ----------
+        speeds : list of float
+            Values from -1 to 1 indicating the requested speed of each motor.
+        motors : iterable of Motor, optional
+            The motors to drive, in the same order as `speeds`. By default,
+            all registered motors are driven.
+
+        Raises
+        ------
+        BadArgError
+            A requested speed is outside the allowable range.
+        NoDriversError
+            Neither serial nor PWM are enabled for a motor.
+
+        """
+        if motors is None:
+            motors = cls.motors
+
+        batches = {}
+        for motor, speed in zip(motors, speeds):
+            if not -1 <= speed <= 1:
+                raise BadArgError("`speed` should be between -1 and 1.")
+            scaled_speed = motor._scale_speed(speed)
+
+            if motor.has_serial:
+                batch = batches.setdefault(motor.ser, bytearray())
+                byte = motor._encode(scaled_speed)
+                if byte is not None:
+                    batch.append(byte)
+            elif motor.has_pwm:
+                motor._pwm_drive(scaled_speed)
+            else:
+                raise NoDriversError(motor)
+
+        for ser, batch in batches.items():
+            batch.append(END_OF_BATCH)
+            ser.write(bytes(batch))
+
+    @classmethod
+    def stop_all(cls):
+        """
+        Stop all motors, which can be driven again afterwards.
+
+        The stop command is sent to every motor with a driver, even if it was
+        the last command sent.
+
+        """
+        motors = [motor for motor in cls.motors
+                  if motor.has_serial or motor.has_pwm]
+        for motor in motors:
+            motor._last_byte = None
+        cls.drive_all([0] * len(motors), motors=motors)
+
     @classmethod
     def shutdown_all(cls):
         """Shut down all motors."""
         logging.debug("Shutting down all motors")
-        for motor in cls.motors.keys():
+        for motor in list(cls.motors):  # Motors remove themselves.
             motor._shutdown()
         gpio.cleanup()
         logging.info("All motors shut down")
@@ -319,6 +461,7 @@ class Motor(object):
         """Shut down the motor."""
         cls = self.__class__
         self._logger.debug("Shutting down motor")
+        self._last_byte = None  # Always send the stop command.
         try:
             self.drive(0)
         except NoDriversError:
@@ -0,0 +1,250 @@
+# (C) 2015  Kyoto University Mechatronics Laboratory
+# Released under the GNU General Public License, version 3
+"""
+Time the stages of a loop.
+
+Each stage of the loop is timed with `time.perf_counter_ns`, and its durations
+are counted in a `Histogram` of fixed size, so that profiling can run for as
+long as the robot does. Percentiles are read from the histograms periodically,
+and the histograms are then cleared, so that each report covers the last
+interval only.
+
+"""
+from collections import OrderedDict
+import time
+
+
+# Each power of two is split into this many buckets, so that the width of a
+# bucket is at most a quarter of its lower bound.
+_SUB_BUCKETS = 4
+_SUB_BITS = 2
+_MAX_BITS = 36  # 2**36 ns is over a minute.
+_N_BUCKETS = (_MAX_BITS - _SUB_BITS + 1) * _SUB_BUCKETS
+
+
+def _bucket(value):
+    """Get the index of the bucket containing a non-negative integer."""
+    if value < _SUB_BUCKETS:
+        return value
+    bits = value.bit_length()
+    sub_bucket = (value >> (bits - _SUB_BITS - 1)) & (_SUB_BUCKETS - 1)
+    return min(_N_BUCKETS - 1, (bits - _SUB_BITS) * _SUB_BUCKETS + sub_bucket)
+
+
+def _lower_bound(index):
+    """Get the smallest integer contained in a bucket."""
+    if index < _SUB_BUCKETS:
+        return index
+    octave, sub_bucket = divmod(index, _SUB_BUCKETS)
+    return (_SUB_BUCKETS + sub_bucket) << (octave - 1)
+
+
+class Histogram(object):
+    """
+    Count durations in logarithmically spaced buckets.
+
+    The histogram uses the same memory however many durations it counts.
+    Percentiles are accurate to within an eighth of their value.
+
+    Attributes
+    ----------
+    count : int
+        The number of durations counted.
+    max : int
+        The longest duration counted, in nanoseconds.
+
+    Examples
+    --------
+    >>> histogram = Histogram()
+    >>> for duration in range(1000, 101000, 1000):
+    ...     histogram.record(duration)
+    >>> 45000 < histogram.percentile(50) < 55000
+    True
+
+    """
+    def __init__(self):
+        self._counts = [0] * _N_BUCKETS
+        self.count = 0
+        self.max = 0
+
+    def record(self, duration):
+        """
+        Count a duration.
+
+        Parameters
+        ----------
+        duration : int
+            The duration, in nanoseconds.
+
+        """
+        self._counts[_bucket(max(0, duration))] += 1
+        self.count += 1
+        if duration > self.max:
+            self.max = duration
+
+    def percentile(self, q):
+        """
+        Estimate a percentile of the durations.
+
+        Parameters
+        ----------
+        q : float
+            The percentile, between 0 and 100.
+
+        Returns
+        -------
+        float
+            The middle of the bucket containing the percentile, in nanoseconds,
+            but no more than `max`. None if no durations were counted.
+
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank and count:
+                break
+        middle = (_lower_bound(index) + _lower_bound(index + 1)) / 2
+        return min(middle, self.max)
+
+    def reset(self):
+        """Forget every duration counted."""
+        self._counts = [0] * _N_BUCKETS
+        self.count = 0
+        self.max = 0
+
+
+class LoopProfiler(object):
+    """
+    Time each stage of a loop.
+
+    Call `start` at the beginning of each cycle, and `lap` at the end of each
+    stage. A stage lasts from the previous call to either method.
+
+    Parameters
+    ----------
+    stages : iterable of str
+        The names of the stages.
+    interval : float, optional
+        The time between two reports, in seconds.
+    percentiles : tuple of float, optional
+        The percentiles reported for each stage.
+
+    Attributes
+    ----------
+    histograms : OrderedDict
+        The durations of each stage since the last report.
+
+        **Dictionary format :** {stage (str): histogram (Histogram)}
+    interval : float
+        The time between two reports, in seconds.
+    percentiles : tuple of float
+        The percentiles reported for each stage.
+    report : OrderedDict
+        The percentiles of each stage at the last report, in seconds. Stages
+        which did not run have None instead.
+
+        **Dictionary format :** {stage (str): percentiles (tuple of float)}
+
+    Examples
+    --------
+    >>> profiler = LoopProfiler(["sleep"], interval=0)
+    >>> profiler.start()
+    >>> time.sleep(0.01)
+    >>> profiler.lap("sleep")
+    >>> profiler.due()
+    True
+    >>> profiler.take_report()
+    >>> 0.008 < profiler.report["sleep"][0] < 0.02
+    True
+
+    """
+    def __init__(self, stages, interval=10, percentiles=(50, 99)):
+        self.histograms = OrderedDict((stage, Histogram())
+                                      for stage in stages)
+        self.interval = interval
+        self.percentiles = percentiles
+        self.report = OrderedDict((stage, (None,) * len(percentiles))
+                                  for stage in stages)
+        self._last = None
+        self._last_report = time.monotonic()
+
+    def start(self):
+        """Start timing a cycle."""
+        self._last = time.perf_counter_ns()
+
+    def lap(self, stage):
+        """
+        End a stage, and start the next one.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage which ended.
+
+        """
+        now = time.perf_counter_ns()
+        self.histograms[stage].record(now - self._last)
+        self._last = now
+
+    def due(self):
+        """
+        Check whether the next report is due.
+
+        Returns
+        -------
+        bool
+            Whether `interval` has passed since the last report.
+
+        """
+        return time.monotonic() - self._last_report >= self.interval
+
+    def take_report(self):
+        """Update `report` from the histograms, and clear them."""
+        for stage, histogram in self.histograms.items():
+            self.report[stage] = tuple(
+                None if value is None else value / 1e9
+                for value in (histogram.percentile(q)
+                              for q in self.percentiles))
+            histogram.reset()
+        self._last_report = time.monotonic()
+
+    def flat_report(self):
+        """
+        Get `report` as a flat tuple, for telemetry.
+
+        Returns
+        -------
+        tuple of float
+            The percentiles of each stage in turn, in seconds.
+
+        """
+        return tuple(value for values in self.report.values()
+                     for value in values)
+
+    def summary(self):
+        """
+        Get a one-line summary of `report`.
+
+        Returns
+        -------
+        str
+            The percentiles of each stage which ran, in milliseconds.
+
+        """
+        stages = []
+        for stage, values in self.report.items():
+            if values[0] is None:
+                continue
+            stages.append("{stage} {values}".format(
+                stage=stage,
+                values="/".join("{:.2f}".format(value * 1000)
+                                for value in values)))
+        return "p{q} ms: {stages}".format(
+            q="/".join("{:g}".format(q) for q in self.percentiles),
+            stages="  ".join(stages) if stages else "no cycles")
+
+    def __str__(self):
+        return self.summary()
@@ -0,0 +1,152 @@
+# (C) 2015  Kyoto University Mechatronics Laboratory
+# Released under the GNU General Public License, version 3
+"""
+Run loops at a fixed rate.
+
+The deadlines of a `LoopScheduler` are absolute: cycle `k` ends at ``t0 + k *
+period`` on the monotonic clock, however long the previous cycles took. Errors
+therefore do not accumulate, and the loop keeps a deterministic rate as long
+as it keeps up.
+
+A cycle which ends after its deadline is an overrun. The next cycle starts
+immediately, and any deadlines which passed entirely during the overrun are
+counted as missed, and skipped rather than caught up with.
+
+"""
+import time
+
+
+class LoopScheduler(object):
+    """
+    Pace a loop at a fixed rate, and account for its timing.
+
+    Call `wait` at the start of each cycle, or `delay` and sleep for the
+    returned time if the loop must not block (e.g. in an event loop).
+
+    Parameters
+    ----------
+    rate : float
+        The rate of the loop, in Hz.
+
+    Attributes
+    ----------
+    period : float
+        The duration of a cycle, in seconds.
+    cycles : int
+        The number of cycles completed.
+    overruns : int
+        The number of cycles which ended after their deadline.
+    missed : int
+        The number of deadlines skipped because of overruns.
+    duration : float
+        How long the last cycle took, in seconds.
+    slack : float
+        How long before its deadline the last cycle ended, in seconds. It is
+        negative if the cycle overran.
+    max_duration : float
+        The longest duration of a cycle.
+    min_slack : float
+        The smallest slack of a cycle.
+
+    Examples
+    --------
+    >>> scheduler = LoopScheduler(rate=100)
+    >>> for _ in range(3):
+    ...     scheduler.wait()
+    ...     # Do some work here.
+    >>> scheduler.cycles
+    2
+
+    """
+    def __init__(self, rate):
+        self.period = 1 / rate
+        self.cycles = 0
+        self.overruns = 0
+        self.missed = 0
+        self.duration = None
+        self.slack = None
+        self.max_duration = None
+        self.min_slack = None
+        self._start = None  # When the current cycle started.
+        self._deadline = None  # When the current cycle should end.
+
+    def delay(self):
+        """
+        End the current cycle, and get the time until the next one starts.
+
+        The first call starts the first cycle.
+
+        Returns
+        -------
+        float
+            The time to sleep before starting the next cycle, in seconds.
+
+        """
+        now = time.monotonic()
+        if self._deadline is None:
+            self._start = now
+            self._deadline = now + self.period
+            return 0
+
+        self.cycles += 1
+        self.duration = now - self._start
+        self.slack = self._deadline - now
+        if self.max_duration is None or self.duration > self.max_duration:
+            self.max_duration = self.duration
+        if self.min_slack is None or self.slack < self.min_slack:
+            self.min_slack = self.slack
+
+        if self.slack >= 0:
+            self._start = self._deadline
+            self._deadline += self.period
+            return self.slack
+
+        missed = int(-self.slack // self.period)
+        self.overruns += 1
+        self.missed += missed
+        self._start = now
+        self._deadline += (missed + 1) * self.period
+        return 0
+
+    def wait(self):
+        """End the current cycle, and sleep until the next one starts."""
+        time.sleep(self.delay())
+
+    @property
+    def timing(self):
+        """
+        The timing of the loop, for telemetry.
+
+        Returns
+        -------
+        4-tuple of float
+            The duration and slack of the last cycle in seconds, and the
+            numbers of overruns and missed deadlines. The duration and slack
+            are None until the first cycle ends.
+
+        """
+        return self.duration, self.slack, self.overruns, self.missed
+
+    def summary(self):
+        """
+        Get a one-line summary of the timing of the loop.
+
+        Returns
+        -------
+        str
+            The rate, the longest cycle and the smallest slack in
+            milliseconds, and the numbers of overruns and missed deadlines.
+
+        """
+        if not self.cycles:
+            return "{rate:.0f} Hz: no cycles".format(rate=1 / self.period)
+        return ("{rate:.0f} Hz: {cycles} cycles  max {duration:.2f} ms  "
+                "min slack {slack:.2f} ms  {overruns} overruns  "
+                "{missed} missed"
+                .format(rate=1 / self.period, cycles=self.cycles,
+                        duration=self.max_duration * 1000,
+                        slack=self.min_slack * 1000, overruns=self.overruns,
+                        missed=self.missed))
+
+    def __str__(self):
+        return self.summary()
@@ -0,0 +1,126 @@
+# (C) 2015  Kyoto University Mechatronics Laboratory
+# Released under the GNU General Public License, version 3
+"""
+Stop the robot when commands stop arriving.
+
+The control loop can block for a while, for instance on a slow sensor or on
+the network, and would not notice that the base station went silent until it
+is done. A `Watchdog` thread instead tracks the age of the last valid command
+on its own, and stops the motors as soon as it is older than a deadline.
+
+"""
+from collections import deque
+import logging
+import threading
+import time
+
+
+class Watchdog(threading.Thread):
+    """
+    A thread which stops the robot if it is not fed in time.
+
+    Call `feed` whenever a valid command is received. If the last command
+    becomes older than `deadline`, `on_timeout` is called once, and the time it
+    took to act is recorded. Feeding the watchdog again rearms it.
+
+    Parameters
+    ----------
+    deadline : float
+        The maximum age of the last command, in seconds.
+    on_timeout : callable
+        The function which stops the robot.
+
+    Attributes
+    ----------
+    deadline : float
+        The maximum age of the last command, in seconds.
+    tripped : bool
+        Whether the deadline passed since the watchdog was last fed.
+    timeouts : int
+        The number of times the deadline passed.
+    reaction_times : deque of float
+        How long after the deadline `on_timeout` returned, for the latest
+        timeouts, in seconds.
+
+    Examples
+    --------
+    >>> stops = []
+    >>> watchdog = Watchdog(0.01, lambda: stops.append(True))
+    >>> watchdog.start()
+    >>> watchdog.feed()
+    >>> time.sleep(0.05)
+    >>> watchdog.tripped, stops
+    (True, [True])
+    >>> watchdog.stop()
+
+    """
+    def __init__(self, deadline, on_timeout):
+        super().__init__(name="watchdog", daemon=True)
+        self._logger = logging.getLogger("watchdog")
+        self.deadline = deadline
+        self.on_timeout = on_timeout
+        self.tripped = False
+        self.timeouts = 0
+        self.reaction_times = deque(maxlen=100)
+        self._last_fed = None
+        self._stop_event = threading.Event()
+
+    def feed(self):
+        """Record that a valid command was just received."""
+        self._last_fed = time.monotonic()
+        if self.tripped:
+            self.tripped = False
+            self._logger.info("Commands returned")
+
+    def run(self):
+        """Watch the age of the last command until `stop` is called."""
+        self._logger.debug("Watchdog started")
+        while not self._stop_event.is_set():
+            last_fed = self._last_fed
+            if last_fed is None or self.tripped:
+                self._stop_event.wait(self.deadline / 4)
+                continue
+
+            expiry = last_fed + self.deadline
+            remaining = expiry - time.monotonic()
+            if remaining > 0:
+                self._stop_event.wait(remaining)
+                continue
+
+            if self._last_fed == last_fed:
+                self._trip(expiry)
+        self._logger.debug("Watchdog stopped")
+
+    def _trip(self, expiry):
+        """
+        Stop the robot, and record how long it took.
+
+        Parameters
+        ----------
+        expiry : float
+            When the deadline passed, on the monotonic clock.
+
+        """
+        self.tripped = True
+        self.timeouts += 1
+        self.on_timeout()
+        reaction_time = time.monotonic() - expiry
+        self.reaction_times.append(reaction_time)
+        self._logger.warning("No commands for {age:.0f} ms; stopped "
+                             "{reaction:.1f} ms after the deadline"
+                             .format(age=self.deadline * 1000,
+                                     reaction=reaction_time * 1000))
+
+    def stop(self, timeout=1):
+        """
+        Stop the thread.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum time to wait, in seconds.
+
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
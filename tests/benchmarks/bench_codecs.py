@@ -0,0 +1,290 @@
+# (C) 2015  Kyoto University Mechatronics Laboratory
+# Released under the GNU General Public License, version 3
+"""
+Measure the cost of every message which crosses the link.
+
+For each message and each codec which can carry it, the payload size and the
+mean encoding and decoding times over the fastest of several runs are
+measured. The messages are:
+
+- commands : The reply to a ``commands`` request, or a pushed command frame.
+- state : The reply to a ``state`` request.
+- inputs : The reply to an ``inputs`` request.
+- telemetry : The sensor data sent by `rpi.client.Client._send_data`.
+
+Run from the root folder using ``python3 -m tests.benchmarks.bench_codecs``.
+No hardware is needed. Pass ``--json results.json`` to also save the results as
+JSON, so that runs on different machines and commits can be compared.
+
+Each telemetry codec is meant to encode faster than pickling the same data,
+which is what the Raspberry Pi did before, or within the factor given in
+`BASELINES` when every cycle changes the data. Pass ``--check`` to exit with an
+error if one does not.
+
+"""
+import argparse
+from itertools import cycle
+import json
+import pickle
+import platform
+import sys
+import time
+import timeit
+
+from common.networking import encode_commands, decode_commands,\
+    SampleRing, TelemetryDecoder, TelemetryEncoder
+from opstn.controller import Buttons, Position, State
+
+
+MOTOR_COMMANDS = [0.73, -0.41, 1, 0]
+ARM_COMMANDS = (0, 1, -1, 0)
+
+STATE = State(Position(0, 1), Position(0.25, -0.5, inverted=True),
+              Position(0.125, 0.75, inverted=True),
+              Buttons("Logitech Logitech RumblePad 2 USB",
+                      [0, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0]))
+INPUTS = ((0, 1), (0.25, -0.5), (0.125, 0.75),
+          [0, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0])
+
+FLIPPERS = [0.4172, 0.6031]
+CURRENTS = [[1.52, 12.1], [1.48, 12.1], [0.31, 12.2], [0.29, 12.2]]
+POSES = [[0.0123, -0.0456, 1.5708], [0.0119, -0.0461, 1.5711]]
+ARM_DATA = ([200.0, 250.0, 300.0], [11.5, 100.0, 125.0],
+            [[20.5 + i / 10 for i in range(16)],
+             [21.5 - i / 10 for i in range(16)]], 452.0)
+MISSING_ARM_DATA = ([None] * 3, [None] * 3, [[None] * 16] * 2, None)
+LOOP_TIMING = (0.0042, 0.0058, 3, 1)
+STAGE_TIMES = (0.0021, 0.0093) * 8
+N_SAMPLES = 10  # Samples queued per datagram when batching.
+
+# Flipper positions, currents, and poses change on every cycle, unlike the
+# arm data. Successive cycles and samples use each of these in turn.
+MOVING = [([position + i / 1000 for position in FLIPPERS],
+           [[current + i / 100, voltage] for current, voltage in CURRENTS],
+           [[angle + i / 10000 for angle in pose] for pose in POSES])
+          for i in range(N_SAMPLES)]
+
+# The codec which each telemetry codec is compared to, and how many times as
+# long it may take to encode. Packing every field which changed cannot beat
+# pickle in pure Python, so the moving and batched cases only have to stay
+# within a fixed factor of it.
+BASELINES = {"keyframe": ("pickle", 1),
+             "quantized": ("pickle", 1),
+             "no-arm": ("pickle", 1),
+             "delta": ("pickle", 1),
+             "moving": ("pickle-moving", 3),
+             "batch-{n}".format(n=N_SAMPLES): ("pickle-batch", 2)}
+
+N_LOOPS = 10000
+N_REPEATS = 5  # Only the fastest run counts, to leave out other processes.
+
+
+def _time(statement, n_loops):
+    """Return the mean duration of `statement` in microseconds."""
+    return min(timeit.repeat(statement, number=n_loops,
+                             repeat=N_REPEATS)) / n_loops * 1e6
+
+
+def _measure(message, codec, encode, decode, n_loops):
+    """
+    Measure a codec for a message.
+
+    Parameters
+    ----------
+    message : str
+        The name of the message.
+    codec : str
+        The name of the codec.
+    encode : callable
+        Encode the message, and return the payload.
+    decode : callable
+        Decode a payload.
+    n_loops : int
+        The number of times each function is run.
+
+    Returns
+    -------
+    dict
+        The `message`, `codec`, payload size in bytes, and mean encoding and
+        decoding times in microseconds.
+
+    """
+    payload = encode()
+    return {"message": message,
+            "codec": codec,
+            "bytes": len(payload),
+            "encode_us": _time(encode, n_loops),
+            "decode_us": _time(lambda: decode(payload), n_loops)}
+
+
+def _telemetry_codecs():
+    """
+    Get the telemetry codecs.
+
+    Returns
+    -------
+    list of 3-tuple
+        The name, encoding function, and decoding function of each codec.
+
+    """
+    keyframes = TelemetryEncoder(keyframe_interval=1)
+    deltas = TelemetryEncoder(keyframe_interval=2**31)
+    moving = TelemetryEncoder(keyframe_interval=2**31)
+    batches = TelemetryEncoder(keyframe_interval=2**31)
+    ring = SampleRing()
+    cycles = cycle(MOVING)
+
+    decoder = TelemetryDecoder()
+    decoder.decode(deltas.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA))
+    moving_decoder = TelemetryDecoder()
+    moving_decoder.decode(moving.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA))
+    batches.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA)
+
+    def pickle_moving():
+        return pickle.dumps((*next(cycles), ARM_DATA), protocol=2)
+
+    def encode_moving():
+        return moving.encode(*next(cycles), ARM_DATA)
+
+    def pickle_batch():
+        samples = []
+        for flippers, currents, poses in MOVING:
+            samples.append((time.monotonic(), currents, poses))
+        return pickle.dumps(((FLIPPERS, CURRENTS, POSES, ARM_DATA), samples),
+                            protocol=2)
+
+    def encode_batch():
+        for flippers, currents, poses in MOVING:
+            ring.append(currents, poses)
+        return batches.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA,
+                              samples=ring)
+
+    def decode_batch(payload):
+        decoder.decode(payload)
+        return decoder.samples
+
+    sensor_data = (FLIPPERS, CURRENTS, POSES, ARM_DATA)
+    return [
+        ("pickle", lambda: pickle.dumps(sensor_data, protocol=2),
+         pickle.loads),
+        ("keyframe",
+         lambda: keyframes.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA),
+         TelemetryDecoder().decode),
+        # Every quantized field is set, or every arm value is missing.
+        ("quantized",
+         lambda: keyframes.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA,
+                                  loop_timing=LOOP_TIMING,
+                                  stage_times=STAGE_TIMES),
+         TelemetryDecoder().decode),
+        ("no-arm",
+         lambda: keyframes.encode(FLIPPERS, CURRENTS, POSES,
+                                  MISSING_ARM_DATA),
+         TelemetryDecoder().decode),
+        ("delta",
+         lambda: deltas.encode([0.42, 0.6], CURRENTS, POSES, ARM_DATA),
+         decoder.decode),
+        ("pickle-moving", pickle_moving, pickle.loads),
+        ("moving", encode_moving, moving_decoder.decode),
+        # Encoding includes queueing the samples.
+        ("pickle-batch", pickle_batch, pickle.loads),
+        ("batch-{n}".format(n=N_SAMPLES), encode_batch, decode_batch),
+    ]
+
+
+def run(n_loops=N_LOOPS):
+    """
+    Run every benchmark.
+
+    Parameters
+    ----------
+    n_loops : int, optional
+        The number of times each function is run.
+
+    Returns
+    -------
+    list of dict
+        The results of each benchmark, as given by `_measure`.
+
+    """
+    codecs = [
+        ("commands", "pickle",
+         lambda: pickle.dumps((MOTOR_COMMANDS, ARM_COMMANDS), protocol=2),
+         pickle.loads),
+        ("commands", "frame",
+         lambda: encode_commands(MOTOR_COMMANDS, ARM_COMMANDS, seq=0),
+         decode_commands),
+        ("state", "pickle", lambda: pickle.dumps(STATE.data), pickle.loads),
+        ("inputs", "pickle", lambda: pickle.dumps(INPUTS), pickle.loads),
+    ]
+    codecs.extend(("telemetry", codec, encode, decode)
+                  for codec, encode, decode in _telemetry_codecs())
+
+    return [_measure(message, codec, encode, decode, n_loops)
+            for message, codec, encode, decode in codecs]
+
+
+def check(results):
+    """
+    Compare the encoding time of each telemetry codec to its baseline.
+
+    Each codec in `BASELINES` may take at most the given number of times as
+    long as its baseline.
+
+    Parameters
+    ----------
+    results : list of dict
+        The results of each benchmark, as given by `run`.
+
+    Returns
+    -------
+    list of str
+        A description of each codec which is too slow.
+
+    """
+    encode_us = {result["codec"]: result["encode_us"] for result in results
+                 if result["message"] == "telemetry"}
+    return ["{codec} encodes in {us:.2f} us, over {ratio} times {baseline} "
+            "({baseline_us:.2f} us)".format(codec=codec, us=encode_us[codec],
+                                            ratio=ratio, baseline=baseline,
+                                            baseline_us=encode_us[baseline])
+            for codec, (baseline, ratio) in BASELINES.items()
+            if encode_us[codec] > ratio * encode_us[baseline]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--json", metavar="PATH",
+                        help="save the results as JSON")
+    parser.add_argument("--loops", type=int, default=N_LOOPS,
+                        help="number of runs of each function")
+    parser.add_argument("--check", action="store_true",
+                        help="fail if a telemetry codec encodes too slowly "
+                             "compared to its baseline")
+    args = parser.parse_args()
+
+    results = run(args.loops)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"machine": platform.machine(),
+                       "python": platform.python_version(),
+                       "loops": args.loops,
+                       "results": results}, json_file, indent=2)
+
+    print("{:<10} {:<13} {:>6} {:>12} {:>12}".format("message", "codec",
+                                                     "bytes", "encode (us)",
+                                                     "decode (us)"))
+    for result in results:
+        print("{message:<10} {codec:<13} {bytes:>6} {encode_us:>12.2f} "
+              "{decode_us:>12.2f}".format(**result))
+
+    if args.check:
+        failures = check(results)
+        for failure in failures:
+            print(failure, file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
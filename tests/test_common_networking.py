@@ -0,0 +1,303 @@
+import math
+import socket
+
+import numpy as np
+from nose.tools import assert_equal, assert_is_none, assert_true, raises
+
+from common.exceptions import BadDataError
+from common.networking import encode_commands, decode_commands,\
+    quantize, quantize_array, dequantize, frame, FramedStream, SampleRing,\
+    TelemetryDecoder, TelemetryEncoder, COMMAND_FRAME_SIZE, QUANTIZED_MISSING,\
+    SAMPLE_SIZE, TELEMETRY_SCALES
+
+
+FLIPPERS = [0.25, None]
+CURRENTS = [[1.5, 12], [None, None], [0.5, 11.5], [0, 12.25]]
+POSES = [[0.125, -0.25, 3], [None, None, None]]
+ARM_DATA = ([200, 250, None], [11.5, 100, 125],
+            [[20.5] * 16, [-1.5] * 16], 450)
+
+
+def test_command_frame_round_trip():
+    frame = encode_commands([0.25, -0.5, 1, -1], (2, 1, 0, -1), seq=42,
+                            timestamp=1234.5)
+    assert_equal(len(frame), COMMAND_FRAME_SIZE)
+    seq, timestamp, motor_commands, arm_commands = decode_commands(frame)
+    assert_equal(seq, 42)
+    assert_equal(timestamp, 1234.5)
+    assert_equal(motor_commands, [0.25, -0.5, 1, -1])
+    assert_equal(arm_commands, (2, 1, 0, -1))
+
+
+def test_command_frame_sequence_wraps():
+    frame = encode_commands([0, 0, 0, 0], (0, 0, 0, 0), seq=2**32 + 5)
+    assert_equal(decode_commands(frame).seq, 5)
+
+
+@raises(BadDataError)
+def test_command_frame_bad_length():
+    decode_commands(encode_commands([0, 0, 0, 0], (0, 0, 0, 0), seq=0)[:-1])
+
+
+@raises(BadDataError)
+def test_command_frame_bad_version():
+    frame = encode_commands([0, 0, 0, 0], (0, 0, 0, 0), seq=0)
+    decode_commands(bytes([0xFF]) + frame[1:])
+
+
+def test_telemetry_round_trip():
+    decoder = TelemetryDecoder()
+    decoder.decode(TelemetryEncoder().encode(FLIPPERS, CURRENTS, POSES,
+                                             ARM_DATA))
+    telemetry = decoder.unpack()
+    assert_equal(telemetry["flippers"][0], 0.25)
+    assert_equal(telemetry["currents"][4:], (0.5, 11.5, 0, 12.25))
+    assert_equal(telemetry["poses"][:3], (0.125, -0.25, 3))
+    assert_equal(telemetry["arm_positions"][:2], (200, 250))
+    assert_equal(telemetry["servo_vii"], (11.5, 100, 125))
+    assert_equal(telemetry["thermo"], (20.5,) * 16 + (-1.5,) * 16)
+    assert_equal(telemetry["co2"], (450,))
+
+
+def test_telemetry_missing_values_are_nan():
+    decoder = TelemetryDecoder()
+    decoder.decode(TelemetryEncoder().encode(FLIPPERS, CURRENTS, POSES,
+                                             ARM_DATA))
+    telemetry = decoder.unpack()
+    assert_true(math.isnan(telemetry["flippers"][1]))
+    assert_true(all(math.isnan(i) for i in telemetry["currents"][2:4]))
+    assert_true(all(math.isnan(i) for i in telemetry["poses"][3:]))
+    assert_true(math.isnan(telemetry["arm_positions"][2]))
+
+
+def test_telemetry_baud_rates():
+    decoder = TelemetryDecoder()
+    decoder.decode(TelemetryEncoder().encode(FLIPPERS, CURRENTS, POSES,
+                                             ARM_DATA,
+                                             baud_rates=[921600, None]))
+    body_baud, arm_baud = decoder.unpack()["baud_rates"]
+    assert_equal(body_baud, 921600)
+    assert_true(math.isnan(arm_baud))
+
+
+def test_telemetry_deltas_only_contain_changes():
+    encoder = TelemetryEncoder(keyframe_interval=3)
+    keyframe = encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA)
+    unchanged = encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA)
+    changed = encoder.encode([0.5, None], CURRENTS, POSES, ARM_DATA)
+    assert_true(len(unchanged) < len(changed) < len(keyframe))
+    assert_equal(len(encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA)),
+                 len(keyframe))
+
+
+def test_telemetry_deltas_rebuild_state():
+    encoder = TelemetryEncoder(keyframe_interval=10)
+    decoder = TelemetryDecoder()
+    decoder.decode(encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA))
+    decoder.decode(encoder.encode([0.5, 0.75], CURRENTS, POSES, ARM_DATA))
+    assert_equal(decoder.unpack()["flippers"], (0.5, 0.75))
+    assert_equal(decoder.unpack()["co2"], (450,))
+
+    # Fields which return to their keyframe values are restored.
+    decoder.decode(encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA))
+    assert_equal(decoder.unpack()["flippers"][0], 0.25)
+
+
+@raises(BadDataError)
+def test_telemetry_delta_without_keyframe():
+    encoder = TelemetryEncoder()
+    encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA)
+    TelemetryDecoder().decode(encoder.encode(FLIPPERS, CURRENTS, POSES,
+                                             ARM_DATA))
+
+
+def test_telemetry_sequence_numbers():
+    encoder = TelemetryEncoder()
+    decoder = TelemetryDecoder()
+    for seq in range(3):
+        decoder.decode(encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA))
+        assert_equal(decoder.seq, seq)
+    assert_true(decoder.timestamp > 0)
+
+
+@raises(BadDataError)
+def test_telemetry_rejects_old_deltas():
+    encoder = TelemetryEncoder()
+    decoder = TelemetryDecoder()
+    decoder.decode(encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA))
+    old = encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA)
+    decoder.decode(encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA))
+    decoder.decode(old)
+
+
+@raises(BadDataError)
+def test_telemetry_bad_length():
+    TelemetryDecoder().decode(TelemetryEncoder().encode(FLIPPERS, CURRENTS,
+                                                        POSES, ARM_DATA)
+                              + bytes(1))
+
+
+def test_quantize_round_trip_error():
+    for scale in set(TELEMETRY_SCALES.values()):
+        for i in range(-20000, 20000, 7):
+            value = i / 7.3 / scale
+            error = abs(dequantize(quantize(value, scale), scale) - value)
+            assert_true(error <= 0.5 / scale, (value, scale, error))
+
+
+def test_quantize_saturates():
+    assert_equal(quantize(1e6, 10), 0x7FFF)
+    assert_equal(quantize(-1e6, 10), -0x7FFF)
+
+
+def test_quantize_missing():
+    assert_equal(quantize(None, 10), QUANTIZED_MISSING)
+    assert_equal(quantize(float("nan"), 10), QUANTIZED_MISSING)
+    assert_true(math.isnan(dequantize(QUANTIZED_MISSING, 10)))
+
+
+def test_quantize_array_matches_quantize():
+    values = [i / 7.3 for i in range(-5000, 5000, 3)] + [0.25, 0.35, 1e6,
+                                                         -1e6, None]
+    expected = [quantize(value, 10) for value in values]
+    assert_equal(quantize_array(np.array(values, dtype=float), 10).tolist(),
+                 expected)
+
+
+def test_telemetry_quantized_round_trip_error():
+    arm_data = ([123.44, 250.06, 300], [11.57, 1200.5, 0.04],
+                [[20.46 + i / 10 for i in range(16)], [-1.54] * 16], 452.4)
+    decoder = TelemetryDecoder()
+    decoder.decode(TelemetryEncoder().encode(FLIPPERS, CURRENTS, POSES,
+                                             arm_data))
+    telemetry = decoder.unpack()
+    for name, sent in (("arm_positions", arm_data[0]),
+                       ("servo_vii", arm_data[1]),
+                       ("thermo", arm_data[2][0] + arm_data[2][1]),
+                       ("co2", [arm_data[3]])):
+        for value, received in zip(sent, telemetry[name]):
+            assert_true(abs(received - value) <= 0.5 / TELEMETRY_SCALES[name],
+                        (name, value, received))
+
+
+def test_telemetry_batched_samples():
+    ring = SampleRing()
+    for i in range(3):
+        ring.append(CURRENTS, POSES, timestamp=i)
+    decoder = TelemetryDecoder()
+    decoder.decode(TelemetryEncoder().encode(FLIPPERS, CURRENTS, POSES,
+                                             ARM_DATA, samples=ring))
+    assert_equal(len(ring), 0)
+    samples = decoder.unpack_samples()
+    assert_equal(samples["timestamp"], [0, 1, 2])
+    assert_equal(samples["currents"][2][:2], (1.5, 12))
+    assert_true(math.isnan(samples["poses"][0][3]))
+
+
+def test_telemetry_batch_respects_byte_budget():
+    ring = SampleRing()
+    for i in range(10):
+        ring.append(CURRENTS, POSES, timestamp=i)
+    keyframe_size = len(TelemetryEncoder().encode(FLIPPERS, CURRENTS, POSES,
+                                                  ARM_DATA))
+    encoder = TelemetryEncoder(max_size=keyframe_size + 1 +
+                               3 * SAMPLE_SIZE + SAMPLE_SIZE // 2)
+    datagram = encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA,
+                              samples=ring)
+    assert_true(len(datagram) <= encoder.max_size)
+    assert_equal(len(ring), 10 - 3)
+
+    decoder = TelemetryDecoder()
+    decoder.decode(datagram)
+    decoder.decode(encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA,
+                                  samples=ring))
+    assert_equal(decoder.unpack_samples()["timestamp"][0], 3)
+
+
+def test_telemetry_samples_of_rejected_delta():
+    ring = SampleRing()
+    encoder = TelemetryEncoder()
+    encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA)
+    ring.append(CURRENTS, POSES, timestamp=5)
+    decoder = TelemetryDecoder()
+    try:
+        decoder.decode(encoder.encode(FLIPPERS, CURRENTS, POSES, ARM_DATA,
+                                      samples=ring))
+    except BadDataError:
+        pass
+    assert_equal(decoder.unpack_samples()["timestamp"], [5])
+
+
+@raises(BadDataError)
+def test_telemetry_bad_sample_count():
+    ring = SampleRing()
+    ring.append(CURRENTS, POSES)
+    TelemetryDecoder().decode(TelemetryEncoder().encode(FLIPPERS, CURRENTS,
+                                                        POSES, ARM_DATA,
+                                                        samples=ring)[:-1])
+
+
+def test_sample_ring_drops_oldest():
+    ring = SampleRing(size=2)
+    for i in range(3):
+        ring.append(CURRENTS, POSES, timestamp=i)
+    assert_equal(ring.dropped, 1)
+    assert_equal(len(ring.pop(1)), SAMPLE_SIZE)
+    assert_equal(len(ring.pop(5)), SAMPLE_SIZE)
+    assert_equal(ring.pop(5), b"")
+
+
+def test_framed_stream_split_message():
+    a, b = socket.socketpair()
+    stream = FramedStream(b)
+    a.sendall(b"\x05\x00he")
+    a.sendall(b"llo")
+    assert_equal(bytes(stream.recv()), b"hello")
+
+
+def test_framed_stream_coalesced_messages():
+    a, b = socket.socketpair()
+    stream = FramedStream(b)
+    a.sendall(b"\x01\x00a\x02\x00bc\x00\x00")
+    assert_equal(bytes(stream.recv()), b"a")
+    assert_equal(bytes(stream.recv()), b"bc")
+    assert_equal(bytes(stream.recv()), b"")
+
+
+def test_framed_stream_wraps_around_buffer():
+    a, b = socket.socketpair()
+    sender, receiver = FramedStream(a), FramedStream(b, buffer_size=16)
+    for i in range(20):
+        sender.send(bytes([i]) * 5)
+        assert_equal(bytes(receiver.recv()), bytes([i]) * 5)
+
+
+def test_framed_stream_latest():
+    a, b = socket.socketpair()
+    sender, receiver = FramedStream(a), FramedStream(b, buffer_size=32)
+    for i in range(20):
+        sender.send(bytes([i]) * 3)
+    assert_equal(bytes(receiver.recv(latest=True)), bytes([19]) * 3)
+
+
+def test_framed_stream_latest_full_buffer():
+    a, b = socket.socketpair()
+    stream = FramedStream(b, buffer_size=16)
+    a.sendall(frame(b"A" * 8) + frame(b"B" * 10))
+    assert_equal(bytes(stream.recv(latest=True)), b"A" * 8)
+    assert_equal(bytes(stream.recv(latest=True)), b"B" * 10)
+
+
+def test_framed_stream_closed():
+    a, b = socket.socketpair()
+    stream = FramedStream(b)
+    a.sendall(b"\x05\x00he")
+    a.close()
+    assert_is_none(stream.recv())
+
+
+@raises(BadDataError)
+def test_framed_stream_message_too_long():
+    a, b = socket.socketpair()
+    FramedStream(a).send(bytes(100))
+    FramedStream(b, buffer_size=64).recv()
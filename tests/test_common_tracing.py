@@ -0,0 +1,103 @@
+import math
+import os
+import signal
+import tempfile
+
+from nose.tools import assert_equal, assert_true, raises
+
+from common.tracing import event, format_trace, read_trace, Tracer
+
+
+SPEEDS = event("test_speeds", "{0:+.2f} {1:+.2f}")
+MARK = event("test_mark")
+
+
+def _dump(tracer):
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        tracer.dump(filename)
+        return read_trace(filename)
+    finally:
+        os.remove(filename)
+
+
+def test_record():
+    tracer = Tracer(size=8)
+    tracer.record(SPEEDS, 0.5, -0.25)
+    tracer.record(MARK)
+    records = tracer.records()
+    assert_equal([record.name for record in records], ["test_speeds",
+                                                       "test_mark"])
+    assert_equal(records[0].fields[:2], (0.5, -0.25))
+    assert_true(all(math.isnan(i) for i in records[1].fields))
+    assert_true(records[0].timestamp <= records[1].timestamp)
+
+
+def test_none_is_nan():
+    tracer = Tracer(size=8)
+    tracer.record(SPEEDS, None, 1)
+    fields = tracer.records()[0].fields
+    assert_true(math.isnan(fields[0]))
+    assert_equal(fields[1], 1)
+
+
+def test_ring_keeps_newest():
+    tracer = Tracer(size=4)
+    for i in range(10):
+        tracer.record(SPEEDS, i, 0)
+    assert_equal([record.fields[0] for record in tracer.records()],
+                 [6, 7, 8, 9])
+
+
+def test_disabled():
+    tracer = Tracer(size=4, enabled=False)
+    tracer.record(SPEEDS, 1, 2)
+    assert_equal(tracer.records(), [])
+
+
+def test_clear():
+    tracer = Tracer(size=4)
+    tracer.record(SPEEDS, 1, 2)
+    tracer.clear()
+    assert_equal(tracer.records(), [])
+
+
+def test_dump_and_format():
+    tracer = Tracer(size=4)
+    for i in range(6):
+        tracer.record(SPEEDS, i / 4, -i / 4)
+    events, records = _dump(tracer)
+    assert_equal([record[:2] + record.fields[:2] for record in records],
+                 [record[:2] + record.fields[:2]
+                  for record in tracer.records()])
+    lines = list(format_trace(events, records))
+    assert_equal(len(lines), 4)
+    assert_true(lines[0].endswith("test_speeds          +0.50 -0.50"))
+    assert_true(lines[-1].endswith("+1.25 -1.25"))
+
+
+def test_dump_on_signal():
+    tracer = Tracer(size=4)
+    tracer.record(MARK)
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        tracer.dump_on_signal(filename)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert_equal(len(read_trace(filename)[1]), 1)
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+        os.remove(filename)
+
+
+@raises(ValueError)
+def test_read_bad_file():
+    fd, filename = tempfile.mkstemp()
+    os.write(fd, b"not a trace at all")
+    os.close(fd)
+    try:
+        read_trace(filename)
+    finally:
+        os.remove(filename)
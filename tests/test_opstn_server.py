@@ -0,0 +1,210 @@
+import socket
+import time
+
+from nose.tools import assert_almost_equal, assert_equal, assert_true,\
+    raises
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+
+from common.exceptions import BadDataError
+from common.networking import SampleRing, TelemetryEncoder
+from opstn.server import Handler, LinkStatistics
+
+
+def _handler():
+    with patch.object(Handler, "handle"):
+        return Handler(MagicMock(), ("127.0.0.1", 9999), MagicMock())
+
+
+def _telemetry(encoder=None):
+    if encoder is None:
+        encoder = TelemetryEncoder()
+    return encoder.encode([0.25, None], [[1.5, 12]] * 4,
+                          [[0, 0.5, 1], [None, None, None]],
+                          ([200, 250, 300], [11.5, 100, 125],
+                           [[20.5] * 16, [-1.5] * 16], 450))
+
+
+def test_decode_telemetry():
+    telemetry = _handler()._decode_telemetry(_telemetry())
+    assert_equal(telemetry["flippers"][0], 0.25)
+    assert_true(np.isnan(telemetry["flippers"][1]))
+    assert_equal(telemetry["currents"].reshape(4, 2).tolist(),
+                 [[1.5, 12]] * 4)
+    assert_true(np.isnan(telemetry["poses"][3:]).all())
+    assert_equal(telemetry["thermo"].reshape(2, 16)[1].tolist(), [-1.5] * 16)
+    assert_equal(telemetry["co2"][0], 450)
+
+
+def test_decode_telemetry_quantized_fields():
+    encoder = TelemetryEncoder()
+    telemetry = _handler()._decode_telemetry(
+        encoder.encode([0, 0], [[1.5, 12]] * 4, [[0, 0, 0]] * 2,
+                       ([123.4, None, 300], [11.5, 100, 125],
+                        [[20.5] * 16, [-1.5] * 16], 452)))
+    assert_almost_equal(telemetry["arm_positions"][0], 123.4, places=4)
+    assert_true(np.isnan(telemetry["arm_positions"][1]))
+    assert_equal(telemetry["co2"][0], 452)
+
+
+def test_decode_telemetry_updates_record_in_place():
+    handler = _handler()
+    encoder = TelemetryEncoder()
+    telemetry = handler._decode_telemetry(_telemetry(encoder))
+    handler._decode_telemetry(encoder.encode([0.5, 0.5], [[1.5, 12]] * 4,
+                                             [[0, 0.5, 1], [0, 0, 0]],
+                                             ([200, 250, 300],
+                                              [11.5, 100, 125],
+                                              [[20.5] * 16, [-1.5] * 16],
+                                              450)))
+    assert_equal(telemetry["flippers"].tolist(), [0.5, 0.5])
+    assert_equal(telemetry["co2"][0], 450)
+
+
+def test_receive_sensor_data_traces():
+    handler = _handler()
+    encoder = TelemetryEncoder()
+    ring = SampleRing()
+    datagrams = []
+    for i in range(4):
+        ring.append([[i, 12]] * 4, [[0, 0.5, i], [0, 0, 0]], timestamp=i)
+        if i % 2:
+            datagrams.append(encoder.encode([0.25, None], [[1.5, 12]] * 4,
+                                            [[0, 0, 0]] * 2,
+                                            ([200, 250, 300],
+                                             [11.5, 100, 125],
+                                             [[20.5] * 16, [-1.5] * 16],
+                                             450), samples=ring))
+    with patch.object(handler, "_udp_receive", return_value=datagrams):
+        handler._receive_sensor_data()
+    assert_equal(handler.traces["timestamp"].tolist(), [0, 1, 2, 3])
+    assert_equal(handler.traces["currents"][:, 0].tolist(), [0, 1, 2, 3])
+    assert_equal(handler.traces["poses"][:, 2].tolist(), [0, 1, 2, 3])
+
+
+def test_receive_sensor_data_many_traces():
+    handler = _handler()
+    encoder = TelemetryEncoder()
+    ring = SampleRing()
+    for i in range(100):
+        ring.append([[i, 12]] * 4, [[0, 0, 0]] * 2, timestamp=i)
+    datagrams = []
+    while ring:
+        datagrams.append(encoder.encode([0.25, None], [[1.5, 12]] * 4,
+                                        [[0, 0, 0]] * 2,
+                                        ([200, 250, 300], [11.5, 100, 125],
+                                         [[20.5] * 16, [-1.5] * 16], 450),
+                                        samples=ring))
+    with patch.object(handler, "_udp_receive", return_value=datagrams):
+        handler._receive_sensor_data()
+    assert_equal(handler.traces["timestamp"].tolist(), list(range(100)))
+
+
+def test_udp_receive_into_buffer():
+    handler = _handler()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver,\
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        receiver.bind(("127.0.0.1", 0))
+        receiver.setblocking(False)
+        handler._sensors_client = receiver
+        sender.sendto(b"first", receiver.getsockname())
+        sender.sendto(b"second", receiver.getsockname())
+        time.sleep(0.05)
+
+        received = []
+        for datagram in handler._udp_receive():
+            assert_true(datagram.obj is handler._datagram)
+            received.append(bytes(datagram))
+    assert_equal(received, [b"first", b"second"])
+
+
+def _stream_until(error):
+    handler = _handler()
+    handler.server.push_rate = 10
+    handler._channel = MagicMock()
+    handler._channel.recv.side_effect = error
+    with patch("select.select", return_value=([handler.request], [], [])),\
+            patch.object(handler, "_receive_sensor_data"):
+        handler._stream()  # Returns instead of raising.
+    assert_equal(handler._channel.send.call_count, 0)
+
+
+def test_stream_ends_on_timeout():
+    _stream_until(socket.timeout)
+
+
+def test_stream_ends_on_reset():
+    _stream_until(ConnectionResetError)
+
+
+@raises(BadDataError)
+def test_decode_telemetry_without_data():
+    _handler()._decode_telemetry(None)
+
+
+@raises(BadDataError)
+def test_decode_telemetry_bad_version():
+    _handler()._decode_telemetry(bytes([0xFF]) + _telemetry()[1:])
+
+
+def test_link_statistics_loss():
+    stats = LinkStatistics(window=10)
+    for seq in [0, 1, 2, 4, 5, 8, 9]:
+        stats.update(seq, seq * 0.1, 100, arrival=seq * 0.1 + 0.01)
+    assert_equal(stats.received, 7)
+    assert_almost_equal(stats.loss_rate, 0.3)
+    assert_equal(stats.reorder_rate, 0)
+    assert_almost_equal(stats.throughput, 70)
+    assert_almost_equal(stats.jitter, 0)
+
+
+def test_link_statistics_reordering():
+    stats = LinkStatistics(window=10)
+    for seq in [0, 2, 1, 3]:
+        stats.update(seq, 0, 100, arrival=1)
+    assert_equal(stats.loss_rate, 0)
+    assert_equal(stats.reorder_rate, 0.25)
+
+
+def test_link_statistics_sequence_wraps():
+    stats = LinkStatistics(window=10)
+    for seq in [2**32 - 2, 2**32 - 1, 0, 1]:
+        stats.update(seq, 0, 100, arrival=1)
+    assert_equal(stats.loss_rate, 0)
+    assert_equal(stats.reorder_rate, 0)
+
+
+def test_link_statistics_restart():
+    stats = LinkStatistics(window=10)
+    for seq in range(50):
+        stats.update(seq, 0, 100, arrival=1)
+    for seq in range(3):
+        stats.update(seq, 0, 100, arrival=1, restart=seq == 0)
+    assert_equal(stats.received, 53)
+    assert_equal(stats.packet_rate, 0.3)
+    assert_equal(stats.reorder_rate, 0)
+
+
+def test_link_statistics_large_jump_back():
+    stats = LinkStatistics(window=10)
+    for seq in [1000, 1001, 1, 2]:
+        stats.update(seq, 0, 100, arrival=1)
+    assert_equal(stats.loss_rate, 0)
+    assert_equal(stats.reorder_rate, 0)
+    assert_equal(stats.packet_rate, 0.2)
+
+
+def test_link_statistics_jitter():
+    stats = LinkStatistics()
+    stats.update(0, 0, 100, arrival=0.05)
+    stats.update(1, 0.1, 100, arrival=0.17)
+    assert_almost_equal(stats.jitter, 0.02 / 16)
+
+
+def test_link_statistics_window():
+    stats = LinkStatistics(window=1)
+    for seq in range(10):
+        stats.update(seq, seq, 100, arrival=seq)
+    assert_equal(stats.received, 10)
+    assert_equal(stats.packet_rate, 2)
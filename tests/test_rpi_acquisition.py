@@ -0,0 +1,75 @@
+import threading
+import time
+
+from nose.tools import assert_equal, assert_is_none, assert_true
+
+from common.exceptions import YozakuraTimeoutError
+from common.functions import interrupted
+from rpi.acquisition import SensorCache, SensorWorker
+
+
+def _run_once(readers, callback=None):
+    cache = SensorCache()
+    worker = SensorWorker("test", cache, readers, period=0.001,
+                          callback=callback)
+    worker.start()
+    time.sleep(0.02)
+    worker.stop()
+    assert_true(not worker.is_alive())
+    return cache
+
+
+def test_cache_default():
+    cache = SensorCache()
+    assert_is_none(cache.get("co2"))
+    assert_is_none(cache.reading("co2"))
+    assert_equal(cache.get("co2", default=-1), -1)
+
+
+def test_cache_max_age():
+    cache = SensorCache()
+    cache.update("co2", 450, timestamp=time.monotonic() - 1)
+    assert_equal(cache.get("co2"), 450)
+    assert_equal(cache.get("co2", default=-1, max_age=0.5), -1)
+    assert_equal(cache.get("co2", max_age=2), 450)
+
+
+def test_worker_stores_readings():
+    cache = _run_once([("co2", lambda: 450), ("thermo", lambda: [20.5] * 32)])
+    assert_equal(cache.get("co2"), 450)
+    assert_equal(cache.get("thermo"), [20.5] * 32)
+    assert_true(cache.reading("co2").timestamp <= time.monotonic())
+
+
+def test_worker_keeps_reading_after_error():
+    values = iter([450, 460])
+
+    def read():
+        try:
+            return next(values)
+        except StopIteration:
+            raise YozakuraTimeoutError
+
+    cache = _run_once([("co2", read)])
+    assert_equal(cache.get("co2"), 460)
+
+
+def test_worker_callback():
+    rounds = []
+    _run_once([("co2", lambda: 450)],
+              callback=lambda cache: rounds.append(cache.get("co2")))
+    assert_true(len(rounds) > 1)
+    assert_equal(set(rounds), {450})
+
+
+def test_interrupted_outside_main_thread():
+    @interrupted(0.01)
+    def slow_function():
+        time.sleep(0.02)
+        return True
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(slow_function()))
+    thread.start()
+    thread.join()
+    assert_equal(results, [True])
@@ -0,0 +1,149 @@
+from nose.tools import assert_equal, assert_false, assert_is_none,\
+    assert_raises, raises
+from unittest.mock import patch, MagicMock
+
+MockRPi = MagicMock()
+modules = {
+    "RPi": MockRPi,
+    "RPi.GPIO": MockRPi.GPIO
+}
+patcher = patch.dict("sys.modules", modules)
+patcher.start()
+
+
+def teardown_module():
+    patcher.stop()
+
+import asyncio
+import socket
+
+import numpy as np
+
+from common.exceptions import NoConnectionError
+from common.functions import add_logging_level
+from common.networking import encode_commands, frame
+from rpi.async_client import AsyncClient
+
+
+add_logging_level("verbose", 5)
+
+
+def _client(stream_commands=False):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        client = AsyncClient("127.0.0.1", listener.getsockname(),
+                             stream_commands=stream_commands)
+        server, _ = listener.accept()
+    return client, server
+
+
+def _mbed(line):
+    mbed = MagicMock()
+    mbed.data = line.split()
+    return mbed
+
+
+def test_flipper_positions_from_mbed():
+    client, server = _client()
+    client.mbeds["mbed_body"] = _mbed("8000 0")
+    assert_equal(client._get_sensor_data("flipper_positions"),
+                 [0x8000 / 0xFFFF, 0])
+    server.close()
+
+
+def test_arm_data_bad_line():
+    client, server = _client()
+    client.mbeds["mbed_arm"] = _mbed("1 2 3")
+    positions, servo_vii, thermo_sensors, co2_sensor =\
+        client._get_sensor_data("arm_data")
+    assert_is_none(co2_sensor)
+    server.close()
+
+
+def test_arm_data_from_frame():
+    client, server = _client()
+    client.mbeds["mbed_arm"] = MagicMock()
+    client.mbeds["mbed_arm"].data = np.array([180.5, -1, 0, 12.3, -1, 250] +
+                                             [20] * 32 + [450])
+    positions, servo_vii, thermo_sensors, co2_sensor =\
+        client._get_sensor_data("arm_data")
+    assert_equal(positions, [180.5, None, 0])
+    assert_equal(servo_vii, [12.3, None, 250])
+    assert_equal(co2_sensor, 450)
+    server.close()
+
+
+def _run(client, scenario):
+    loop = asyncio.new_event_loop()
+
+    async def run():
+        client._new_commands = asyncio.Event()
+        reader, client._writer = await asyncio.open_connection(
+            sock=client.request)
+        task = loop.create_task(client._receive_frames(reader))
+        try:
+            return await scenario()
+        finally:
+            task.cancel()
+
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def test_next_commands_newest():
+    client, server = _client(stream_commands=True)
+    server.sendall(frame(encode_commands([0.5] * 4, (0, 0, 0, 0), seq=1)) +
+                   frame(encode_commands([1] * 4, (0, 1, 0, 0), seq=2)))
+
+    async def scenario():
+        await asyncio.sleep(0.05)
+        return await client._next_commands()
+
+    assert_equal(_run(client, scenario), ([1, 1, 1, 1], (0, 1, 0, 0)))
+    server.close()
+
+
+def test_next_commands_requests():
+    client, server = _client()
+
+    async def scenario():
+        pending = asyncio.ensure_future(client._next_commands())
+        await asyncio.sleep(0.05)
+        assert_equal(server.recv(64), frame(b"commands"))
+        server.sendall(frame(encode_commands([0.5] * 4, (0, 0, 0, 0),
+                                             seq=1)))
+        return await pending
+
+    assert_equal(_run(client, scenario), ([0.5] * 4, (0, 0, 0, 0)))
+    server.close()
+
+
+def test_next_commands_after_timeout():
+    client, server = _client()
+    late, reply = (frame(encode_commands([speed] * 4, (0, 0, 0, 0), seq=seq))
+                   for seq, speed in enumerate([0.25, 0.5]))
+
+    async def scenario():
+        with assert_raises(asyncio.TimeoutError):
+            await asyncio.wait_for(client._next_commands(), 0.05)
+        server.sendall(late)  # The late reply arrives before the next request.
+        await asyncio.sleep(0.05)
+        pending = asyncio.ensure_future(client._next_commands())
+        await asyncio.sleep(0.05)
+        assert_equal(server.recv(64), frame(b"commands") * 2)
+        assert_false(pending.done())
+        server.sendall(reply)
+        return await pending
+
+    assert_equal(_run(client, scenario), ([0.5] * 4, (0, 0, 0, 0)))
+    server.close()
+
+
+@raises(NoConnectionError)
+def test_next_commands_closed():
+    client, server = _client(stream_commands=True)
+    server.close()
+    _run(client, client._next_commands)
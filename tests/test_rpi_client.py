@@ -0,0 +1,117 @@
+from nose.tools import assert_equal, assert_raises, raises
+from unittest.mock import patch, MagicMock
+
+MockRPi = MagicMock()
+modules = {
+    "RPi": MockRPi,
+    "RPi.GPIO": MockRPi.GPIO
+}
+patcher = patch.dict("sys.modules", modules)
+patcher.start()
+
+
+def teardown_module():
+    patcher.stop()
+
+import socket
+import threading
+import time
+
+from common.networking import encode_commands, frame
+from rpi.client import Client
+
+
+def _listener():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    return listener
+
+
+@raises(BrokenPipeError)
+def test_request_commands_closed():
+    with _listener() as listener:
+        client = Client("127.0.0.1", listener.getsockname())
+        server, _ = listener.accept()
+    server.close()
+    client._request_commands()
+
+
+def _timed_out_client():
+    with _listener() as listener:
+        client = Client("127.0.0.1", listener.getsockname())
+        server, _ = listener.accept()
+    client.request.settimeout(0.05)
+    assert_raises(socket.timeout, client._request_commands)
+    return client, server
+
+
+def _replies(*speeds):
+    return [frame(encode_commands([speed] * 4, (0, 0, 0, 0), seq=seq))
+            for seq, speed in enumerate(speeds)]
+
+
+def test_request_commands_after_timeout():
+    client, server = _timed_out_client()
+    late, reply = _replies(0.25, 0.5)
+    server.sendall(late + reply)  # The late reply arrived with this one.
+    assert_equal(client._request_commands(), ([0.5] * 4, (0, 0, 0, 0)))
+    server.close()
+    client.request.close()
+
+
+def test_request_commands_late_reply_alone():
+    client, server = _timed_out_client()
+    late, *replies = _replies(0.25, 0.5, 0.75)
+    server.sendall(late)  # The late reply arrived before the next request.
+    time.sleep(0.02)
+    for speed, reply in zip([0.5, 0.75], replies):
+        reply_later = threading.Timer(0.02, server.sendall, [reply])
+        reply_later.start()
+        assert_equal(client._request_commands(), ([speed] * 4, (0, 0, 0, 0)))
+        reply_later.join()
+    server.close()
+    client.request.close()
+
+
+def test_reconnect():
+    with _listener() as listener:
+        client = Client("127.0.0.1", listener.getsockname(), reconnect=True)
+        server, _ = listener.accept()
+        server.close()
+
+        client._reconnect()
+        server, _ = listener.accept()
+
+    server.sendall(frame(encode_commands([0.5] * 4, (0, 0, 0, 0), seq=1)))
+    assert_equal(client._receive_commands(), ([0.5] * 4, (0, 0, 0, 0)))
+    assert_equal(client.reconnections, 1)
+    server.close()
+    client.request.close()
+
+
+def test_reconnect_retries():
+    listener = _listener()
+    address = listener.getsockname()
+    client = Client("127.0.0.1", address, reconnect=True)
+    server, _ = listener.accept()
+    server.close()
+    listener.close()
+
+    def restart():
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(address)
+        listener.listen(1)
+        return listener
+
+    timer = threading.Timer(0.2, lambda: listeners.append(restart()))
+    listeners = []
+    timer.start()
+    client._reconnect()
+    timer.join()
+
+    assert_equal(client.reconnections, 1)
+    listeners[0].close()
+    client.request.close()
@@ -0,0 +1,174 @@
+from nose.tools import assert_almost_equal, assert_equal, assert_true,\
+    raises
+from unittest.mock import patch, MagicMock
+
+MockRPi = MagicMock()
+modules = {
+    "RPi": MockRPi,
+    "RPi.GPIO": MockRPi.GPIO
+}
+patcher = patch.dict("sys.modules", modules)
+patcher.start()
+
+
+def teardown_module():
+    patcher.stop()
+
+import time
+
+from rpi.acquisition import SensorCache
+from rpi.flippers import FlipperServo, PID
+from rpi.mbed import Sample
+from rpi.motor import Motor
+
+
+def _servo(line=None, **kwargs):
+    mbed = MagicMock()
+    mbed.latest = None if line is None else _sample(line)
+    return FlipperServo(mbed, [MagicMock(), MagicMock()], **kwargs)
+
+
+def _sample(line):
+    return Sample(time.monotonic(), line.split())
+
+
+def test_pid_saturates():
+    pid = PID(kp=10, ki=100, limit=1)
+    for _ in range(100):
+        assert_equal(pid.update(1, 0, 0.01), 1)
+    # The integral did not grow while saturated.
+    assert_almost_equal(pid.update(0.5, 0.45, 0.01), 0.5 + 100 * 0.0005)
+
+
+def test_pid_derivative_on_measurement():
+    pid = PID(kp=0, kd=1)
+    assert_equal(pid.update(1, 0, 0.1), 0)
+    assert_almost_equal(pid.update(0, 0.05, 0.1), -0.5)
+
+
+def test_read_positions():
+    cache = SensorCache()
+    servo = _servo("8000 0", cache=cache)
+    servo._read_positions()
+    assert_equal(servo.positions, [0x8000 / 0xFFFF, 0])
+    servo.mbed.latest = _sample("4000 C000")
+    servo._read_positions()
+    assert_equal(cache.get("flipper_positions"),
+                 [0x4000 / 0xFFFF, 0xC000 / 0xFFFF])
+    servo.positions = [0.5, 0.5]
+    servo._read_positions()  # Nothing new.
+    assert_equal(servo.positions, [0.5, 0.5])
+
+
+def test_stale_positions():
+    servo = _servo("8000 8000", max_age=0.05)
+    servo._read_positions()
+    servo.set_target(0, 0.8)
+    assert_true(servo._speeds_to_send()[0] > 0)
+
+    time.sleep(0.06)  # The mbed stopped replying.
+    servo._read_positions()
+    assert_equal(servo.positions, [None, None])
+    assert_equal(servo._speeds_to_send(), [0, 0])
+    assert_equal(servo._controllers[0]._integral, 0)
+
+
+@raises(IndexError)
+def test_read_positions_bad_line():
+    servo = _servo("8000")
+    servo._read_positions()
+
+
+def test_released_by_default():
+    servo = _servo()
+    servo.positions = [0.5, 0.5]
+    assert_equal(servo._speeds_to_send(), [0, 0])
+
+
+def test_manual_speeds():
+    servo = _servo()
+    servo.positions = [0.5, 0.5]
+    servo.set_speeds([0.5, -1])
+    assert_equal(servo.targets, [None, None])
+    assert_equal(servo._speeds_to_send(), [0.5, -1])
+
+
+def test_hold_when_stopped():
+    servo = _servo()
+    servo.positions = [0.5, 0.5]
+    servo.set_speeds([1, 1])
+    servo.positions = [0.6, 0.4]
+    servo.set_speeds([0, 0])
+    assert_equal(servo.targets, [0.6, 0.4])
+
+    servo.positions = [0.55, 0.45]  # Both flippers fell back.
+    left, right = servo._speeds_to_send()
+    assert_true(left > 0)  # The left position increases with the speed.
+    assert_true(right > 0)  # The right position decreases with the speed.
+
+
+def test_hold_deadband():
+    servo = _servo()
+    servo.positions = [0.5, 0.5]
+    servo.set_speeds([0, 0])
+    servo.positions = [0.502, 0.498]
+    assert_equal(servo._speeds_to_send(), [0, 0])
+
+
+def test_set_target():
+    servo = _servo()
+    servo.positions = [0.5, 0.5]
+    servo.set_target(1, 0.3)
+    assert_equal(servo.targets, [None, 0.3])
+    assert_true(servo._speeds_to_send()[1] > 0)
+
+
+def test_limits():
+    servo = _servo()
+    servo.positions = [0.02, 0.98]
+    servo.set_speeds([-1, -1])
+    assert_equal(servo._speeds_to_send(), [0, 0])
+    servo.set_speeds([1, 1])
+    assert_equal(servo._speeds_to_send(), [1, 1])
+
+
+def test_unknown_position():
+    servo = _servo()
+    servo.set_speeds([0, 1])
+    assert_equal(servo.targets, [None, None])
+    assert_equal(servo._speeds_to_send(), [0, 0])
+
+
+def test_release():
+    servo = _servo()
+    servo.positions = [0.5, 0.5]
+    servo.set_speeds([0, 0.5])
+    servo.release()
+    assert_equal(servo.targets, [None, None])
+    assert_equal(servo._speeds_to_send(), [0, 0])
+
+
+@patch.object(Motor, "drive_all")
+def test_run(mock_drive_all):
+    servo = _servo("8000 8000", rate=500)
+    servo.start()
+    time.sleep(0.05)
+    servo.set_speeds([0, 0])
+    time.sleep(0.02)
+    servo.stop()
+    assert_equal(servo.targets, [0x8000 / 0xFFFF] * 2)
+    assert_true(mock_drive_all.call_count > 10)
+    mock_drive_all.assert_called_with([0, 0], motors=servo.motors)
+    assert_true(not servo.is_alive())
+
+
+@patch.object(Motor, "drive_all")
+def test_run_stops_without_positions(mock_drive_all):
+    servo = _servo("8000 8000", rate=500, max_age=0.05)
+    servo.set_target(0, 0.8)
+    servo.start()
+    time.sleep(0.02)
+    assert_true(mock_drive_all.call_args[0][0][0] > 0)
+    time.sleep(0.1)  # The mbed stopped replying.
+    mock_drive_all.assert_called_with([0, 0], motors=servo.motors)
+    servo.stop()
@@ -0,0 +1,399 @@
+from nose.tools import assert_equal, assert_false, assert_is_none,\
+    assert_true, raises
+
+import json
+import os
+import queue
+import select
+import struct
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+import numpy as np
+
+from common.exceptions import NoMbedError, YozakuraTimeoutError
+from rpi import mbed as mbed_module
+from rpi.mbed import ARM_FRAME, ARM_SET_BAUD, ARM_START_FRAMES,\
+    ARM_STOP_FRAMES, ArmFrameDecoder, BAUD_RATES, cobs_decode, cobs_encode,\
+    crc16, FrameDecoder, Mbed, SET_BAUD, START_FRAMES
+
+
+class _Port(object):
+    """A pseudo-terminal standing in for an mbed."""
+    def __init__(self, identity=b"test", connect=True):
+        self.identity = identity
+        self.master, self.slave = os.openpty()
+        self.name = os.ttyname(self.slave)
+        self.mbed = None
+        self.received = queue.Queue()  # Every byte but identity requests.
+        self.replier = threading.Thread(target=self._reply_to_identity,
+                                        daemon=True)
+        if identity is not None:
+            self.replier.start()
+        if connect:
+            self.mbed = Mbed(self.name, baudrate=38400)
+
+    def _reply_to_identity(self):
+        try:
+            while True:
+                byte = os.read(self.master, 1)
+                if byte == bytes([7]):
+                    os.write(self.master, self.identity + b"\n")
+                else:
+                    self.received.put(byte)
+        except OSError:
+            pass
+
+    def send(self, *chunks):
+        lines_read = self.mbed.lines_read
+        for chunk in chunks:
+            os.write(self.master, chunk)
+            time.sleep(0.01)
+        self.mbed.wait_for_line(1, since=lines_read)
+        time.sleep(0.01)
+
+    def read(self):
+        return self.received.get(timeout=1)
+
+    def close(self):
+        if self.mbed is not None:
+            self.mbed.close()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def test_identity():
+    port = _Port()
+    assert_equal(port.mbed.identity, "test")
+    port.close()
+
+
+def test_data_latest_line():
+    port = _Port()
+    port.send(b"0 FFFF\n8000 0\n4000 ", b"C000\n")
+    assert_equal(port.mbed.data, ["4000", "C000"])
+    assert_equal([sample.fields for sample in port.mbed.samples][-3:],
+                 [["0", "FFFF"], ["8000", "0"], ["4000", "C000"]])
+    port.close()
+
+
+def test_incomplete_line_ignored():
+    port = _Port()
+    port.send(b"1 2\n3 ")
+    assert_equal(port.mbed.data, ["1", "2"])
+    port.close()
+
+
+@raises(YozakuraTimeoutError)
+def test_data_stale():
+    port = _Port()
+    port.send(b"1 2\n")
+    port.mbed.max_age = 0
+    try:
+        port.mbed.data
+    finally:
+        port.close()
+
+
+def test_wait_for_line_timeout():
+    port = _Port()
+    assert_is_none(port.mbed.wait_for_line(0.05))
+    port.close()
+
+
+def test_close_stops_reader():
+    port = _Port()
+    port.close()
+    assert_false(port.mbed._reader.is_alive())
+
+
+def test_break_on_open():
+    with patch.object(Mbed, "sendBreak") as send_break:
+        port = _Port()
+    send_break.assert_called_once_with(mbed_module._BREAK_DURATION)
+    port.close()
+
+
+def test_no_break_for_arm():
+    with patch.object(Mbed, "sendBreak") as send_break:
+        port = _Port(identity=b"arm")
+    send_break.assert_not_called()
+    assert_equal(port.read(), bytes([ARM_STOP_FRAMES]))
+    port.close()
+
+
+def _frame(sequence, *values):
+    return _encode(struct.pack("<B{n}H".format(n=len(values)), sequence,
+                               *values))
+
+
+def _arm_frame(sequence, co2_sensor=450):
+    record = np.zeros(1, ARM_FRAME)
+    record["positions"] = [1805, -10, 0]
+    record["servo_vii"] = [123, -10, 2500]
+    record["thermo_sensors"] = np.arange(200, 232)
+    record["co2_sensor"] = co2_sensor
+    return _encode(bytes([sequence]) + record.tobytes())
+
+
+def _encode(payload):
+    return cobs_encode(payload + struct.pack("<H", crc16(payload))) + b"\x00"
+
+
+def test_cobs_round_trip():
+    for data in (b"", b"\x00", b"\x00\x00", b"\x01\x00\x02",
+                 bytes(range(256)) * 2):
+        encoded = cobs_encode(data)
+        assert_false(0 in encoded)
+        assert_equal(cobs_decode(encoded), data)
+
+
+@raises(ValueError)
+def test_cobs_truncated():
+    cobs_decode(b"\x05\x01\x02")
+
+
+def test_frame_decoder_chunks():
+    decoder = FrameDecoder()
+    data = _frame(0, 0x8000, 0) + _frame(1, 0, 0xFFFF)
+    results = []
+    for i in range(len(data)):
+        results += decoder.feed(data[i:i + 1])
+    assert_equal(results, [(0x8000, 0), (0, 0xFFFF)])
+    assert_equal(decoder.frames, 2)
+
+
+def test_frame_decoder_bad_crc():
+    decoder = FrameDecoder()
+    bad = bytearray(_frame(0, 0x1234, 0x5678))
+    bad[2] ^= 0x01
+    assert_equal(decoder.feed(bytes(bad) + _frame(1, 1, 2)), [(1, 2)])
+    assert_equal(decoder.errors, 1)
+
+
+def test_frame_decoder_dropped():
+    decoder = FrameDecoder()
+    decoder.feed(_frame(254, 1, 1) + _frame(2, 1, 1))
+    assert_equal(decoder.dropped, 3)
+
+
+def test_frames_over_port():
+    port = _Port()
+    port.send(b"8000 0\n")
+    port.mbed.use_frames()
+    assert_equal(port.read(), bytes([START_FRAMES]))
+    port.send(_frame(0, 0x8000, 0x4000)[:4], _frame(0, 0x8000, 0x4000)[4:])
+    assert_equal(port.mbed.data, (0x8000, 0x4000))
+    port.close()
+
+
+def test_arm_frame_decoder():
+    values, = ArmFrameDecoder().feed(_arm_frame(0, co2_sensor=5400))
+    assert_equal(values.tolist(),
+                 [180.5, -1, 0, 12.3, -1, 250] +
+                 [i / 10 for i in range(200, 232)] + [5400])
+
+
+def test_arm_frame_decoder_bad_size():
+    decoder = ArmFrameDecoder()
+    short = _encode(bytes([1]) + bytes(ARM_FRAME.itemsize - 2))
+    assert_equal(decoder.feed(_frame(0, 1, 2) + short), [])
+    assert_equal(decoder.errors, 2)
+    assert_equal(decoder.frames, 0)
+
+
+def test_arm_frames_over_port():
+    port = _Port(identity=b"arm")
+    port.read()  # Sent on open.
+    port.mbed.use_frames()
+    assert_equal(port.read(), bytes([ARM_START_FRAMES]))
+    port.send(_arm_frame(0))
+    assert_equal(port.mbed.data[-1], 450)
+    port.close()
+
+
+def test_arm_frames_stop_on_close():
+    port = _Port(identity=b"arm")
+    port.mbed.use_frames()
+    port.read()
+    port.read()
+    port.mbed.close()
+    assert_equal(port.read(), bytes([ARM_STOP_FRAMES]))
+    port.close()
+
+
+def _connect(*ports, **kwargs):
+    names = [port.name for port in ports]
+    with patch("glob.glob", return_value=names),\
+            patch.object(mbed_module, "_usb_serial_number",
+                         side_effect=lambda name: "serial" + name):
+        return Mbed.connect_to_mbeds(**kwargs)
+
+
+def test_connect_to_mbeds():
+    ports = [_Port(b"body", connect=False), _Port(b"arm", connect=False)]
+    start = time.monotonic()
+    mbed_arm, mbed_body = _connect(*ports)
+    assert_true(time.monotonic() - start < 1)
+    assert_equal(mbed_arm.port, ports[1].name)
+    assert_equal(mbed_body.port, ports[0].name)
+    for port, mbed in zip(ports, (mbed_body, mbed_arm)):
+        port.mbed = mbed
+        port.close()
+
+
+def test_connect_to_mbeds_cached():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = os.path.join(directory, "mbeds.json")
+        port = _Port(b"body", connect=False)
+        mbed_arm, port.mbed = _connect(port, identity_cache=cache)
+        port.close()
+        with open(cache) as cache_file:
+            assert_equal(json.load(cache_file), {"serial" + port.name: "body"})
+
+        # The same mbed, which does not reply this time.
+        silent = _Port(None, connect=False)
+        with open(cache, "w") as cache_file:
+            json.dump({"serial" + silent.name: "body"}, cache_file)
+        mbed_arm, silent.mbed = _connect(silent, identity_cache=cache)
+        assert_is_none(mbed_arm)
+        assert_equal(silent.mbed.identity, "body")
+        silent.close()
+
+
+@raises(NoMbedError)
+def test_connect_to_mbeds_no_body():
+    port = _Port(b"arm", connect=False)
+    try:
+        _connect(port)
+    finally:
+        port.close()
+
+
+class _Firmware(threading.Thread):
+    """Answers identity and baud rate requests, as the mbeds do."""
+    def __init__(self, master, identity=b"body", max_index=5, echo_index=5,
+                 lost_index=None, boot_time=0):
+        super().__init__(daemon=True)
+        self.master = master
+        self.identity = identity
+        self.set_baud = ARM_SET_BAUD if identity == b"arm" else SET_BAUD
+        self.max_index = max_index  # Higher rates are refused.
+        self.echo_index = echo_index  # Echoes fail at higher rates.
+        self.lost_index = lost_index  # The confirmation is lost at this rate.
+        self.boot_time = boot_time  # Requests are ignored after a reset.
+        self.baudrate = BAUD_RATES[0]
+        self.baudrates = []
+        self.ignored = 0
+        self._booted = 0
+        self._buffer = bytearray()
+        self._stop_event = threading.Event()
+
+    def _read_byte(self, timeout=0.2):
+        if not self._buffer:
+            if not select.select([self.master], [], [], timeout)[0]:
+                return None
+            self._buffer += os.read(self.master, 64)
+        return self._buffer.pop(0)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            byte = self._read_byte(0.05)
+            if byte == 7:
+                if time.monotonic() < self._booted:
+                    self.ignored += 1
+                else:
+                    os.write(self.master, self.identity + b"\n")
+            elif byte == self.set_baud:
+                self._negotiate(self._read_byte())
+
+    def _negotiate(self, index):
+        if index > self.max_index:
+            os.write(self.master, b"baud 0\n")
+            return
+        os.write(self.master, "baud {rate}\n".format(
+            rate=BAUD_RATES[index]).encode())
+        line = bytearray()
+        while not line.endswith(b"\n"):
+            byte = self._read_byte()
+            if byte is None:
+                return
+            line.append(byte)
+        if index > self.echo_index:
+            line = b"\xff" + line[1:]  # Garbled at this rate.
+        os.write(self.master, bytes(line))
+        if self._read_byte() == 7:
+            self.baudrate = BAUD_RATES[index]
+            self.baudrates.append(self.baudrate)
+            if index != self.lost_index:
+                os.write(self.master, self.identity + b"\n")
+
+    def send_break(self, duration):
+        self.baudrate = BAUD_RATES[0]
+        self._booted = time.monotonic() + self.boot_time
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _negotiate(max_index=5, echo_index=5, lost_index=None, **kwargs):
+    port = _Port(None, connect=False)
+    firmware = _Firmware(port.master, max_index=max_index,
+                         echo_index=echo_index, lost_index=lost_index)
+    firmware.start()
+    with patch.object(Mbed, "sendBreak", side_effect=firmware.send_break):
+        port.mbed = Mbed(port.name, baudrate=BAUD_RATES[0])
+        baudrate = port.mbed.negotiate_baudrate(**kwargs)
+    assert_equal(port.mbed.baudrate, baudrate)
+    assert_equal(firmware.baudrate, baudrate)
+    firmware.stop()
+    port.close()
+    return baudrate, firmware.baudrates
+
+
+def test_negotiate_baudrate():
+    assert_equal(_negotiate(max_index=3),
+                 (230400, [57600, 115200, 230400]))
+
+
+def test_negotiate_baudrate_limit():
+    assert_equal(_negotiate(max_baudrate=115200), (115200, [57600, 115200]))
+
+
+def test_negotiate_baudrate_echo_fails():
+    assert_equal(_negotiate(echo_index=2), (115200, [57600, 115200]))
+
+
+def test_negotiate_baudrate_confirmation_lost():
+    assert_equal(_negotiate(lost_index=2), (38400, [57600, 115200]))
+
+
+def test_reset_waits_for_identity():
+    port = _Port(None, connect=False)
+    firmware = _Firmware(port.master, boot_time=0.3)
+    firmware.start()
+    with patch.object(Mbed, "sendBreak", side_effect=firmware.send_break):
+        start = time.monotonic()
+        port.mbed = Mbed(port.name, baudrate=BAUD_RATES[0])
+    assert_true(time.monotonic() - start > 0.3)
+    assert_true(firmware.ignored > 1)
+    assert_equal(port.mbed.latest.fields, ["body"])
+    firmware.stop()
+    port.close()
+
+
+def test_arm_close_restores_first_rate():
+    port = _Port(None, connect=False)
+    firmware = _Firmware(port.master, identity=b"arm")
+    firmware.start()
+    with patch.object(Mbed, "sendBreak") as send_break:
+        port.mbed = Mbed(port.name, baudrate=BAUD_RATES[0])
+        assert_equal(port.mbed.negotiate_baudrate(max_baudrate=115200), 115200)
+        port.mbed.close()
+    send_break.assert_not_called()
+    assert_equal(firmware.baudrate, BAUD_RATES[0])
+    firmware.stop()
+    port.close()
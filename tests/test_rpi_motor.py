@@ -17,7 +17,7 @@ import time
 
 from common.exceptions import BadArgError, MotorCountError, NoDriversError
 
-from rpi.motor import gpio, Motor
+from rpi.motor import gpio, Motor, END_OF_BATCH
 
 
 class TestMotor(object):
@@ -107,6 +107,7 @@ class TestMotorUtilities(TestMotor):
         Motor("motor1", 8, 10, 7)
         Motor("motor2", 8, 10, 7)
         Motor("motor3", 8, 10, 7)
+        gpio.cleanup.reset_mock()  # Earlier teardowns also clean up.
         Motor.shutdown_all()
         gpio.cleanup.assert_called_once()
         assert_equal(Motor.motors, [])
@@ -223,3 +224,66 @@ class TestMotorDrive(TestMotor):
                 self.motor0.max_speed = max_speed
                 scaled_speeds.append(self.motor0._scale_speed(speed))
             assert_equal(scaled_speeds, expected_speeds[speed])
+
+    def test_drive_with_serial_negative_zero(self):
+        self.motor0.enable_serial(self.ser)
+        self.motor0.drive(-0.01)
+        self.motor0.ser.write.assert_called_with(bytes([0b00000000]))  # 0
+
+    def test_drive_with_serial_skips_unchanged(self):
+        self.motor0.enable_serial(self.ser)
+        assert_true(self.motor0.drive(0.3))
+        assert_false(self.motor0.drive(0.3))
+        assert_true(self.motor0.drive(0.5))
+        assert_equal(self.motor0.ser.write.call_count, 2)
+        assert_equal(self.motor0.bytes_sent, 2)
+        assert_equal(self.motor0.bytes_saved, 1)
+
+    def test_drive_with_serial_keepalive(self):
+        self.motor0.keepalive = 0.01
+        self.motor0.enable_serial(self.ser)
+        self.motor0.drive(0.3)
+        time.sleep(0.02)
+        assert_true(self.motor0.drive(0.3))
+        assert_equal(self.motor0.ser.write.call_count, 2)
+
+    def test_drive_all_single_write(self):
+        motor1 = Motor("motor1", 8, 10, 7)
+        self.motor0.enable_serial(self.ser)
+        motor1.enable_serial(self.ser)
+        Motor.drive_all([0.3, 0.5])
+        self.ser.write.assert_called_once_with(
+            bytes([0b01001000, 0b01111001, END_OF_BATCH]))
+
+    def test_drive_all_skips_unchanged(self):
+        motor1 = Motor("motor1", 8, 10, 7)
+        self.motor0.enable_serial(self.ser)
+        motor1.enable_serial(self.ser)
+        Motor.drive_all([0.3, 0.5])
+        Motor.drive_all([0.3, -0.5])
+        self.ser.write.assert_called_with(bytes([0b01111101, END_OF_BATCH]))
+
+    def test_drive_all_with_soft_pwm(self):
+        self.motor0.enable_soft_pwm(12, 17, 2800)
+        Motor.drive_all([0.3])
+        self.motor0._pwm.ChangeDutyCycle.assert_called_with(30)
+
+    @raises(BadArgError)
+    def test_drive_all_speed_more_than_one(self):
+        self.motor0.enable_serial(self.ser)
+        Motor.drive_all([1.5])
+
+    def test_stop_all_resends_zero(self):
+        motor1 = Motor("motor1", 8, 10, 7)
+        self.motor0.enable_serial(self.ser)
+        motor1.enable_serial(self.ser)
+        Motor.drive_all([0, 0])
+        Motor.stop_all()
+        self.ser.write.assert_called_with(
+            bytes([0b00000000, 0b00000001, END_OF_BATCH]))
+
+    def test_stop_all_skips_motors_without_drivers(self):
+        motor1 = Motor("motor1", 8, 10, 7)
+        motor1.enable_serial(self.ser)
+        Motor.stop_all()
+        self.ser.write.assert_called_with(bytes([0b00000001, END_OF_BATCH]))
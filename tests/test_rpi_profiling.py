@@ -0,0 +1,66 @@
+import math
+
+from nose.tools import assert_equal, assert_is_none, assert_true
+
+from common.networking import TelemetryDecoder, TelemetryEncoder, LOOP_STAGES
+from rpi.profiling import Histogram, LoopProfiler
+
+
+def test_histogram_empty():
+    assert_is_none(Histogram().percentile(50))
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for duration in range(1, 10001):
+        histogram.record(duration * 1000)
+    for q in (1, 50, 90, 99):
+        exact = q * 100000
+        assert_true(abs(histogram.percentile(q) - exact) <= exact / 8)
+    assert_true(histogram.percentile(100) <= histogram.max)
+
+
+def test_histogram_fixed_size():
+    histogram = Histogram()
+    size = len(histogram._counts)
+    for duration in (0, 1, 5, 10**6, 10**15):
+        histogram.record(duration)
+    assert_equal(len(histogram._counts), size)
+    assert_equal(histogram.count, 5)
+    assert_equal(histogram.max, 10**15)
+
+
+def test_histogram_reset():
+    histogram = Histogram()
+    histogram.record(1000)
+    histogram.reset()
+    assert_equal(histogram.count, 0)
+    assert_is_none(histogram.percentile(50))
+
+
+def test_profiler_report():
+    profiler = LoopProfiler(["a", "b"], interval=0)
+    assert_equal(profiler.flat_report(), (None,) * 4)
+    for _ in range(10):
+        profiler.start()
+        profiler.lap("a")
+    profiler.take_report()
+    p50, p99 = profiler.report["a"]
+    assert_true(0 <= p50 <= p99 < 0.001)
+    assert_equal(profiler.report["b"], (None, None))
+    assert_equal(profiler.histograms["a"].count, 0)
+    assert_true(str(profiler).startswith("p50/99 ms: a "))
+
+
+def test_stage_times_in_telemetry():
+    stage_times = tuple(i / 1000 for i in range(2 * len(LOOP_STAGES)))
+    stage_times = (None,) + stage_times[1:]
+    decoder = TelemetryDecoder()
+    decoder.decode(TelemetryEncoder().encode(
+        [None] * 2, [[None] * 2] * 4, [[None] * 3] * 2,
+        ([None] * 3, [None] * 3, [[None] * 16] * 2, None),
+        stage_times=stage_times))
+    received = decoder.unpack()["stage_times"]
+    assert_true(math.isnan(received[0]))
+    for sent, value in zip(stage_times[1:], received[1:]):
+        assert_true(abs(sent - value) <= 0.000005)
@@ -0,0 +1,70 @@
+import math
+import time
+
+from nose.tools import assert_almost_equal, assert_equal, assert_true
+
+from common.networking import TelemetryDecoder, TelemetryEncoder
+from rpi.scheduler import LoopScheduler
+
+
+def test_steady_rate():
+    scheduler = LoopScheduler(rate=50)
+    start = time.monotonic()
+    for _ in range(6):
+        scheduler.wait()
+    assert_equal(scheduler.cycles, 5)
+    assert_true(0.09 <= time.monotonic() - start < 0.2)
+    assert_equal(scheduler.overruns, 0)
+    assert_true(scheduler.min_slack >= 0)
+
+
+def test_overrun_skips_missed_deadlines():
+    scheduler = LoopScheduler(rate=100)
+    scheduler.wait()
+    time.sleep(0.035)
+    assert_equal(scheduler.delay(), 0)
+    assert_equal(scheduler.overruns, 1)
+    assert_equal(scheduler.missed, 2)
+    assert_true(scheduler.slack < 0)
+
+    scheduler.wait()
+    assert_equal(scheduler.overruns, 1)
+    assert_true(scheduler.duration < scheduler.period)
+
+
+def test_timing():
+    scheduler = LoopScheduler(rate=10)
+    assert_equal(scheduler.timing, (None, None, 0, 0))
+    scheduler.wait()
+    scheduler.wait()
+    duration, slack, overruns, missed = scheduler.timing
+    assert_almost_equal(duration + slack, scheduler.period)
+    assert_equal((overruns, missed), (0, 0))
+
+
+def test_timing_in_telemetry():
+    decoder = TelemetryDecoder()
+    decoder.decode(TelemetryEncoder().encode(
+        [None] * 2, [[None] * 2] * 4, [[None] * 3] * 2,
+        ([None] * 3, [None] * 3, [[None] * 16] * 2, None),
+        loop_timing=(0.0025, 0.0075, 3, 5)))
+    duration, slack, overruns, missed = decoder.unpack()["loop_timing"]
+    assert_almost_equal(duration, 0.0025)
+    assert_almost_equal(slack, 0.0075)
+    assert_equal((overruns, missed), (3, 5))
+
+
+def test_no_timing_in_telemetry():
+    decoder = TelemetryDecoder()
+    decoder.decode(TelemetryEncoder().encode(
+        [None] * 2, [[None] * 2] * 4, [[None] * 3] * 2,
+        ([None] * 3, [None] * 3, [[None] * 16] * 2, None)))
+    assert_true(all(math.isnan(i) for i in decoder.unpack()["loop_timing"]))
+
+
+def test_summary():
+    scheduler = LoopScheduler(rate=50)
+    assert_equal(str(scheduler), "50 Hz: no cycles")
+    scheduler.wait()
+    scheduler.wait()
+    assert_true(str(scheduler).startswith("50 Hz: 1 cycles"))
@@ -0,0 +1,55 @@
+import time
+
+from nose.tools import assert_equal, assert_false, assert_true
+
+from rpi.watchdog import Watchdog
+
+
+def _watchdog(deadline=0.02):
+    stops = []
+    watchdog = Watchdog(deadline, lambda: stops.append(time.monotonic()))
+    watchdog.start()
+    return watchdog, stops
+
+
+def test_not_armed_until_fed():
+    watchdog, stops = _watchdog()
+    time.sleep(0.05)
+    watchdog.stop()
+    assert_equal(stops, [])
+    assert_false(watchdog.tripped)
+
+
+def test_fed_in_time():
+    watchdog, stops = _watchdog()
+    for _ in range(10):
+        watchdog.feed()
+        time.sleep(0.005)
+    watchdog.stop()
+    assert_equal(stops, [])
+
+
+def test_trips_once_after_deadline():
+    watchdog, stops = _watchdog()
+    watchdog.feed()
+    fed = time.monotonic()
+    time.sleep(0.1)
+    watchdog.stop()
+    assert_true(watchdog.tripped)
+    assert_equal(len(stops), 1)
+    assert_true(0.02 <= stops[0] - fed < 0.05)
+    assert_equal(watchdog.timeouts, 1)
+    assert_equal(len(watchdog.reaction_times), 1)
+    assert_true(0 <= watchdog.reaction_times[0] < 0.03)
+
+
+def test_rearms_when_fed():
+    watchdog, stops = _watchdog()
+    watchdog.feed()
+    time.sleep(0.05)
+    watchdog.feed()
+    assert_false(watchdog.tripped)
+    time.sleep(0.05)
+    watchdog.stop()
+    assert_equal(len(stops), 2)
+    assert_equal(watchdog.timeouts, 2)